@@ -0,0 +1,272 @@
+import argparse
+import os
+import time
+import typing
+
+import numpy
+
+import torch
+import torch.utils.data as torch_data
+
+from mllighting.ml import (
+    cache, constants, dataset, manifest, mixed_precision, network, train)
+
+
+def decode(args: argparse.Namespace):
+    sample_names = manifest.get_sample_names(args.directory)[:args.samples]
+
+    # Decode the same samples with the full and the reduced decode paths.
+    timings = {}
+    for reduced in (False, True):
+        start = time.perf_counter()
+        for name in sample_names:
+            dataset.load_sample(
+                os.path.join(args.directory, name),
+                reduced=reduced)
+        timings[reduced] = (time.perf_counter() - start) / len(sample_names)
+
+    print(f'Full decode: {timings[False] * 1000:.2f} ms per sample')
+    print(f'Reduced decode: {timings[True] * 1000:.2f} ms per sample')
+    print(f'Speedup: {timings[False] / timings[True]:.2f}x')
+
+
+def storage(args: argparse.Namespace):
+    reference = cache.open_cache(args.cache)
+    if cache.get_storage(reference.dtype) != 'float32':
+        raise ValueError(f'{args.cache} does not use the float32 storage')
+
+    # Convert the float32 cache to the compact storage and back.
+    compact = cache.convert_records(reference, 'compact')
+    print(f'float32 storage: {reference.nbytes / 2**20:.1f} MiB')
+    print(f'compact storage: {compact.nbytes / 2**20:.1f} MiB')
+
+    for name in cache.MAP_NAMES:
+        values = numpy.asarray(reference[name])
+        error = numpy.abs(cache.decode_map(compact[name]) - values)
+        bound = cache.get_error_bound(values, compact.dtype[name].base.type)
+        print(
+            f'{name}: max error {error.max():.3g}, '
+            f'within bound {bool((error <= bound).all())}')
+
+
+def precision(args: argparse.Namespace):
+    # Load a fixed set of batches once, so only the model is timed.
+    data = train.load_dataset(args.dataset)
+    loader = torch_data.DataLoader(
+        data,
+        batch_size=constants.BATCH_SIZE,
+        collate_fn=train.get_collate_function(data))
+    batches = []
+    for inputs, targets in loader:
+        batches.append((inputs.clone(), targets.clone()))
+        if len(batches) == args.batches:
+            break
+    sample_count = sum(len(inputs) for inputs, _ in batches)
+
+    # Train the same initial model in each precision.
+    criterion = train.get_loss_function()
+    models = {}
+    for name in mixed_precision.PRECISIONS:
+        torch.manual_seed(0)
+        model = network.CNNModel()
+        optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+
+        start = time.perf_counter()
+        train.train_loop(
+            model,
+            batches,
+            criterion,
+            optimizer,
+            num_epochs=args.epochs,
+            precision=name)
+        duration = time.perf_counter() - start
+        models[name] = model
+
+        start = time.perf_counter()
+        loss = train.evaluate(model, batches, criterion, precision=name)
+        inference_duration = time.perf_counter() - start
+
+        print(
+            f'{name}: train {sample_count * args.epochs / duration:.1f} '
+            f'samples/s, inference {sample_count / inference_duration:.1f} '
+            f'samples/s, loss {loss:.6f}')
+
+    # Compare the predictions of the float32 model in both precisions.
+    model = models['fp32'].eval()
+    errors = []
+    with torch.no_grad():
+        for inputs, _ in batches:
+            reference = model(inputs)
+            with mixed_precision.get_autocast(torch.device('cpu'), 'bf16'):
+                preds = model(inputs).float()
+            errors.append((preds - reference).abs().max())
+    print(f'bf16 inference max error: {max(errors).item():.6f}')
+
+
+def time_calls(function: typing.Callable, count: int) -> float:
+    """Get the median duration of a function call.
+
+    Args:
+        function: The function to time.
+        count: The number of calls.
+
+    Returns:
+        The median duration, in seconds.
+    """
+    durations = []
+    for _ in range(count):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return float(numpy.median(durations))
+
+
+def compilation(args: argparse.Namespace):
+    width, height = constants.IMAGE_SIZE
+    single = torch.randn((1, 12, height, width))
+    batch = torch.randn((constants.BATCH_SIZE, 12, height, width))
+    targets = torch.randn((constants.BATCH_SIZE, 3))
+    criterion = train.get_loss_function()
+
+    for compiled in (False, True):
+        torch.manual_seed(0)
+        model = network.CNNModel()
+
+        # Compile and warm up the inference and training graphs.
+        start = time.perf_counter()
+        inference_model = model
+        training_model = model
+        if compiled:
+            inference_model = network.compile_model(model)
+            training_model = network.compile_model(
+                model, batch_size=constants.BATCH_SIZE, training=True)
+        warmup = time.perf_counter() - start
+
+        inference_model.eval()
+        with torch.no_grad():
+            inference_model(batch)
+            latency = time_calls(
+                lambda: inference_model(single), args.iterations)
+            throughput = constants.BATCH_SIZE / time_calls(
+                lambda: inference_model(batch), args.iterations)
+
+        def train_step():
+            loss = criterion(training_model(batch), targets)
+            loss.backward()
+            model.zero_grad(set_to_none=True)
+
+        training_model.train()
+        training_throughput = constants.BATCH_SIZE / time_calls(
+            train_step, args.iterations)
+
+        name = 'compiled' if compiled else 'eager'
+        print(
+            f'{name}: warmup {warmup:.1f} s, '
+            f'latency {latency * 1000:.3f} ms, '
+            f'inference {throughput:.1f} samples/s, '
+            f'training {training_throughput:.1f} samples/s')
+
+
+def batch(args: argparse.Namespace):
+    width, height = constants.IMAGE_SIZE
+    criterion = train.get_loss_function()
+
+    for batch_size in args.batch_sizes:
+        # Train on the same number of random samples with each batch size.
+        batch_count = max(args.samples // batch_size, 1)
+        batches = [
+            (torch.randn((batch_size, 12, height, width)),
+             torch.randn((batch_size, 3)))
+            for _ in range(batch_count)]
+
+        for accumulation_steps in args.accumulation_steps:
+            for channels_last in (False, True):
+                torch.manual_seed(0)
+                model = network.CNNModel()
+                if channels_last:
+                    model = model.to(memory_format=torch.channels_last)
+                optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+
+                start = time.perf_counter()
+                train.train_loop(
+                    model,
+                    batches,
+                    criterion,
+                    optimizer,
+                    num_epochs=args.epochs,
+                    accumulation_steps=accumulation_steps)
+                duration = time.perf_counter() - start
+
+                memory_format = 'channels_last' if channels_last else 'nchw'
+                sample_count = batch_size * batch_count * args.epochs
+                print(
+                    f'batch {batch_size}, accumulation {accumulation_steps} '
+                    f'(effective {batch_size * accumulation_steps}), '
+                    f'{memory_format}: '
+                    f'{sample_count / duration:.1f} samples/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='ML Lighting benchmark script',
+        description='Benchmark script for the ML Lighting tool')
+    subparsers = parser.add_subparsers(required=True)
+
+    decode_parser = subparsers.add_parser(
+        'decode',
+        help='Compare the full and reduced render maps decoding')
+    decode_parser.add_argument('directory', help='The dataset directory')
+    decode_parser.add_argument(
+        '--samples', type=int, default=100,
+        help='The number of samples to decode')
+    decode_parser.set_defaults(func=decode)
+
+    storage_parser = subparsers.add_parser(
+        'storage',
+        help='Compare the float32 and compact storages of a cache file')
+    storage_parser.add_argument(
+        'cache', help='The cache file using the float32 storage')
+    storage_parser.set_defaults(func=storage)
+
+    precision_parser = subparsers.add_parser(
+        'precision',
+        help='Compare the fp32 and bf16 training and inference')
+    precision_parser.add_argument(
+        'dataset', help='The dataset directory or cache file')
+    precision_parser.add_argument(
+        '--batches', type=int, default=10,
+        help='The number of batches to train on')
+    precision_parser.add_argument(
+        '--epochs', type=int, default=5,
+        help='The number of epochs to train')
+    precision_parser.set_defaults(func=precision)
+
+    compile_parser = subparsers.add_parser(
+        'compile',
+        help='Compare the eager and compiled model speed')
+    compile_parser.add_argument(
+        '--iterations', type=int, default=50,
+        help='The number of timed calls')
+    compile_parser.set_defaults(func=compilation)
+
+    batch_parser = subparsers.add_parser(
+        'batch',
+        help='Compare the training speed of batch sizes, gradient '
+             'accumulation and memory formats')
+    batch_parser.add_argument(
+        '--batch-sizes', type=int, nargs='+', default=[16, 64, 256],
+        help='The batch sizes to train with')
+    batch_parser.add_argument(
+        '--accumulation-steps', type=int, nargs='+', default=[1, 4],
+        help='The gradient accumulation steps to train with')
+    batch_parser.add_argument(
+        '--samples', type=int, default=1024,
+        help='The number of samples of each epoch')
+    batch_parser.add_argument(
+        '--epochs', type=int, default=2,
+        help='The number of epochs to train')
+    batch_parser.set_defaults(func=batch)
+
+    args = parser.parse_args()
+
+    args.func(args)
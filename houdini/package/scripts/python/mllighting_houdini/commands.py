@@ -4,10 +4,8 @@ import hou
 
 from pxr import Gf, Sdf
 
-import torch
-
 from mllighting import log
-from mllighting.ml import inference, network
+from mllighting.communication import client
 
 
 logger = log.LoggerManager.get_logger(__name__)
@@ -17,19 +15,20 @@ def beauty_received(node: hou.OpNode, path: str):
     logger.debug(f'Received the beauty {path}')
 
     render_directory = os.path.dirname(path)
-
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    logger.debug(f'Using device {device}')
-
-    # Load the model.
     checkpoint = node.parm('checkpoint').evalAsString()
-    model = network.load_model(
-        checkpoint=checkpoint,
-        device=device)
 
-    # Predict the values.
-    predicted_lights = inference.run_inference(
-        model, render_directory, device=device)
+    # Predict the values, in the inference server when one is set.
+    server_address = client.get_server_address()
+    if server_address is not None:
+        address, port = server_address
+        logger.debug(f'Running the inference in {address}:{port}')
+        predicted_lights = client.infer(
+            address,
+            port,
+            render_directory=render_directory,
+            checkpoint=checkpoint)
+    else:
+        predicted_lights = run_inference(checkpoint, render_directory)
 
     # Format the infered values.
     # We only predict 3 values, but this can change if we predict more lights
@@ -58,6 +57,30 @@ def beauty_received(node: hou.OpNode, path: str):
     inlineusd_node.parm('usdsource').set(layer_str)
 
 
+def run_inference(checkpoint: str, render_directory: str) -> list[float]:
+    """Run the inference in the Houdini process.
+
+    Torch is only imported when the inference runs in the Houdini process.
+
+    Args:
+        checkpoint: The model checkpoint.
+        render_directory: The directory containing the images.
+
+    Returns:
+        The infered values.
+    """
+    import torch
+
+    from mllighting.ml import inference, registry
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    logger.debug(f'Using device {device}')
+
+    # Get the model, only loaded again when the checkpoint changes.
+    model = registry.get_registry().get(checkpoint, device=device)
+    return inference.run_inference(model, render_directory, device=device)
+
+
 def create_light_layer(light_data: list[dict]) -> Sdf.Layer:
     """Create a light layer from the given light data.
 
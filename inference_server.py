@@ -0,0 +1,70 @@
+import argparse
+import asyncio
+
+import torch
+
+from mllighting.ml import inference_server, mixed_precision, validation
+
+
+def main(args: argparse.Namespace):
+    # Detect the device to use.
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    print(f'Using device {device}')
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    # Read the dataset statistics.
+    statistics = None
+    if args.statistics:
+        statistics = validation.read_report(args.statistics)
+
+    # Load the model and serve the requests until interrupted.
+    server = inference_server.InferenceServer(
+        args.address,
+        args.port,
+        args.checkpoint,
+        device=device,
+        statistics=statistics,
+        precision=args.precision,
+        compiled=args.compile,
+        channels_last=args.channels_last)
+    print(f'Serving {args.checkpoint} on {args.address}:{args.port}')
+    try:
+        asyncio.run(server.start_server())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='ML Lighting inference server',
+        description='Inference server for the ML Lighting tool')
+
+    parser.add_argument('checkpoint', help='The default checkpoint to use')
+    parser.add_argument(
+        '--address', default='127.0.0.1', help='The server address')
+    parser.add_argument(
+        '--port', type=int, default=8003, help='The server port')
+    parser.add_argument(
+        '--threads', type=int,
+        help='The number of torch threads, defaults to the core count')
+    parser.add_argument(
+        '--statistics',
+        help='The scan report the model was trained with, to normalize the '
+             'EXR maps')
+
+    parser.add_argument(
+        '--precision', default='fp32', choices=mixed_precision.PRECISIONS,
+        help='The precision to run the model with, bf16 runs the supported '
+             'operations in bfloat16')
+    parser.add_argument(
+        '--compile', action='store_true',
+        help='Compile the model with torch.compile')
+    parser.add_argument(
+        '--channels-last', action='store_true',
+        help='Run the convolutions in the channels last memory format')
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,106 @@
+import base64
+import json
+import os
+import socket
+
+from mllighting import log
+
+
+logger = log.LoggerManager.get_logger(__name__)
+
+
+# The environment variable set to the "address:port" of the inference server
+# to run the inference in.
+SERVER_ENVIRONMENT_VARIABLE = 'MLLIGHTING_INFERENCE_SERVER'
+
+
+def get_server_address() -> tuple[str, int] | None:
+    """Get the inference server address from the environment.
+
+    Returns:
+        The address and port, None if the variable is not set.
+    """
+    value = os.environ.get(SERVER_ENVIRONMENT_VARIABLE)
+    if not value:
+        return None
+    address, _, port = value.rpartition(':')
+    return address or '127.0.0.1', int(port)
+
+
+def send_request(
+        address: str,
+        port: int,
+        command: str,
+        arguments: dict | None = None,
+        timeout: float = 30.0) -> dict:
+    """Send a command to a server and wait for its response.
+
+    The request is written then the connection is half closed, the server
+    answers once the whole request is read. Only the standard library is
+    used, so the client can run in any application.
+
+    Args:
+        address: The server address.
+        port: The server port.
+        command: The command to execute.
+        arguments: The command arguments.
+        timeout: The time in seconds to wait for the server.
+
+    Returns:
+        The response of the server.
+    """
+    request = json.dumps({'command': command, 'arguments': arguments or {}})
+    logger.debug(f'Sending {command} to {address}:{port}')
+
+    with socket.create_connection((address, port), timeout=timeout) as s:
+        s.sendall(request.encode())
+        s.shutdown(socket.SHUT_WR)
+
+        chunks = []
+        while True:
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+
+    response = json.loads(b''.join(chunks).decode())
+    if 'error' in response:
+        raise RuntimeError(f'{command} failed: {response["error"]}')
+    return response
+
+
+def infer(
+        address: str,
+        port: int,
+        render_directory: str | None = None,
+        payload: dict[str, bytes] | None = None,
+        checkpoint: str | None = None,
+        timeout: float = 30.0) -> list[float]:
+    """Run the inference in an inference server.
+
+    Args:
+        address: The server address.
+        port: The server port.
+        render_directory: The directory containing the render maps, readable
+            by the server.
+        payload: The content of the render map files by file name, sent to
+            the server instead of a render directory.
+        checkpoint: The model checkpoint, readable by the server. Defaults to
+            the checkpoint of the server.
+        timeout: The time in seconds to wait for the server.
+
+    Returns:
+        The infered values.
+    """
+    arguments = {}
+    if render_directory is not None:
+        arguments['render_directory'] = render_directory
+    if payload is not None:
+        arguments['payload'] = {
+            name: base64.b64encode(content).decode('ascii')
+            for name, content in payload.items()}
+    if checkpoint is not None:
+        arguments['checkpoint'] = checkpoint
+
+    response = send_request(address, port, 'infer', arguments, timeout)
+    return response['lights']
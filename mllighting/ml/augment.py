@@ -0,0 +1,177 @@
+import abc
+
+import torch
+
+
+# The beauty channels in the model inputs.
+BEAUTY_CHANNELS = slice(0, 3)
+
+
+class BatchAugmentation(abc.ABC):
+    """Augmentation applied on a collated batch.
+
+    Augmentations draw their random values for the whole batch at once and
+    modify the batch in place with vectorized operations.
+    """
+
+    @abc.abstractmethod
+    def __call__(
+            self,
+            inputs: torch.Tensor,
+            targets: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        """Augment the batch.
+
+        Args:
+            inputs: The (B, 12, H, W) inputs batch.
+            targets: The (B, N) light positions batch.
+
+        Returns:
+            The augmented inputs and targets.
+        """
+        raise NotImplementedError()
+
+
+class Compose(BatchAugmentation):
+    """Apply a list of augmentations one after the other."""
+
+    def __init__(self, augmentations: list[BatchAugmentation]):
+        """Initialize the augmentation.
+
+        Args:
+            augmentations: The augmentations to apply.
+        """
+        self.augmentations = augmentations
+
+    def __call__(
+            self,
+            inputs: torch.Tensor,
+            targets: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        for augmentation in self.augmentations:
+            inputs, targets = augmentation(inputs, targets)
+        return inputs, targets
+
+
+class BeautyGamma(BatchAugmentation):
+    """Randomly apply a gamma on the beauty.
+
+    The beauty is supposed to be drawn by the user.
+    Add variation to the beauty to compress the shadows and lighted areas to
+    simulate harder brush strokes.
+    """
+
+    def __init__(
+            self,
+            probability: float = 0.5,
+            gamma_range: tuple[float, float] = (0.4, 0.8)):
+        """Initialize the augmentation.
+
+        Args:
+            probability: The probability to augment a sample.
+            gamma_range: The range to draw the gamma from.
+        """
+        self.probability = probability
+        self.gamma_range = gamma_range
+
+    def __call__(
+            self,
+            inputs: torch.Tensor,
+            targets: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        mask = get_sample_mask(inputs, self.probability)
+        gamma = torch.empty_like(mask, dtype=inputs.dtype).uniform_(
+            *self.gamma_range)
+
+        beauty = inputs[:, BEAUTY_CHANNELS]
+        augmented = (beauty + 1.0) * 0.5
+        augmented = augmented.clamp_(0.0, 1.0).pow_(gamma)
+        augmented = augmented * 2.0 - 1.0
+        inputs[:, BEAUTY_CHANNELS] = torch.where(mask, augmented, beauty)
+        return inputs, targets
+
+
+class ExposureJitter(BatchAugmentation):
+    """Randomly scale the beauty exposure."""
+
+    def __init__(self, probability: float = 0.5, stops: float = 0.5):
+        """Initialize the augmentation.
+
+        Args:
+            probability: The probability to augment a sample.
+            stops: The maximum exposure change, in stops.
+        """
+        self.probability = probability
+        self.stops = stops
+
+    def __call__(
+            self,
+            inputs: torch.Tensor,
+            targets: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        mask = get_sample_mask(inputs, self.probability)
+        exposure = torch.empty_like(mask, dtype=inputs.dtype).uniform_(
+            -self.stops, self.stops)
+        scale = torch.where(mask, torch.exp2(exposure), 1.0)
+
+        beauty = inputs[:, BEAUTY_CHANNELS]
+        beauty = ((beauty + 1.0) * 0.5 * scale).clamp_(0.0, 1.0)
+        inputs[:, BEAUTY_CHANNELS] = beauty * 2.0 - 1.0
+        return inputs, targets
+
+
+class RandomFlip(BatchAugmentation):
+    """Randomly flip all the render maps horizontally.
+
+    The position and normal maps hold world space values, so the light
+    positions are not changed by the flip.
+    """
+
+    def __init__(self, probability: float = 0.5):
+        """Initialize the augmentation.
+
+        Args:
+            probability: The probability to augment a sample.
+        """
+        self.probability = probability
+
+    def __call__(
+            self,
+            inputs: torch.Tensor,
+            targets: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        mask = get_sample_mask(inputs, self.probability)
+        inputs = torch.where(mask, inputs.flip(-1), inputs)
+        return inputs, targets
+
+
+# The augmentations available by name.
+AUGMENTATIONS = {
+    'gamma': BeautyGamma,
+    'exposure': ExposureJitter,
+    'flip': RandomFlip,
+}
+
+
+def get_sample_mask(inputs: torch.Tensor, probability: float) -> torch.Tensor:
+    """Draw the samples of the batch to augment.
+
+    Args:
+        inputs: The (B, C, H, W) inputs batch.
+        probability: The probability to augment a sample.
+
+    Returns:
+        The (B, 1, 1, 1) boolean mask of the samples to augment.
+    """
+    return torch.rand(
+        (inputs.shape[0], 1, 1, 1), device=inputs.device) < probability
+
+
+def get_augmentation(names: list[str] | None = None) -> Compose:
+    """Get the augmentation to apply on the training batches.
+
+    Args:
+        names: The names of the augmentations to apply, from
+            `AUGMENTATIONS`. Defaults to the beauty gamma only.
+
+    Returns:
+        The augmentation.
+    """
+    if names is None:
+        names = ['gamma']
+    return Compose([AUGMENTATIONS[name]() for name in names])
@@ -0,0 +1,340 @@
+import numpy
+from numpy.lib import format as numpy_format
+
+import torch
+import torch.utils.data as torch_data
+
+from mllighting import log
+from mllighting.ml import constants, dataset
+
+
+logger = log.LoggerManager.get_logger(__name__)
+
+
+# The render maps stored in the cache, in the model input channel order.
+MAP_NAMES = ('beauty', 'albedo', 'normal', 'position')
+
+# The types used to store the render maps.
+# The compact storage keeps the 8 bits PNG values of the beauty and albedo,
+# and stores the normal and position in half precision.
+STORAGE_TYPES = {
+    'float32': {
+        'beauty': numpy.float32,
+        'albedo': numpy.float32,
+        'normal': numpy.float32,
+        'position': numpy.float32,
+    },
+    'compact': {
+        'beauty': numpy.uint8,
+        'albedo': numpy.uint8,
+        'normal': numpy.float16,
+        'position': numpy.float16,
+    },
+}
+
+
+class CachedRenderMapsDataset(torch_data.Dataset):
+    """The render map dataset read from a preprocessed cache file.
+
+    The cache file is created with `preprocess_dataset` and contains the
+    resized render maps with the light positions of every sample. Samples
+    are served straight from the memory mapped file, or from memory.
+    Compact render maps are converted to normalized float32 values when the
+    batch is formed.
+    """
+
+    def __init__(
+            self,
+            filepath: str,
+            storage: str | None = None,
+            in_memory: bool = False):
+        """Initialize the dataset.
+
+        Args:
+            filepath: The cache file created with `preprocess_dataset`.
+            storage: The storage to keep the samples in memory with, from
+                `STORAGE_TYPES`. Defaults to the cache file storage.
+                Requires to load the samples in memory when it differs from
+                the cache file storage.
+            in_memory: Load all the samples in memory instead of mapping
+                the file.
+        """
+        self.filepath = filepath
+        self.in_memory = in_memory
+
+        array = open_cache(filepath)
+        self._length = len(array)
+
+        if storage is not None and storage != get_storage(array.dtype):
+            if not in_memory:
+                raise ValueError(
+                    f'{filepath} uses the {get_storage(array.dtype)} storage, '
+                    f'converting it to {storage} requires to load it in '
+                    'memory')
+            array = convert_records(array, storage)
+        elif in_memory:
+            array = numpy.array(array)
+
+        # The memory mapping is opened lazily so each DataLoader worker maps
+        # the file on its own.
+        self._array = array if in_memory else None
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        if not self.in_memory:
+            state['_array'] = None
+        return state
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: int) -> tuple[torch.Tensor, torch.Tensor]:
+        inputs, targets = self.read_batch([index])
+        return inputs[0], targets[0]
+
+    def __getitems__(
+            self, indices: list[int]) -> tuple[torch.Tensor, torch.Tensor]:
+        return self.read_batch(indices)
+
+    def read_batch(
+            self,
+            indices: list[int],
+            out: torch.Tensor | None = None)\
+            -> tuple[torch.Tensor, torch.Tensor]:
+        """Load a batch of samples.
+
+        The records are copied once, straight from the mapping into the
+        batch tensor. The DataLoader must use `dataset.collate_batch` to not
+        copy it again.
+
+        Args:
+            indices: The indices of the samples to load.
+            out: The (B, 12, H, W) tensor to copy the samples into.
+                Allocated with `dataset.allocate_batch` if not set.
+
+        Returns:
+            The inputs batch and the light positions batch.
+        """
+        if self._array is None:
+            self._array = open_cache(self.filepath)
+
+        if out is None:
+            height, width = self._array.dtype['beauty'].shape[1:]
+            out = dataset.allocate_batch(len(indices), (width, height))
+        targets = numpy.empty(
+            (len(indices), *self._array.dtype['targets'].shape),
+            dtype=numpy.float32)
+
+        # The assignment converts the stored values to float32.
+        out_array = out.numpy()
+        for batch_index, index in enumerate(indices):
+            record = self._array[index]
+            for map_index, name in enumerate(MAP_NAMES):
+                channels = slice(map_index * 3, (map_index + 1) * 3)
+                out_array[batch_index, channels] = record[name]
+            targets[batch_index] = record['targets']
+
+        # Normalize the 8 bits render maps on the whole batch at once.
+        for map_index, name in enumerate(MAP_NAMES):
+            if self._array.dtype[name].base == numpy.uint8:
+                channels = slice(map_index * 3, (map_index + 1) * 3)
+                out[:, channels].mul_(2.0 / 255.0).sub_(1.0)
+
+        return out, torch.from_numpy(targets)
+
+
+def get_record_dtype(
+        map_shape: tuple[int, int, int],
+        target_count: int,
+        storage: str = 'float32') -> numpy.dtype:
+    """Get the structured type of a sample stored in a cache file.
+
+    Args:
+        map_shape: The (channels, height, width) shape of a render map.
+        target_count: The number of values in the light positions.
+        storage: The render maps storage, from `STORAGE_TYPES`.
+
+    Returns:
+        The record type.
+    """
+    types = STORAGE_TYPES[storage]
+    fields = [(name, types[name], map_shape) for name in MAP_NAMES]
+    fields.append(('targets', numpy.float32, (target_count,)))
+    return numpy.dtype(fields)
+
+
+def get_storage(dtype: numpy.dtype) -> str:
+    """Get the render maps storage of a record type.
+
+    Args:
+        dtype: The record type.
+
+    Returns:
+        The storage name, from `STORAGE_TYPES`.
+    """
+    for storage, types in STORAGE_TYPES.items():
+        if all(dtype[name].base == types[name] for name in MAP_NAMES):
+            return storage
+    raise ValueError(f'Unknown render maps storage {dtype}')
+
+
+def encode_map(values: numpy.ndarray, dtype: type) -> numpy.ndarray:
+    """Convert normalized float32 render map values to the storage type.
+
+    Args:
+        values: The normalized float32 values.
+        dtype: The storage type.
+
+    Returns:
+        The stored values.
+    """
+    if dtype == numpy.uint8:
+        # The values come from 8 bits PNG files, the conversion is lossless.
+        values = numpy.rint((values + 1.0) * 127.5)
+        return numpy.clip(values, 0, 255).astype(numpy.uint8)
+
+    encoded = values.astype(dtype)
+    if not numpy.isfinite(encoded).all() and numpy.isfinite(values).all():
+        raise ValueError(
+            f'Render map values out of the {numpy.dtype(dtype)} range, '
+            'use the float32 storage')
+    return encoded
+
+
+def decode_map(values: numpy.ndarray) -> numpy.ndarray:
+    """Convert stored render map values to normalized float32 values.
+
+    Args:
+        values: The stored values.
+
+    Returns:
+        The normalized float32 values.
+    """
+    if values.dtype == numpy.uint8:
+        return values.astype(numpy.float32) * (2.0 / 255.0) - 1.0
+    return values.astype(numpy.float32)
+
+
+def get_error_bound(values: numpy.ndarray, dtype: type) -> numpy.ndarray:
+    """Get the maximum decoding error of render map values stored in a type.
+
+    The 8 bits maps are lossless. Half precision rounding is bounded by 2^-11
+    relative to the value, and 2^-25 for subnormal values.
+
+    Args:
+        values: The normalized float32 values.
+        dtype: The storage type.
+
+    Returns:
+        The error bound of each value.
+    """
+    if dtype == numpy.uint8:
+        return numpy.full_like(values, 1e-6)
+    if dtype == numpy.float16:
+        return numpy.maximum(numpy.abs(values) * 2**-11, 2**-25)
+    return numpy.zeros_like(values)
+
+
+def convert_records(
+        array: numpy.ndarray,
+        storage: str,
+        chunk_size: int = 1024) -> numpy.ndarray:
+    """Convert the records of a cache to another storage in memory.
+
+    Args:
+        array: The records to convert.
+        storage: The storage to convert to, from `STORAGE_TYPES`.
+        chunk_size: The number of records converted at once.
+
+    Returns:
+        The converted records.
+    """
+    dtype = get_record_dtype(
+        array.dtype['beauty'].shape,
+        array.dtype['targets'].shape[0],
+        storage=storage)
+    converted = numpy.empty(len(array), dtype=dtype)
+
+    for start in range(0, len(array), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        for name in MAP_NAMES:
+            converted[name][chunk] = encode_map(
+                decode_map(array[name][chunk]), dtype[name].base.type)
+        converted['targets'][chunk] = array['targets'][chunk]
+
+    return converted
+
+
+def open_cache(filepath: str, mode: str = 'r') -> numpy.memmap:
+    """Memory map a cache file.
+
+    Args:
+        filepath: The cache file created with `preprocess_dataset`.
+        mode: The memory mapping mode.
+
+    Returns:
+        The memory mapped records.
+    """
+    array = numpy.load(filepath, mmap_mode=mode)
+    if array.dtype.names is None or \
+            any(name not in array.dtype.names for name in MAP_NAMES):
+        raise ValueError(f'{filepath} is not a render maps cache file')
+    return array
+
+
+def preprocess_dataset(
+        directory: str,
+        output: str,
+        image_size: tuple[int, int] = constants.IMAGE_SIZE,
+        num_workers: int = 0,
+        storage: str = 'float32',
+        statistics: dict | None = None):
+    """Decode a dataset directory into a single memory mapped cache file.
+
+    The cache file is a NumPy `.npy` file holding one structured record per
+    sample, with the decoded render maps and the light positions.
+
+    Args:
+        directory: The dataset directory.
+        output: The cache file to write.
+        image_size: The size to use for the images.
+        num_workers: The number of processes used to decode the samples.
+        storage: The render maps storage, from `STORAGE_TYPES`. The compact
+            storage is about 3 times smaller than the float32 one.
+        statistics: The report of `validation.scan_dataset`, to skip the
+            invalid samples and store the normalized EXR maps.
+    """
+    source = dataset.RenderMapsDataset(
+        directory, image_size=image_size, statistics=statistics)
+    if len(source) == 0:
+        raise ValueError(f'No sample found in {directory}')
+
+    # Get the record layout from the first sample.
+    image_tensor, light_tensor = source[0]
+    map_shape = (3, *image_tensor.shape[1:])
+    dtype = get_record_dtype(
+        map_shape, light_tensor.numel(), storage=storage)
+
+    logger.debug(f'Writing {len(source)} samples to {output}')
+    array = numpy_format.open_memmap(
+        output, mode='w+', dtype=dtype, shape=(len(source),))
+
+    loader = torch_data.DataLoader(
+        source,
+        batch_size=constants.BATCH_SIZE,
+        num_workers=num_workers,
+        worker_init_fn=dataset.init_worker,
+        collate_fn=dataset.collate_batch)
+
+    start = 0
+    for inputs, targets in loader:
+        end = start + len(inputs)
+        for map_index, name in enumerate(MAP_NAMES):
+            channels = slice(map_index * 3, (map_index + 1) * 3)
+            array[name][start:end] = encode_map(
+                inputs[:, channels].numpy(), dtype[name].base.type)
+        array['targets'][start:end] = targets.numpy()
+        start = end
+
+    array.flush()
+    del array
@@ -0,0 +1,357 @@
+import copy
+import os
+import random
+import threading
+import typing
+
+import numpy
+
+import torch
+import torch.optim.lr_scheduler as torch_lr_scheduler
+import torch.optim.optimizer as torch_optimizer
+from torch import nn as torch_nn
+
+from mllighting import log
+from mllighting.ml import distributed
+
+
+logger = log.LoggerManager.get_logger(__name__)
+
+
+class StateSnapshot:
+    """A copy of a model state dict kept on the CPU.
+
+    The tensors are allocated once and updated in place, so taking a
+    snapshot does not allocate memory or duplicate the module.
+    """
+
+    def __init__(self, model: torch_nn.Module):
+        """Initialize the snapshot.
+
+        Args:
+            model: The model to take snapshots of.
+        """
+        self.state = {
+            name: torch.empty_like(value, device='cpu')
+            for name, value in model.state_dict().items()}
+
+    def update(self, model: torch_nn.Module):
+        """Copy the current state of the model into the snapshot.
+
+        Args:
+            model: The model to copy the state of.
+        """
+        with torch.no_grad():
+            for name, value in model.state_dict().items():
+                self.state[name].copy_(value)
+
+    def load_into(self, model: torch_nn.Module):
+        """Load the snapshot into a model.
+
+        Args:
+            model: The model to load the state into.
+        """
+        model.load_state_dict(self.state)
+
+    def load_state(self, state: dict):
+        """Copy a state dict into the snapshot.
+
+        Args:
+            state: The state dict to copy.
+        """
+        for name, value in state.items():
+            self.state[name].copy_(value)
+
+
+def save_state(state: dict, filepath: str):
+    """Atomically save a state dict.
+
+    Args:
+        state: The state dict to save.
+        filepath: The checkpoint file path.
+    """
+    # Write to a temporary file so an interrupted write never leaves a
+    # truncated checkpoint.
+    torch.save(state, f'{filepath}.tmp')
+    os.replace(f'{filepath}.tmp', filepath)
+
+
+def copy_state(value: typing.Any, out: typing.Any = None) -> typing.Any:
+    """Copy a nested state dict to the CPU.
+
+    The tensors are copied into the tensors of a previous copy when they
+    match, so copying the same state again does not allocate memory.
+
+    Args:
+        value: The state to copy.
+        out: The previous copy of the state, if any.
+
+    Returns:
+        The copy.
+    """
+    if isinstance(value, torch.Tensor):
+        if isinstance(out, torch.Tensor) and out.shape == value.shape \
+                and out.dtype == value.dtype:
+            return out.copy_(value)
+        return value.detach().to(device='cpu', copy=True)
+    if isinstance(value, dict):
+        if not isinstance(out, dict):
+            out = {}
+        return {
+            key: copy_state(item, out.get(key))
+            for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if not isinstance(out, (list, tuple)) or len(out) != len(value):
+            out = [None] * len(value)
+        return type(value)(
+            copy_state(item, previous) for item, previous in zip(value, out))
+    return copy.deepcopy(value)
+
+
+class TrainingStateSnapshot:
+    """A copy of the full state of a training kept on the CPU.
+
+    The model tensors are allocated with the snapshot, like `StateSnapshot`.
+    The optimizer creates its state on its first step, so the other tensors
+    are allocated by the first update. All of them are then updated in
+    place.
+    """
+
+    def __init__(self, model: torch_nn.Module):
+        """Initialize the snapshot.
+
+        Args:
+            model: The model being trained.
+        """
+        self.state = None
+        # The tensors the first update copies into.
+        self._initial_state = {'model': StateSnapshot(model).state}
+
+    def update(
+            self,
+            model: torch_nn.Module,
+            optimizer: torch_optimizer.Optimizer,
+            progress: dict,
+            best_state: StateSnapshot | None,
+            scheduler: torch_lr_scheduler.LRScheduler | None,
+            rng_states: list[dict]):
+        """Copy the current state of the training into the snapshot.
+
+        Args:
+            model: The model being trained.
+            optimizer: The optimizer of the training.
+            progress: The epoch, batch and step counters, and the best score.
+            best_state: The snapshot of the best model, None if there is none
+                yet.
+            scheduler: The learning rate scheduler of the training, if any.
+            rng_states: The random generator states of all the processes.
+        """
+        previous = self.state or self._initial_state
+        self.state = copy_state({
+            'version': 1,
+            'model': model.state_dict(),
+            'optimizer': optimizer.state_dict(),
+            'progress': progress,
+            'best_model': None if best_state is None else best_state.state,
+            'scheduler': None if scheduler is None
+            else scheduler.state_dict(),
+            'rng': rng_states,
+        }, previous)
+
+
+class CheckpointWriter:
+    """Write the model checkpoints from a background thread.
+
+    The state is copied into one of two preallocated snapshots, and the
+    writer thread saves it while training goes on. When a checkpoint is
+    submitted while the previous one is still being written, it replaces
+    any checkpoint waiting to be written, so only the latest one is saved.
+    """
+
+    # The type of the snapshots of the submitted states.
+    snapshot_type = StateSnapshot
+
+    def __init__(self, model: torch_nn.Module, filepath: str):
+        """Initialize the writer and start its thread.
+
+        Args:
+            model: The model to write the checkpoints of.
+            filepath: The checkpoint file path.
+        """
+        self.filepath = filepath
+
+        self._snapshots = [
+            self.snapshot_type(model), self.snapshot_type(model)]
+        self._condition = threading.Condition()
+        # The index of the snapshot waiting to be written and of the one
+        # being written.
+        self._pending = None
+        self._writing = None
+        self._closed = False
+        self._error = None
+
+        self._thread = threading.Thread(
+            target=self._run, name='CheckpointWriter', daemon=True)
+        self._thread.start()
+
+    def __enter__(self) -> 'CheckpointWriter':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def submit(self, model: torch_nn.Module):
+        """Snapshot the model state and queue it to be written.
+
+        Args:
+            model: The model to write the checkpoint of.
+        """
+        self._submit(model)
+
+    def _submit(self, *args):
+        """Update a snapshot and queue it to be written.
+
+        Args:
+            args: The arguments of the snapshot update.
+        """
+        with self._condition:
+            self._raise_error()
+            # Use the snapshot that is not being written.
+            index = 1 if self._writing == 0 else 0
+            self._snapshots[index].update(*args)
+            self._pending = index
+            self._condition.notify_all()
+
+    def flush(self):
+        """Wait until the submitted checkpoints are written."""
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._pending is None and self._writing is None)
+            self._raise_error()
+
+    def close(self):
+        """Write the submitted checkpoints and stop the thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        """Raise the error of the last failed write."""
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        """Write the queued checkpoints until the writer is closed."""
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._pending is not None or self._closed)
+                if self._pending is None:
+                    return
+                self._writing, self._pending = self._pending, None
+
+            try:
+                save_state(self._snapshots[self._writing].state, self.filepath)
+                logger.debug(f'Checkpoint written to {self.filepath}')
+            except Exception as e:
+                self._error = e
+
+            with self._condition:
+                self._writing = None
+                self._condition.notify_all()
+
+
+def get_rng_state() -> dict:
+    """Get the state of the random generators of the process.
+
+    Returns:
+        The torch, NumPy and Python random generator states.
+    """
+    name, keys, position, has_gauss, cached_gaussian = \
+        numpy.random.get_state()
+    state = {
+        'torch': torch.get_rng_state(),
+        'numpy': {
+            'name': name,
+            'keys': torch.from_numpy(keys.astype(numpy.int64)),
+            'position': position,
+            'has_gauss': has_gauss,
+            'cached_gaussian': cached_gaussian,
+        },
+        'python': random.getstate(),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state: dict):
+    """Restore the state of the random generators of the process.
+
+    Args:
+        state: The state from `get_rng_state`.
+    """
+    torch.set_rng_state(state['torch'])
+    numpy_state = state['numpy']
+    numpy.random.set_state((
+        numpy_state['name'],
+        numpy_state['keys'].numpy().astype(numpy.uint32),
+        numpy_state['position'],
+        numpy_state['has_gauss'],
+        numpy_state['cached_gaussian']))
+    random.setstate(state['python'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+class TrainingStateWriter(CheckpointWriter):
+    """Write the full training states from a background thread, to resume
+    the training.
+
+    In a distributed training, the writer is created by all the processes,
+    which must all submit the states to gather their random generator
+    states. Only the rank 0 process copies and writes the states.
+    """
+
+    snapshot_type = TrainingStateSnapshot
+
+    def submit(
+            self,
+            model: torch_nn.Module,
+            optimizer: torch_optimizer.Optimizer,
+            progress: dict,
+            best_state: StateSnapshot | None,
+            scheduler: torch_lr_scheduler.LRScheduler | None = None):
+        """Snapshot the training state and queue it to be written.
+
+        Args:
+            model: The model being trained.
+            optimizer: The optimizer of the training.
+            progress: The epoch, batch and step counters, and the best score.
+            best_state: The snapshot of the best model, None if there is none
+                yet.
+            scheduler: The learning rate scheduler of the training, if any.
+        """
+        rng_states = distributed.all_gather_object(get_rng_state())
+        if not distributed.is_main_process():
+            return
+        self._submit(
+            model, optimizer, progress, best_state, scheduler, rng_states)
+
+
+def load_training_state(filepath: str) -> dict:
+    """Load a training state written by a `TrainingStateWriter`.
+
+    The tensors are loaded on the CPU, loading the model and optimizer
+    states moves them to the device of the parameters.
+
+    Args:
+        filepath: The training state file path.
+
+    Returns:
+        The training state.
+    """
+    return torch.load(filepath, weights_only=True, map_location='cpu')
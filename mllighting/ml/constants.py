@@ -1,3 +1,6 @@
 IMAGE_SIZE = (128, 128)
 BATCH_SIZE = 64
+EVALUATION_BATCH_SIZE = 256
 EPOCH_COUNT = 100
+SAMPLE_FILENAMES = (
+    'albedo.png', 'beauty.png', 'normal.exr', 'position.exr', 'light.json')
@@ -8,11 +8,20 @@ import OpenImageIO
 from PIL import Image
 
 import torch
+import torch.nn.functional as torch_functional
 import torch.utils.data as torch_data
 
 import torchvision.transforms as transforms
 
-from mllighting.ml import constants
+from mllighting.ml import constants, manifest, targets
+
+
+# The EXR render maps channels in the model inputs, normalized from the
+# dataset statistics.
+EXR_MAP_CHANNELS = {
+    'normal': slice(6, 9),
+    'position': slice(9, 12),
+}
 
 
 class RenderMapsDataset(torch_data.Dataset):
@@ -30,7 +39,9 @@ class RenderMapsDataset(torch_data.Dataset):
           |- light.json
     ```
 
-    with the sample index starting at 0.
+    with the sample index starting at 0. When the dataset directory contains a
+    manifest created with `manifest.update_manifest`, the samples listed in
+    the manifest are used instead, with any sample names.
 
     The light json contains the lights information to train the model with.
 
@@ -46,78 +57,305 @@ class RenderMapsDataset(torch_data.Dataset):
     def __init__(
             self,
             directory: str,
-            image_size: tuple[int, int] = constants.IMAGE_SIZE):
+            image_size: tuple[int, int] = constants.IMAGE_SIZE,
+            reduced: bool = True,
+            pin_memory: bool = False,
+            statistics: dict | None = None):
         """Initialize the dataset.
 
         Args:
             directory: The dataset directory.
             image_size: The image size to work with.
+            reduced: Decode the render maps close to the image size when the
+                files allow it.
+            pin_memory: Allocate the batches loaded in the main process in
+                pinned memory.
+            statistics: The report of `validation.scan_dataset`. The invalid
+                samples are skipped and the EXR maps are normalized.
         """
         self.image_size = image_size
         self.directory = directory
-        self.transform = get_transform(image_size=image_size)
+        self.reduced = reduced
+        self.pin_memory = pin_memory
+        self.samples = manifest.get_sample_names(directory)
+
+        self.normalization = None
+        if statistics is not None:
+            invalid = set(statistics['errors'])
+            self.samples = [
+                name for name in self.samples if name not in invalid]
+            self.normalization = get_normalization(statistics)
+
+        # Read the light positions from the compiled target table when the
+        # dataset has one, the samples missing from it or changed since it
+        # was built use their json file. The table is checked once here.
+        self.target_table = None
+        if targets.has_targets(directory):
+            self.target_table = targets.TargetTable(directory)
 
     def __len__(self) -> int:
-        # Get the number of directory in the dataset directory.
-        count = len(
-            [item for item in os.listdir(self.directory)
-             if os.path.isdir(os.path.join(self.directory, item))])
-        return count
-
-    def __getitem__(self, index: int) -> dict:
-        sample_directory = os.path.join(self.directory, str(index))
-
-        # Load the render maps.
-        albedo = Image.open(
-            os.path.join(
-                sample_directory,
-                'albedo.png')).convert('RGB')
-        beauty = Image.open(
-            os.path.join(
-                sample_directory,
-                'beauty.png')).convert('RGB')
-        normal = read_exr_as_tensor(
-            os.path.join(sample_directory, 'normal.exr'),
-            image_size=self.image_size)
-        position = read_exr_as_tensor(
-            os.path.join(sample_directory, 'position.exr'),
-            image_size=self.image_size)
-
-        # Apply transforms on the render maps.
-        albedo = self.transform(albedo)
-        beauty = self.transform(beauty)
-
-        # The beauty is supposed to be drawn by the user.
-        # Add variation to the beauty to compress the shadows and lighted
-        # areas to simulate harder brush strokes.
-        if torch.rand(1).item() < 0.5:
-            gamma = torch.empty(1).uniform_(0.4, 0.8).item()
-            beauty = (beauty + 1.0) * 0.5
-            beauty = torch.clamp(beauty, 0.0, 1.0)
-            beauty = beauty.pow(gamma)
-            beauty = beauty * 2.0 - 1.0
-
-        # Concatenate into a single tensor.
-        image_tensor = torch.cat([
-            beauty, albedo, normal, position
-        ], dim=0)
-
-        # Load light positions from the json file.
-        light_filepath = os.path.join(sample_directory, 'light.json')
-        with open(light_filepath, 'r') as f:
-            lights_data = json.load(f)
-
-        # Extract light positions as a tensor.
-        lights_transforms = []
-        for light_dict in lights_data:
-            matrix = light_dict['matrix']
-            lights_transforms.extend(
-                [matrix[12], matrix[13], matrix[14]])
-
-        light_tensor = torch.tensor(
-            lights_transforms, dtype=torch.float32)
-
-        return image_tensor, light_tensor
+        return len(self.samples)
+
+    def __getitem__(self, index: int) -> tuple[torch.Tensor, torch.Tensor]:
+        image_tensor = torch.empty(
+            (12, self.image_size[1], self.image_size[0]))
+        read_maps_into(
+            self.get_sample_directory(index),
+            image_tensor,
+            reduced=self.reduced)
+        if self.normalization is not None:
+            normalize_maps(image_tensor, self.normalization)
+        return image_tensor, self.get_light_positions(index)
+
+    def __getitems__(
+            self, indices: list[int]) -> tuple[torch.Tensor, torch.Tensor]:
+        return self.read_batch(indices)
+
+    def get_sample_directory(self, index: int) -> str:
+        """Get the directory of a sample.
+
+        Args:
+            index: The sample index.
+
+        Returns:
+            The sample directory.
+        """
+        return os.path.join(self.directory, self.samples[index])
+
+    def get_light_positions(self, index: int) -> torch.Tensor:
+        """Get the light positions of a sample.
+
+        Args:
+            index: The sample index.
+
+        Returns:
+            The light positions tensor.
+        """
+        if self.target_table is not None:
+            row = self.target_table.rows.get(self.samples[index])
+            if row is not None:
+                return self.target_table.get_light_positions(row)
+        return read_light_positions(
+            os.path.join(self.get_sample_directory(index), 'light.json'))
+
+    def read_batch(
+            self,
+            indices: list[int],
+            out: torch.Tensor | None = None)\
+            -> tuple[torch.Tensor, torch.Tensor]:
+        """Load a batch of samples.
+
+        The render maps are decoded straight into the batch tensor, the
+        DataLoader must use `collate_batch` to not copy it again.
+
+        Args:
+            indices: The indices of the samples to load.
+            out: The (B, 12, H, W) tensor to decode the samples into.
+                Allocated with `allocate_batch` if not set.
+
+        Returns:
+            The inputs batch and the light positions batch.
+        """
+        if out is None:
+            out = allocate_batch(
+                len(indices), self.image_size, pin_memory=self.pin_memory)
+
+        light_tensors = []
+        for batch_index, index in enumerate(indices):
+            read_maps_into(
+                self.get_sample_directory(index),
+                out[batch_index],
+                reduced=self.reduced)
+            light_tensors.append(self.get_light_positions(index))
+
+        if self.normalization is not None:
+            normalize_maps(out, self.normalization)
+
+        return out, torch.stack(light_tensors)
+
+
+def collate_batch(
+        batch: tuple[torch.Tensor, torch.Tensor])\
+        -> tuple[torch.Tensor, torch.Tensor]:
+    """Collate function of the datasets loading whole batches.
+
+    The batch is already formed by the dataset `__getitems__` method.
+
+    Args:
+        batch: The inputs batch and the light positions batch.
+
+    Returns:
+        The batch unchanged.
+    """
+    return batch
+
+
+def allocate_batch(
+        batch_size: int,
+        image_size: tuple[int, int] = constants.IMAGE_SIZE,
+        pin_memory: bool = False) -> torch.Tensor:
+    """Allocate a tensor to decode a batch of samples into.
+
+    Args:
+        batch_size: The number of samples in the batch.
+        image_size: The size of the images.
+        pin_memory: Allocate the tensor in pinned memory when not in a
+            DataLoader worker.
+
+    Returns:
+        The uninitialized (B, 12, H, W) tensor.
+    """
+    shape = (batch_size, 12, image_size[1], image_size[0])
+
+    # Tensors are sent from the DataLoader workers to the main process
+    # through shared memory, allocating them there avoids a copy.
+    if torch_data.get_worker_info() is not None:
+        return torch.empty(shape).share_memory_()
+    if pin_memory and torch.cuda.is_available():
+        return torch.empty(shape, pin_memory=True)
+    return torch.empty(shape)
+
+
+def get_normalization(statistics: dict) -> tuple[torch.Tensor, torch.Tensor]:
+    """Get the per channel normalization of the render maps.
+
+    The beauty and albedo are already in [-1, 1], only the EXR maps are
+    normalized from their statistics.
+
+    Args:
+        statistics: The report of `validation.scan_dataset`.
+
+    Returns:
+        The (12, 1, 1) mean and std tensors.
+    """
+    mean = torch.zeros((12, 1, 1))
+    std = torch.ones((12, 1, 1))
+    for name, channels in EXR_MAP_CHANNELS.items():
+        map_statistics = statistics['channels'].get(name)
+        if map_statistics is None:
+            continue
+        mean[channels, 0, 0] = torch.tensor(map_statistics['mean'])
+        std[channels, 0, 0] = torch.tensor(
+            map_statistics['std']).clamp(min=1e-6)
+    return mean, std
+
+
+def normalize_maps(
+        image_tensor: torch.Tensor,
+        normalization: tuple[torch.Tensor, torch.Tensor]) -> torch.Tensor:
+    """Normalize the render maps in place.
+
+    Args:
+        image_tensor: The (12, H, W) or (B, 12, H, W) render maps.
+        normalization: The mean and std from `get_normalization`.
+
+    Returns:
+        The normalized render maps.
+    """
+    mean, std = normalization
+    return image_tensor.sub_(mean).div_(std)
+
+
+def load_sample(
+        sample_directory: str,
+        image_size: tuple[int, int] = constants.IMAGE_SIZE,
+        reduced: bool = True) -> tuple[torch.Tensor, torch.Tensor]:
+    """Load a sample.
+
+    Args:
+        sample_directory: The directory containing the sample files.
+        image_size: The size to use for the images.
+        reduced: Decode the render maps close to the target size when the
+            files allow it.
+
+    Returns:
+        The 12 channels image tensor and the light positions tensor.
+    """
+    image_tensor = torch.empty((12, image_size[1], image_size[0]))
+    light_tensor = read_sample_into(
+        sample_directory, image_tensor, reduced=reduced)
+    return image_tensor, light_tensor
+
+
+def read_sample_into(
+        sample_directory: str,
+        out: torch.Tensor,
+        reduced: bool = True) -> torch.Tensor:
+    """Decode a sample into an existing tensor.
+
+    Args:
+        sample_directory: The directory containing the sample files.
+        out: The (12, H, W) tensor to decode the render maps into.
+        reduced: Decode the render maps close to the target size when the
+            files allow it.
+
+    Returns:
+        The light positions tensor.
+    """
+    read_maps_into(sample_directory, out, reduced=reduced)
+    return read_light_positions(
+        os.path.join(sample_directory, 'light.json'))
+
+
+def read_maps_into(
+        directory: str,
+        out: torch.Tensor,
+        reduced: bool = True):
+    """Decode the render maps of a directory into an existing tensor.
+
+    The render maps are stored in the beauty, albedo, normal and position
+    order, each one written straight into its channels of the tensor.
+
+    Args:
+        directory: The directory containing the render maps.
+        out: The (12, H, W) tensor to decode the render maps into.
+        reduced: Decode the render maps close to the target size when the
+            files allow it.
+    """
+    read_png_into(
+        os.path.join(directory, 'beauty.png'), out[0:3], reduced=reduced)
+    read_png_into(
+        os.path.join(directory, 'albedo.png'), out[3:6], reduced=reduced)
+    read_exr_into(
+        os.path.join(directory, 'normal.exr'), out[6:9], reduced=reduced)
+    read_exr_into(
+        os.path.join(directory, 'position.exr'), out[9:12], reduced=reduced)
+
+
+def read_light_positions(filepath: str) -> torch.Tensor:
+    """Read the light positions from a light json file.
+
+    Args:
+        filepath: The light json file path.
+
+    Returns:
+        The light positions tensor.
+    """
+    with open(filepath, 'r') as f:
+        lights_data = json.load(f)
+
+    # Extract light positions as a tensor.
+    lights_transforms = []
+    for light_dict in lights_data:
+        matrix = light_dict['matrix']
+        lights_transforms.extend(
+            [matrix[12], matrix[13], matrix[14]])
+
+    return torch.tensor(lights_transforms, dtype=torch.float32)
+
+
+def init_worker(worker_id: int):
+    """Configure a DataLoader worker process.
+
+    Workers decode samples in parallel, so OpenImageIO and torch are limited
+    to a single thread in each worker to not oversubscribe the cores.
+
+    Args:
+        worker_id: The worker index.
+    """
+    torch.set_num_threads(1)
+    OpenImageIO.attribute('threads', 1)
+    OpenImageIO.attribute('exr_threads', 1)
 
 
 def get_transform(
@@ -138,20 +376,133 @@ def get_transform(
     ])
 
 
+def read_png(
+        filepath: str,
+        image_size: tuple[int, int] = constants.IMAGE_SIZE,
+        reduced: bool = True) -> Image.Image:
+    """Read a PNG file as an RGB image.
+
+    Args:
+        filepath: The PNG file path.
+        image_size: The size the image will be resized to.
+        reduced: Reduce the image close to the target size while decoding,
+            to make the resize cheaper.
+
+    Returns:
+        The image.
+    """
+    image = Image.open(filepath)
+    if not reduced:
+        return image.convert('RGB')
+
+    # Let the decoders supporting it decode at a lower resolution.
+    image.draft('RGB', image_size)
+    image = image.convert('RGB')
+
+    # Box reduce the image while keeping it at least twice as large as the
+    # target size, so the resize keeps the same quality.
+    factor = min(
+        image.width // image_size[0], image.height // image_size[1]) // 2
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image
+
+
+def read_png_into(filepath: str, out: torch.Tensor, reduced: bool = True):
+    """Read, resize and normalize a PNG file into an existing tensor.
+
+    The result matches the `get_transform` transform.
+
+    Args:
+        filepath: The PNG file path.
+        out: The (3, H, W) float tensor to write the image into.
+        reduced: Reduce the image close to the target size while decoding.
+    """
+    height, width = out.shape[1:]
+    image = read_png(filepath, image_size=(width, height), reduced=reduced)
+    image = image.resize((width, height), Image.BILINEAR)
+
+    # Convert and normalize the pixels straight into the tensor memory.
+    pixels = numpy.asarray(image).transpose(2, 0, 1)
+    out_array = out.numpy()
+    numpy.multiply(pixels, 2.0 / 255.0, out=out_array, casting='unsafe')
+    out_array -= 1.0
+
+
 def read_exr_as_tensor(
         filepath: str,
-        image_size: tuple[int, int] = constants.IMAGE_SIZE) -> torch.Tensor:
+        image_size: tuple[int, int] = constants.IMAGE_SIZE,
+        reduced: bool = True) -> torch.Tensor:
     """Read and resze an EXR file and return a torch tensor.
 
     Args:
         filepath: The EXR file path.
         image_size: The size used to resize the EXR.
+        reduced: Only read the pixels needed for the target size when the
+            file allows it, see `read_reduced_exr_pixels`.
 
     Returns:
         The tensor.
     """
-    # Load the exr file.
-    src_buf = OpenImageIO.ImageBuf(filepath)
+    pixels = read_resized_exr_pixels(
+        filepath, image_size=image_size, reduced=reduced)
+    # Convert the data to tensor and match the order from PIL.
+    tensor = torch.from_numpy(pixels).permute(2, 0, 1).float()
+    return tensor
+
+
+def read_exr_into(filepath: str, out: torch.Tensor, reduced: bool = True):
+    """Read and resize the first channels of an EXR file into an existing
+    tensor.
+
+    Args:
+        filepath: The EXR file path.
+        out: The (C, H, W) float tensor to write the image into.
+        reduced: Only read the pixels needed for the target size when the
+            file allows it, see `read_reduced_exr_pixels`.
+    """
+    channels, height, width = out.shape
+    pixels = read_resized_exr_pixels(
+        filepath, image_size=(width, height), reduced=reduced)
+    out.numpy()[...] = pixels[..., :channels].transpose(2, 0, 1)
+
+
+def read_resized_exr_pixels(
+        filepath: str,
+        image_size: tuple[int, int] = constants.IMAGE_SIZE,
+        reduced: bool = True) -> numpy.ndarray:
+    """Read and resize the pixels of an EXR file.
+
+    Args:
+        filepath: The EXR file path.
+        image_size: The size used to resize the EXR.
+        reduced: Only read the pixels needed for the target size when the
+            file allows it, see `read_reduced_exr_pixels`.
+
+    Returns:
+        The (height, width, channels) pixels.
+    """
+    # Read the exr file directly instead of going through the shared image
+    # cache, which would keep file handles open across the DataLoader worker
+    # processes.
+    image_input = OpenImageIO.ImageInput.open(filepath)
+    if image_input is None:
+        raise OSError(f'Could not open {filepath}: {OpenImageIO.geterror()}')
+    try:
+        pixels = None
+        if reduced:
+            pixels = read_reduced_exr_pixels(image_input, image_size)
+        if pixels is None:
+            pixels = image_input.read_image(OpenImageIO.FLOAT)
+        if pixels is None:
+            raise OSError(
+                f'Could not read {filepath}: {image_input.geterror()}')
+    finally:
+        image_input.close()
+
+    if reduced:
+        pixels = box_reduce(pixels, image_size)
+    src_buf = OpenImageIO.ImageBuf(pixels)
     spec = src_buf.spec()
 
     # Create a destination buffer with the same properties than the source
@@ -161,8 +512,62 @@ def read_exr_as_tensor(
             image_size[0], image_size[1], spec.nchannels, OpenImageIO.FLOAT))
     OpenImageIO.ImageBufAlgo.resize(dst_buf, src_buf)
     data = dst_buf.get_pixels(OpenImageIO.FLOAT)
-    data = numpy.asarray(data).reshape(
+    return numpy.asarray(data).reshape(
         image_size[1], image_size[0], spec.nchannels)
-    # Convert the data to tensor and match the order from PIL.
-    tensor = torch.from_numpy(data).permute(2, 0, 1).float()
-    return tensor
+
+
+def box_reduce(
+        pixels: numpy.ndarray,
+        image_size: tuple[int, int]) -> numpy.ndarray:
+    """Average the pixels by blocks while keeping them at least twice as large
+    as the target size, so the following resize keeps the same quality.
+
+    Args:
+        pixels: The (height, width, channels) pixels.
+        image_size: The target size.
+
+    Returns:
+        The reduced pixels.
+    """
+    height, width = pixels.shape[:2]
+    factor = min(width // image_size[0], height // image_size[1]) // 2
+    if factor < 2:
+        return pixels
+
+    tensor = torch.from_numpy(pixels).permute(2, 0, 1)
+    tensor = torch_functional.avg_pool2d(tensor, factor)
+    return tensor.permute(1, 2, 0).contiguous().numpy()
+
+
+def read_reduced_exr_pixels(
+        image_input: OpenImageIO.ImageInput,
+        image_size: tuple[int, int]) -> numpy.ndarray | None:
+    """Read only the pixels of an EXR file needed for the target size.
+
+    Mipmapped files are read from the smallest MIP level still larger than
+    the target size. Other files are read in full and box reduced by the
+    caller, skipping scanlines or pixels would alias the noisy render maps.
+
+    Args:
+        image_input: The opened EXR file.
+        image_size: The target size.
+
+    Returns:
+        The (height, width, channels) pixels, None if the file does not
+        allow a reduced read.
+    """
+    spec = image_input.spec()
+    width, height = image_size
+
+    # Find the smallest MIP level still larger than the target size.
+    miplevel = 0
+    while image_input.seek_subimage(0, miplevel + 1):
+        level_spec = image_input.spec()
+        if level_spec.width < width or level_spec.height < height:
+            break
+        miplevel += 1
+    image_input.seek_subimage(0, 0)
+    if miplevel == 0:
+        return None
+    return image_input.read_image(
+        0, miplevel, 0, spec.nchannels, OpenImageIO.FLOAT)
@@ -0,0 +1,198 @@
+import os
+import socket
+import typing
+
+import torch
+import torch.distributed as torch_distributed
+import torch.multiprocessing as torch_multiprocessing
+
+from mllighting import log
+
+
+logger = log.LoggerManager.get_logger(__name__)
+
+
+def is_distributed() -> bool:
+    """Check if the process is part of a distributed training.
+
+    Returns:
+        True if the process group is initialized.
+    """
+    return torch_distributed.is_available() and \
+        torch_distributed.is_initialized()
+
+
+def get_rank() -> int:
+    """Get the rank of the process in the distributed training.
+
+    Returns:
+        The rank, 0 when not distributed.
+    """
+    if not is_distributed():
+        return 0
+    return torch_distributed.get_rank()
+
+
+def get_world_size() -> int:
+    """Get the number of processes of the distributed training.
+
+    Returns:
+        The number of processes, 1 when not distributed.
+    """
+    if not is_distributed():
+        return 1
+    return torch_distributed.get_world_size()
+
+
+def get_local_rank() -> int:
+    """Get the rank of the process on its machine.
+
+    Returns:
+        The local rank, 0 when not distributed.
+    """
+    return int(os.environ.get('LOCAL_RANK', 0))
+
+
+def get_local_world_size() -> int:
+    """Get the number of processes of the distributed training on the
+    machine.
+
+    Returns:
+        The number of local processes, 1 when not distributed.
+    """
+    return int(os.environ.get('LOCAL_WORLD_SIZE', 1))
+
+
+def is_main_process() -> bool:
+    """Check if the process is the one reporting and writing checkpoints.
+
+    Returns:
+        True for the rank 0 process, or when not distributed.
+    """
+    return get_rank() == 0
+
+
+def all_reduce_sum(tensor: torch.Tensor) -> torch.Tensor:
+    """Sum a tensor over all the processes, in place.
+
+    Args:
+        tensor: The tensor to sum.
+
+    Returns:
+        The summed tensor, the tensor itself when not distributed.
+    """
+    if is_distributed():
+        torch_distributed.all_reduce(tensor, op=torch_distributed.ReduceOp.SUM)
+    return tensor
+
+
+def all_reduce_mean(tensor: torch.Tensor) -> torch.Tensor:
+    """Average a tensor over all the processes, in place.
+
+    Args:
+        tensor: The tensor to average.
+
+    Returns:
+        The averaged tensor, the tensor itself when not distributed.
+    """
+    return all_reduce_sum(tensor).div_(get_world_size())
+
+
+def all_gather_object(value: typing.Any) -> list:
+    """Gather a picklable object from all the processes.
+
+    Args:
+        value: The object of the process.
+
+    Returns:
+        The objects of all the processes, ordered by rank.
+    """
+    if not is_distributed():
+        return [value]
+    values = [None] * get_world_size()
+    torch_distributed.all_gather_object(values, value)
+    return values
+
+
+def is_launched() -> bool:
+    """Check if the process was started by a distributed launcher.
+
+    `torchrun` sets the environment variables of the process group, so the
+    process can join it.
+
+    Returns:
+        True if the process is one of several launched processes.
+    """
+    return int(os.environ.get('WORLD_SIZE', 1)) > 1
+
+
+def get_free_port() -> int:
+    """Get a free TCP port on the local machine.
+
+    Returns:
+        The port.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _run_process(
+        local_rank: int,
+        process_count: int,
+        function: typing.Callable,
+        args: tuple):
+    """Run a function in a process spawned by `launch`.
+
+    Args:
+        local_rank: The rank of the process.
+        process_count: The number of processes.
+        function: The function to run.
+        args: The function arguments.
+    """
+    os.environ['RANK'] = str(local_rank)
+    os.environ['LOCAL_RANK'] = str(local_rank)
+    os.environ['WORLD_SIZE'] = str(process_count)
+    os.environ['LOCAL_WORLD_SIZE'] = str(process_count)
+    _run_distributed(function, args)
+
+
+def _run_distributed(function: typing.Callable, args: tuple):
+    """Run a function in the process group described by the environment.
+
+    Args:
+        function: The function to run.
+        args: The function arguments.
+    """
+    torch_distributed.init_process_group(backend='gloo')
+    logger.debug(f'Joined the process group as rank {get_rank()}')
+    try:
+        function(*args)
+    finally:
+        torch_distributed.destroy_process_group()
+
+
+def launch(function: typing.Callable, process_count: int, *args):
+    """Run a function in a distributed process group with the gloo backend.
+
+    With several processes, the processes are spawned on the local machine.
+    Otherwise, a process started by `torchrun`, possibly on several
+    machines, joins the process group of its launcher. A single process not
+    launched by `torchrun` runs the function directly.
+
+    Args:
+        function: The function to run, must be picklable.
+        process_count: The number of local processes to spawn.
+        args: The function arguments.
+    """
+    if process_count > 1:
+        os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+        os.environ.setdefault('MASTER_PORT', str(get_free_port()))
+        torch_multiprocessing.spawn(
+            _run_process,
+            args=(process_count, function, args),
+            nprocs=process_count)
+    elif is_launched():
+        _run_distributed(function, args)
+    else:
+        function(*args)
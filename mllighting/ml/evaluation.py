@@ -0,0 +1,229 @@
+import copy
+
+import numpy
+import numpy.lib.format as numpy_format
+
+import torch
+import torch.func as torch_func
+import torch.utils.data as torch_data
+from torch import nn as torch_nn
+
+from mllighting.ml import mixed_precision, network
+
+
+# The record of each evaluated sample in a results file, in the dataset
+# order.
+RESULT_DTYPE = numpy.dtype([
+    ('prediction', numpy.float32, (3,)),
+    ('target', numpy.float32, (3,)),
+    ('distance', numpy.float32),
+    ('loss', numpy.float32),
+])
+
+
+class ResultsWriter:
+    """Stream the per sample errors of an evaluation to a results file.
+
+    The results file is a NumPy `.npy` file holding one `RESULT_DTYPE`
+    record per sample, written batch by batch through a memory mapping, so
+    the results of large test sets are never held in memory.
+    """
+
+    def __init__(self, filepath: str, sample_count: int):
+        """Create the results file.
+
+        Args:
+            filepath: The results file to write.
+            sample_count: The number of evaluated samples.
+        """
+        self.filepath = filepath
+        self.records = numpy_format.open_memmap(
+            filepath, mode='w+', dtype=RESULT_DTYPE, shape=(sample_count,))
+        self.count = 0
+
+    def __enter__(self) -> 'ResultsWriter':
+        return self
+
+    def __exit__(self, exception_type, *args):
+        # Do not hide the error that stopped the evaluation.
+        if exception_type is None:
+            self.close()
+
+    def write(self, preds: torch.Tensor, targets: torch.Tensor):
+        """Write the errors of a batch.
+
+        Args:
+            preds: The (B, 3) predicted light positions.
+            targets: The (B, 3) light positions.
+        """
+        end = self.count + len(preds)
+        if end > len(self.records):
+            raise ValueError(
+                f'{self.filepath} holds {len(self.records)} samples, got '
+                f'{end}')
+
+        preds = preds.detach().float()
+        targets = targets.detach().float()
+        differences = preds - targets
+        errors = torch.stack([
+            torch.linalg.vector_norm(differences, dim=1),
+            differences.square().mean(dim=1)], dim=1)
+
+        # Read the batch back from the device at once.
+        records = self.records[self.count:end]
+        records['prediction'] = preds.cpu().numpy()
+        records['target'] = targets.cpu().numpy()
+        records['distance'], records['loss'] = errors.cpu().numpy().T
+        self.count = end
+
+    def close(self):
+        """Flush the results file."""
+        if self.count != len(self.records):
+            raise ValueError(
+                f'{self.filepath} holds {len(self.records)} samples, only '
+                f'{self.count} were evaluated')
+        self.records.flush()
+
+
+def read_results(filepath: str) -> numpy.ndarray:
+    """Map a results file written by `ResultsWriter`.
+
+    Args:
+        filepath: The results file.
+
+    Returns:
+        The read-only records, in the dataset order.
+    """
+    return numpy.load(filepath, mmap_mode='r')
+
+
+def summarize_results(records: numpy.ndarray) -> dict:
+    """Get the statistics of the light position distances.
+
+    Args:
+        records: The records of a results file.
+
+    Returns:
+        The mean, median, 95th percentile and maximum distance.
+    """
+    return summarize_distances(records['distance'])
+
+
+def summarize_distances(distances: numpy.ndarray) -> dict:
+    """Get the statistics of light position distances.
+
+    Args:
+        distances: The distance of each sample.
+
+    Returns:
+        The mean, median, 95th percentile and maximum distance.
+    """
+    distances = numpy.asarray(distances, dtype=numpy.float64)
+    return {
+        'mean': float(distances.mean()),
+        'median': float(numpy.median(distances)),
+        'p95': float(numpy.percentile(distances, 95)),
+        'max': float(distances.max()),
+    }
+
+
+class ModelStack:
+    """Run several models of the same architecture on the same inputs.
+
+    The models are either run one after the other, or vectorized with
+    `torch.func.vmap` over their stacked parameters, in a single forward of
+    all the models.
+    """
+
+    def __init__(
+            self,
+            models: list[torch_nn.Module],
+            vectorized: bool = False):
+        """Initialize the stack.
+
+        Args:
+            models: The models to run, in evaluation mode.
+            vectorized: Run the models with a single vectorized forward.
+        """
+        self.models = models
+        self.vectorized = vectorized
+
+        if vectorized:
+            # The base model only provides the architecture, its parameters
+            # are replaced by the stacked ones in each call.
+            self.params, self.buffers = torch_func.stack_module_state(models)
+            base_model = copy.deepcopy(models[0]).to(device='meta')
+
+            def forward(params, buffers, inputs):
+                return torch_func.functional_call(
+                    base_model, (params, buffers), (inputs,))
+
+            self._forward = torch_func.vmap(
+                forward, in_dims=(0, 0, None), randomness='same')
+
+    def __len__(self) -> int:
+        return len(self.models)
+
+    def __call__(self, inputs: torch.Tensor) -> torch.Tensor:
+        """Run all the models.
+
+        Args:
+            inputs: The (B, C, H, W) inputs batch.
+
+        Returns:
+            The (K, B, 3) predictions of the K models.
+        """
+        if self.vectorized:
+            return self._forward(self.params, self.buffers, inputs)
+        return torch.stack([model(inputs) for model in self.models])
+
+
+def evaluate_models(
+        models: ModelStack,
+        loader: torch_data.DataLoader,
+        device: torch.device = torch.device('cpu'),
+        precision: str = 'fp32') -> list[dict]:
+    """Evaluate several models on a dataset in a single pass over the data.
+
+    Each batch is loaded once and run through all the models. The light
+    position distances of all the models are read back from the device once
+    per batch.
+
+    Args:
+        models: The models to evaluate.
+        loader: The loader of the data to evaluate on.
+        device: The device to run the evaluation on.
+        precision: The precision to run the models with, from
+            `mixed_precision.PRECISIONS`.
+
+    Returns:
+        The metrics of each model: the mean squared error, and the mean,
+        median, 95th percentile and maximum light position distance.
+    """
+    memory_format = network.get_memory_format(
+        network.unwrap_model(models.models[0]))
+
+    for model in models.models:
+        model.eval()
+    total_losses = torch.zeros(len(models), device=device)
+    distances = []
+    with torch.no_grad():
+        for inputs, targets in loader:
+            inputs = inputs.to(
+                device=device,
+                memory_format=memory_format,
+                non_blocking=True)
+            targets = targets.to(device=device, non_blocking=True)
+
+            with mixed_precision.get_autocast(device, precision):
+                preds = models(inputs)
+            differences = preds.float() - targets
+            total_losses += differences.square().mean(dim=2).sum(dim=1)
+            distances.append(
+                torch.linalg.vector_norm(differences, dim=2).cpu().numpy())
+
+    distances = numpy.concatenate(distances, axis=1)
+    losses = (total_losses / max(1, distances.shape[1])).tolist()
+    return [
+        {'loss': loss, **summarize_distances(model_distances)}
+        for loss, model_distances in zip(losses, distances)]
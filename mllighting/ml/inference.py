@@ -1,18 +1,16 @@
-import os
-
-from PIL import Image
-
 import torch
 from torch import nn as torch_nn
 
-from mllighting.ml import constants, dataset
+from mllighting.ml import constants, dataset, mixed_precision, network
 
 
 def run_inference(
         model: torch_nn.Module,
         render_directory: str,
         image_size: tuple[int, int] = constants.IMAGE_SIZE,
-        device: torch.device = torch.device('cpu')) -> list[float]:
+        device: torch.device = torch.device('cpu'),
+        statistics: dict | None = None,
+        precision: str = 'fp32') -> list[float]:
     """Run the inference with the given model.
 
     Args:
@@ -20,39 +18,26 @@ def run_inference(
         render_directory: The directory containing the images.
         image_size: The transform image size.
         device: The device to run the inference on.
+        statistics: The dataset statistics the model was trained with, to
+            normalize the EXR maps the same way.
+        precision: The precision to run the model with, from
+            `mixed_precision.PRECISIONS`.
 
     Returns:
         The infered values.
     """
-    # Load the images.
-    albedo = Image.open(
-        os.path.join(
-            render_directory,
-            'albedo.png')).convert('RGB')
-    beauty = Image.open(
-        os.path.join(
-            render_directory,
-            'beauty.png')).convert('RGB')
-    normal = dataset.read_exr_as_tensor(
-        os.path.join(render_directory, 'normal.exr'), image_size=image_size)
-    position = dataset.read_exr_as_tensor(
-        os.path.join(render_directory, 'position.exr'), image_size=image_size)
-
-    # Apply transforms.
-    trans = dataset.get_transform(image_size=image_size)
-    albedo = trans(albedo)
-    beauty = trans(beauty)
-
-    # Concatenate.
-    image_tensor = torch.cat([
-        beauty, albedo, normal, position
-    ], dim=0)
+    # Decode the render maps straight into the model input.
+    inputs = dataset.allocate_batch(1, image_size=image_size)
+    dataset.read_maps_into(render_directory, inputs[0])
+    if statistics is not None:
+        dataset.normalize_maps(inputs, dataset.get_normalization(statistics))
 
     # Predict the values.
-    inputs = image_tensor
-    inputs = inputs.unsqueeze(0).to(device=device)
-    with torch.no_grad():
+    inputs = inputs.to(
+        device=device,
+        memory_format=network.get_memory_format(network.unwrap_model(model)))
+    with torch.no_grad(), mixed_precision.get_autocast(device, precision):
         preds = model(inputs)
-        predicted_lights = preds.squeeze(0).cpu().numpy()
+        predicted_lights = preds.squeeze(0).float().cpu().numpy()
 
     return predicted_lights.tolist()
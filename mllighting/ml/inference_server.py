@@ -0,0 +1,188 @@
+import asyncio
+import base64
+import concurrent.futures
+import json
+import os
+import queue
+import tempfile
+
+import torch
+
+from mllighting import log
+from mllighting.communication import server
+from mllighting.ml import constants, inference, registry
+
+
+logger = log.LoggerManager.get_logger(__name__)
+
+
+class InferenceServer(server.Server):
+    """Serve the inference requests of the applications.
+
+    The models are kept loaded in the process, so a request only costs the
+    inference and the round trip. Unlike the application servers, the
+    commands are executed as they are received and their result is sent
+    back. The models run one request at a time in a worker thread, so the
+    server keeps accepting connections.
+
+    A request is a json command read until the client closes its side of
+    the connection, see `client.send_request`. The commands are:
+    - `infer`, with a `render_directory` or a `payload` of render map files
+      and an optional `checkpoint`, returns the `lights` values.
+    - `ping`, returns the server checkpoint.
+    """
+
+    def __init__(
+            self,
+            address: str,
+            port: int,
+            checkpoint: str,
+            device: torch.device = torch.device('cpu'),
+            statistics: dict | None = None,
+            precision: str = 'fp32',
+            compiled: bool = False,
+            channels_last: bool = False):
+        """Initialize the server and load the model.
+
+        Args:
+            address: The server address.
+            port: The server port.
+            checkpoint: The default model checkpoint.
+            device: The device to run the inference on.
+            statistics: The dataset statistics the models were trained with.
+            precision: The precision to run the models with, from
+                `mixed_precision.PRECISIONS`.
+            compiled: Compile the models with `network.compile_model`.
+            channels_last: Run the convolutions in the channels last memory
+                format.
+        """
+        # The commands are not queued, they are executed by the server.
+        super().__init__(address, port, queue.Queue())
+
+        self.checkpoint = checkpoint
+        self.device = device
+        self.statistics = statistics
+        self.precision = precision
+        self.compiled = compiled
+        self.channels_last = channels_last
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='InferenceServer')
+
+        # Load the default model now, instead of on the first request.
+        self.get_model(checkpoint)
+
+    def get_model(self, checkpoint: str | None = None) -> torch.nn.Module:
+        """Get a model from the process wide registry.
+
+        Args:
+            checkpoint: The model checkpoint. Defaults to the server
+                checkpoint.
+
+        Returns:
+            The model, reloaded if its checkpoint changed.
+        """
+        return registry.get_registry().get(
+            checkpoint or self.checkpoint,
+            device=self.device,
+            compiled=self.compiled,
+            channels_last=self.channels_last)
+
+    def infer(
+            self,
+            render_directory: str | None = None,
+            payload: dict[str, str] | None = None,
+            checkpoint: str | None = None) -> dict:
+        """Execute the `infer` command.
+
+        Args:
+            render_directory: The directory containing the render maps.
+            payload: The base64 content of the render map files by file
+                name, used instead of a render directory.
+            checkpoint: The model checkpoint. Defaults to the server
+                checkpoint.
+
+        Returns:
+            The response, with the infered values.
+        """
+        model = self.get_model(checkpoint)
+
+        if payload is None:
+            if render_directory is None:
+                raise ValueError('No render directory or payload')
+            lights = inference.run_inference(
+                model,
+                render_directory,
+                device=self.device,
+                statistics=self.statistics,
+                precision=self.precision)
+            return {'lights': lights}
+
+        # Write the received files, the render maps are read from files.
+        with tempfile.TemporaryDirectory(prefix='mllighting_') as directory:
+            for name, content in payload.items():
+                if name not in constants.SAMPLE_FILENAMES:
+                    raise ValueError(f'Unexpected payload file {name}')
+                with open(os.path.join(directory, name), 'wb') as f:
+                    f.write(base64.b64decode(content))
+            lights = inference.run_inference(
+                model,
+                directory,
+                device=self.device,
+                statistics=self.statistics,
+                precision=self.precision)
+        return {'lights': lights}
+
+    def execute(self, command: str, arguments: dict) -> dict:
+        """Execute a command.
+
+        Args:
+            command: The command name.
+            arguments: The command arguments.
+
+        Returns:
+            The response.
+        """
+        if command == 'infer':
+            return self.infer(**arguments)
+        if command == 'ping':
+            return {'checkpoint': self.checkpoint}
+        raise ValueError(f'Unknown command {command}')
+
+    async def _handle_client(
+            self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Server callback, executing the command and sending its result.
+
+        Args:
+            reader: The reader data stream.
+            writer: The writer data stream.
+        """
+        try:
+            # Read the whole request, it can be larger than a single read.
+            data = await reader.read()
+            if not data:
+                logger.debug('No data')
+                return
+
+            try:
+                request = json.loads(data.decode())
+                command = request.get('command')
+                arguments = request.get('arguments', {})
+                logger.debug(f'Received command {command}')
+
+                # Run the model out of the event loop.
+                loop = asyncio.get_running_loop()
+                response = await loop.run_in_executor(
+                    self._executor, self.execute, command, arguments)
+            except Exception as e:
+                logger.error(f'Command error: {e}')
+                response = {'error': str(e)}
+
+            writer.write(json.dumps(response).encode())
+            await writer.drain()
+
+        except Exception as e:
+            logger.error(f'Server callback error: {e}')
+        finally:
+            writer.close()
+            await writer.wait_closed()
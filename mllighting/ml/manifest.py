@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+
+from mllighting import log
+from mllighting.ml import constants
+
+
+logger = log.LoggerManager.get_logger(__name__)
+
+
+MANIFEST_FILENAME = 'manifest.json'
+
+
+def sample_sort_key(name: str) -> tuple[int, int | str]:
+    """Get the key used to sort the sample names.
+
+    Numeric sample names are sorted by value, before the other names.
+
+    Args:
+        name: The sample name.
+
+    Returns:
+        The sort key.
+    """
+    if name.isdigit():
+        return (0, int(name))
+    return (1, name)
+
+
+def scan_sample(sample_directory: str, mtime: int) -> dict | None:
+    """Scan the files of a sample directory.
+
+    Args:
+        sample_directory: The sample directory.
+        mtime: The modification time of the sample directory, in nanoseconds.
+
+    Returns:
+        The sample record, None if a sample file is missing.
+    """
+    files = {}
+    for filename in constants.SAMPLE_FILENAMES:
+        try:
+            stat = os.stat(os.path.join(sample_directory, filename))
+        except FileNotFoundError:
+            logger.warning(f'Missing {filename} in {sample_directory}')
+            return None
+        files[filename] = [stat.st_size, stat.st_mtime_ns]
+
+    return {
+        'name': os.path.basename(sample_directory),
+        'mtime': mtime,
+        'files': files}
+
+
+def build_manifest(directory: str, previous: dict | None = None) -> dict:
+    """Build the manifest of a dataset directory.
+
+    Only the sample directories whose modification time changed since the
+    previous manifest are scanned again.
+
+    Args:
+        directory: The dataset directory.
+        previous: The previous manifest to update.
+
+    Returns:
+        The manifest.
+    """
+    previous_samples = {}
+    if previous is not None:
+        previous_samples = {
+            sample['name']: sample for sample in previous['samples']}
+
+    samples = []
+    scanned_count = 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+
+            mtime = entry.stat().st_mtime_ns
+            sample = previous_samples.get(entry.name)
+            if sample is None or sample['mtime'] != mtime:
+                sample = scan_sample(entry.path, mtime)
+                scanned_count += 1
+            if sample is not None:
+                samples.append(sample)
+
+    samples.sort(key=lambda sample: sample_sort_key(sample['name']))
+    logger.debug(
+        f'Manifest of {directory} built with {len(samples)} samples, '
+        f'{scanned_count} scanned')
+
+    return {'version': 1, 'samples': samples}
+
+
+def get_fingerprint(directory: str) -> str:
+    """Get a fingerprint of the samples of a dataset directory.
+
+    The fingerprint changes when a sample is added or removed, or when the
+    size or modification time of one of its files changes. Every file of
+    every sample is checked, editing a file in place does not change the
+    modification time of its sample directory.
+
+    Args:
+        directory: The dataset directory.
+
+    Returns:
+        The hexadecimal fingerprint.
+    """
+    digest = hashlib.sha256()
+    for name in get_sample_names(directory):
+        files = []
+        for filename in constants.SAMPLE_FILENAMES:
+            try:
+                stat = os.stat(os.path.join(directory, name, filename))
+                files.append([stat.st_size, stat.st_mtime_ns])
+            except FileNotFoundError:
+                files.append(None)
+        digest.update(json.dumps([name, files]).encode())
+    return digest.hexdigest()
+
+
+def read_manifest(directory: str) -> dict | None:
+    """Read the manifest of a dataset directory.
+
+    Args:
+        directory: The dataset directory.
+
+    Returns:
+        The manifest, None if the directory has no manifest.
+    """
+    filepath = os.path.join(directory, MANIFEST_FILENAME)
+    if not os.path.isfile(filepath):
+        return None
+    with open(filepath, 'r') as f:
+        return json.load(f)
+
+
+def write_manifest(directory: str, manifest: dict):
+    """Write the manifest of a dataset directory.
+
+    Args:
+        directory: The dataset directory.
+        manifest: The manifest to write.
+    """
+    filepath = os.path.join(directory, MANIFEST_FILENAME)
+    with open(f'{filepath}.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(f'{filepath}.tmp', filepath)
+
+
+def update_manifest(directory: str, full: bool = False) -> dict:
+    """Rebuild the manifest of a dataset directory and write it.
+
+    Args:
+        directory: The dataset directory.
+        full: Scan every sample directory instead of only the changed ones.
+
+    Returns:
+        The manifest.
+    """
+    previous = None if full else read_manifest(directory)
+    manifest = build_manifest(directory, previous=previous)
+    write_manifest(directory, manifest)
+    return manifest
+
+
+def get_sample_names(directory: str) -> list[str]:
+    """Get the sample names of a dataset directory.
+
+    The names are read from the manifest when the directory has one,
+    otherwise the directory is listed.
+
+    Args:
+        directory: The dataset directory.
+
+    Returns:
+        The sorted sample names.
+    """
+    manifest = read_manifest(directory)
+    if manifest is not None:
+        return [sample['name'] for sample in manifest['samples']]
+
+    with os.scandir(directory) as entries:
+        names = [entry.name for entry in entries if entry.is_dir()]
+    return sorted(names, key=sample_sort_key)
@@ -0,0 +1,32 @@
+import contextlib
+
+import torch
+
+
+# The precisions the model can run with.
+PRECISIONS = ('fp32', 'bf16')
+
+
+def get_autocast(
+        device: torch.device,
+        precision: str = 'fp32') -> contextlib.AbstractContextManager:
+    """Get the context to run the model forward pass in.
+
+    In bf16 the weights, the gradients and the optimizer state stay in
+    float32, only the operations supporting it run in bfloat16. bfloat16
+    has the same exponent range as float32, so the gradients do not need
+    loss scaling.
+
+    Args:
+        device: The device the model runs on.
+        precision: The precision, from `PRECISIONS`.
+
+    Returns:
+        The autocast context.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f'Unknown precision {precision}')
+    return torch.autocast(
+        device_type=device.type,
+        dtype=torch.bfloat16,
+        enabled=precision == 'bf16')
@@ -1,9 +1,21 @@
+import os
+
 import torch
 import torch.nn as torch_nn
 
+from mllighting import log
 from mllighting.ml import constants
 
 
+logger = log.LoggerManager.get_logger(__name__)
+
+
+# The directory the compiled kernels are cached in, shared by all the
+# processes compiling the model.
+COMPILE_CACHE_DIRECTORY = os.path.join(
+    os.path.expanduser('~'), '.cache', 'mllighting', 'inductor')
+
+
 class CNNModel(torch_nn.Module):
 
     def __init__(
@@ -36,23 +48,128 @@ class CNNModel(torch_nn.Module):
         return x
 
 
+def get_memory_format(model: torch_nn.Module) -> torch.memory_format:
+    """Get the memory format of the model convolutions.
+
+    The inputs are converted to the same memory format, so the convolutions
+    do not convert them.
+
+    Args:
+        model: The eager model.
+
+    Returns:
+        `torch.channels_last` if the model was converted with
+        `model.to(memory_format=torch.channels_last)`, otherwise
+        `torch.contiguous_format`.
+    """
+    for module in model.modules():
+        if isinstance(module, torch_nn.Conv2d):
+            if module.weight.is_contiguous(memory_format=torch.channels_last):
+                return torch.channels_last
+            break
+    return torch.contiguous_format
+
+
+def compile_model(
+        model: torch_nn.Module,
+        image_size: tuple[int, int] = constants.IMAGE_SIZE,
+        batch_size: int = 1,
+        training: bool = False) -> torch_nn.Module:
+    """Compile the model with `torch.compile` and warm it up.
+
+    The compiled kernels are cached in `COMPILE_CACHE_DIRECTORY`, unless the
+    `TORCHINDUCTOR_CACHE_DIR` environment variable is set, so the next
+    processes compiling the model reuse them.
+
+    Args:
+        model: The model to compile.
+        image_size: The input image size to warm up with.
+        batch_size: The batch size to warm up with.
+        training: Warm up the training forward and backward passes as well
+            as the inference one.
+
+    Returns:
+        The compiled model, or the model itself if it can not be compiled.
+    """
+    os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', COMPILE_CACHE_DIRECTORY)
+
+    device = next(model.parameters()).device
+    memory_format = get_memory_format(unwrap_model(model))
+
+    # The compilation is done on the first call of each input shape and
+    # mode, so warm up the model to compile it now and fall back to the
+    # eager model on failure. The batch dimension is dynamic, so the smaller
+    # last batches reuse the compiled kernels, but single sample batches are
+    # compiled apart. The training is validated in evaluation mode.
+    modes = [training, False] if training else [False]
+    try:
+        compiled_model = torch.compile(model, dynamic=True)
+        for mode_training in modes:
+            for size in sorted({batch_size, 1}, reverse=True):
+                inputs = torch.zeros(
+                    (size, 12, image_size[1], image_size[0]), device=device)
+                inputs = inputs.contiguous(memory_format=memory_format)
+                if mode_training:
+                    compiled_model.train()
+                    compiled_model(inputs).sum().backward()
+                    model.zero_grad(set_to_none=True)
+                else:
+                    compiled_model.eval()
+                    with torch.no_grad():
+                        compiled_model(inputs)
+    except Exception as e:
+        logger.warning(f'Could not compile the model, running eager: {e}')
+        model.zero_grad(set_to_none=True)
+        return model
+
+    compiled_model.train(training)
+    return compiled_model
+
+
+def unwrap_model(model: torch_nn.Module) -> torch_nn.Module:
+    """Get the original model of a compiled or distributed model.
+
+    The wrapped model shares its parameters with the original one, whose
+    state dict is saved so the checkpoints load in all the modes.
+
+    Args:
+        model: The compiled, distributed or eager model.
+
+    Returns:
+        The eager model.
+    """
+    model = getattr(model, '_orig_mod', model)
+    if isinstance(model, torch_nn.parallel.DistributedDataParallel):
+        model = model.module
+    return model
+
+
 def load_model(
         checkpoint: str | None = None,
-        device: torch.device = torch.device('cpu')) -> CNNModel:
+        device: torch.device = torch.device('cpu'),
+        compiled: bool = False,
+        channels_last: bool = False) -> torch_nn.Module:
     """Load the model with an optional checkpoint.
 
     Args:
         checkpoint: The model checkpoint to load.
         device: The device to load the model with.
+        compiled: Compile the model for inference with `compile_model`.
+        channels_last: Run the convolutions in the channels last memory
+            format, usually faster on CPU.
 
     Returns:
         The model.
     """
     model = CNNModel().to(device=device)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
     if checkpoint is not None:
         state_dict = torch.load(
             checkpoint,
             weights_only=True,
             map_location=device)
         model.load_state_dict(state_dict)
+    if compiled:
+        return compile_model(model)
     return model
@@ -0,0 +1,247 @@
+import contextlib
+import sys
+import time
+import typing
+
+import torch
+import torch.profiler as torch_profiler
+
+from mllighting import log
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the process peak memory is not reported.
+    resource = None
+
+
+logger = log.LoggerManager.get_logger(__name__)
+
+
+# The timed stages of a training step, in order.
+STAGES = (
+    'data', 'transfer', 'augment', 'forward', 'backward', 'optimizer',
+    'validation')
+
+
+class StageProfiler:
+    """Time the stages of the training steps and summarize each epoch.
+
+    The time spent waiting on the DataLoader is timed by iterating the
+    loader through `iterate`, the other stages are timed with `stage`. GPU
+    stages are synchronized to time the kernels instead of their launch. A
+    `torch.profiler` trace can be captured for a window of steps.
+    """
+
+    def __init__(
+            self,
+            device: torch.device = torch.device('cpu'),
+            enabled: bool = True,
+            trace_path: str | None = None,
+            trace_start: int = 10,
+            trace_steps: int = 5):
+        """Initialize the profiler.
+
+        Args:
+            device: The device the model runs on.
+            enabled: Time the stages, a disabled profiler does nothing.
+            trace_path: The Chrome trace file the `torch.profiler` trace is
+                written to. No trace is captured if not set.
+            trace_start: The number of steps skipped before the trace.
+            trace_steps: The number of traced steps.
+        """
+        self.device = device
+        self.enabled = enabled
+        self.trace_path = trace_path
+        self.trace_start = trace_start
+        self.trace_steps = trace_steps
+
+        self.durations = dict.fromkeys(STAGES, 0.0)
+        self.sample_count = 0
+        self._epoch_start = None
+        self._trace = None
+
+    def start(self):
+        """Start capturing the trace, if any."""
+        if not self.enabled or self.trace_path is None:
+            return
+
+        activities = [torch_profiler.ProfilerActivity.CPU]
+        if self.device.type == 'cuda':
+            activities.append(torch_profiler.ProfilerActivity.CUDA)
+        self._trace = torch_profiler.profile(
+            activities=activities,
+            schedule=torch_profiler.schedule(
+                skip_first=self.trace_start,
+                wait=0,
+                warmup=1,
+                active=self.trace_steps,
+                repeat=1),
+            on_trace_ready=self._write_trace,
+            profile_memory=True)
+        self._trace.start()
+
+    def stop(self):
+        """Stop capturing the trace."""
+        if self._trace is not None:
+            self._trace.stop()
+            self._trace = None
+
+    def step(self):
+        """Mark the end of a training step for the trace schedule."""
+        if self._trace is not None:
+            self._trace.step()
+
+    def _write_trace(self, trace: torch_profiler.profile):
+        """Write the captured trace.
+
+        Args:
+            trace: The profiler holding the trace.
+        """
+        trace.export_chrome_trace(self.trace_path)
+        logger.debug(f'Trace written to {self.trace_path}')
+
+    def start_epoch(self):
+        """Reset the timings for a new epoch."""
+        if not self.enabled:
+            return
+
+        self.durations = dict.fromkeys(STAGES, 0.0)
+        self.sample_count = 0
+        if self.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(self.device)
+        self._epoch_start = time.perf_counter()
+
+    def add_samples(self, count: int):
+        """Count the samples trained on in the epoch.
+
+        Args:
+            count: The number of samples of the batch.
+        """
+        self.sample_count += count
+
+    def stage(self, name: str) -> typing.ContextManager:
+        """Time a stage of the step.
+
+        Args:
+            name: The stage name, from `STAGES`.
+
+        Returns:
+            The context manager timing the code it runs.
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._time_stage(name)
+
+    @contextlib.contextmanager
+    def _time_stage(self, name: str) -> typing.Iterator[None]:
+        """Time a stage of the step, labelled in the trace.
+
+        Args:
+            name: The stage name.
+        """
+        label = contextlib.nullcontext()
+        if self._trace is not None:
+            label = torch_profiler.record_function(name)
+
+        self._synchronize()
+        start = time.perf_counter()
+        with label:
+            yield
+        self._synchronize()
+        self.durations[name] += time.perf_counter() - start
+
+    def iterate(self, iterable: typing.Iterable) -> typing.Iterator:
+        """Iterate while timing the wait for each item in the data stage.
+
+        Args:
+            iterable: The DataLoader iterator.
+
+        Yields:
+            The items of the iterable.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage('data'):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def _synchronize(self):
+        """Wait for the queued GPU kernels."""
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+
+    def get_peak_memory(self) -> int | None:
+        """Get the peak memory of the epoch.
+
+        Returns:
+            The peak memory allocated by torch on the GPU, in bytes. None on
+            CPU, where the peak memory can not be reset for each epoch.
+        """
+        if self.device.type == 'cuda':
+            return torch.cuda.max_memory_allocated(self.device)
+        return None
+
+    @staticmethod
+    def get_process_peak_memory() -> int | None:
+        """Get the peak resident memory of the process.
+
+        This is the peak since the process started, not since the epoch
+        started, it only grows from one epoch to the next.
+
+        Returns:
+            The peak resident memory, in bytes. None if unknown.
+        """
+        if resource is None:
+            return None
+        # The resident memory is in bytes on macOS, KiB otherwise.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    def end_epoch(self) -> dict | None:
+        """Summarize the epoch.
+
+        Returns:
+            The epoch duration, the samples per second, the duration of
+            each stage, the peak memory of the epoch and the peak memory of
+            the process. None if the profiler is disabled.
+        """
+        if not self.enabled:
+            return None
+
+        duration = time.perf_counter() - self._epoch_start
+        stages = dict(self.durations)
+        stages['other'] = max(0.0, duration - sum(self.durations.values()))
+        return {
+            'duration': duration,
+            'samples_per_second': self.sample_count / duration,
+            'stages': stages,
+            'peak_memory': self.get_peak_memory(),
+            'process_peak_memory': self.get_process_peak_memory(),
+        }
+
+
+def format_summary(summary: dict) -> str:
+    """Format the epoch summary of a `StageProfiler`.
+
+    Args:
+        summary: The summary returned by `StageProfiler.end_epoch`.
+
+    Returns:
+        The summary on a line.
+    """
+    duration = summary['duration']
+    stages = ', '.join(
+        f'{name} {stage_duration / duration * 100:.1f}%'
+        for name, stage_duration in summary['stages'].items())
+    text = f'{summary["samples_per_second"]:.1f} samples/s, {stages}'
+    if summary['peak_memory'] is not None:
+        text += f', peak memory {summary["peak_memory"] / 2**20:.1f} MiB'
+    if summary['process_peak_memory'] is not None:
+        text += (
+            ', process peak memory '
+            f'{summary["process_peak_memory"] / 2**20:.1f} MiB')
+    return text
@@ -0,0 +1,218 @@
+import collections
+import os
+import threading
+
+import torch
+from torch import nn as torch_nn
+
+from mllighting import log
+from mllighting.ml import constants, network
+
+
+logger = log.LoggerManager.get_logger(__name__)
+
+
+# The number of models kept loaded by the process wide registry.
+DEFAULT_CAPACITY = 4
+
+
+class ModelRegistry:
+    """Keep the loaded models of a process, to not reload them on each use.
+
+    The models are keyed by their checkpoint, device and options, and the
+    least recently used model is evicted once the registry is full. The
+    models are warmed up when loaded, and reloaded when their checkpoint file
+    changes. A reloaded model is a new model swapped in once fully loaded,
+    so the callers still running the previous model are not affected.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        """Initialize the registry.
+
+        Args:
+            capacity: The number of models kept loaded.
+        """
+        self.capacity = capacity
+
+        # The models and the fingerprint of the checkpoint file they were
+        # loaded from, by key, the least recently used first.
+        self._entries = collections.OrderedDict()
+        # The locks held while loading a model, by key.
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(
+            self,
+            checkpoint: str,
+            device: torch.device = torch.device('cpu'),
+            compiled: bool = False,
+            channels_last: bool = False) -> torch_nn.Module:
+        """Get a model, loading it if it is not loaded or has changed.
+
+        Args:
+            checkpoint: The model checkpoint.
+            device: The device to load the model on.
+            compiled: Compile the model with `network.compile_model`.
+            channels_last: Run the convolutions in the channels last memory
+                format.
+
+        Returns:
+            The model, in evaluation mode.
+        """
+        checkpoint = os.path.realpath(checkpoint)
+        key = (checkpoint, str(device), compiled, channels_last)
+
+        model = self._get_current(key)
+        if model is not None:
+            return model
+
+        # The models are loaded under the lock of their key, so the same
+        # model is never loaded twice at once while the other models are
+        # still served. The registry lock is only held to swap the entries.
+        with self._get_key_lock(key):
+            # Another thread may have loaded the model while waiting.
+            model = self._get_current(key)
+            if model is not None:
+                return model
+
+            fingerprint = get_fingerprint(checkpoint)
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None:
+                logger.debug(f'Reloading the changed {checkpoint}')
+            else:
+                logger.debug(f'Loading {checkpoint} on {device}')
+
+            try:
+                model = load_model(
+                    checkpoint,
+                    device=device,
+                    compiled=compiled,
+                    channels_last=channels_last)
+            except Exception as e:
+                # Keep the previous model when the new checkpoint can not be
+                # loaded, it is loaded again on the next call.
+                if entry is None:
+                    raise
+                logger.warning(f'Could not reload {checkpoint}: {e}')
+                return entry[0]
+
+            with self._lock:
+                self._entries[key] = (model, fingerprint)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.capacity:
+                    evicted_key, _ = self._entries.popitem(last=False)
+                    self._key_locks.pop(evicted_key, None)
+                    logger.debug(f'Evicted {evicted_key[0]}')
+            return model
+
+    def _get_current(self, key: tuple) -> torch_nn.Module | None:
+        """Get a loaded model if its checkpoint did not change.
+
+        Args:
+            key: The model key.
+
+        Returns:
+            The model, None if it is not loaded or its checkpoint changed.
+        """
+        fingerprint = get_fingerprint(key[0])
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            model, loaded_fingerprint = entry
+            if fingerprint != loaded_fingerprint:
+                return None
+            return model
+
+    def _get_key_lock(self, key: tuple) -> threading.Lock:
+        """Get the lock held while loading the model of a key.
+
+        Args:
+            key: The model key.
+
+        Returns:
+            The lock.
+        """
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def clear(self):
+        """Unload all the models."""
+        with self._lock:
+            self._entries.clear()
+            self._key_locks.clear()
+
+
+def get_fingerprint(filepath: str) -> tuple[int, int]:
+    """Get the fingerprint used to detect the changed checkpoints.
+
+    Args:
+        filepath: The checkpoint file path.
+
+    Returns:
+        The file size and modification time in nanoseconds.
+    """
+    stat = os.stat(filepath)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_model(
+        checkpoint: str,
+        device: torch.device = torch.device('cpu'),
+        compiled: bool = False,
+        channels_last: bool = False,
+        image_size: tuple[int, int] = constants.IMAGE_SIZE)\
+        -> torch_nn.Module:
+    """Load a model for inference and warm it up.
+
+    Args:
+        checkpoint: The model checkpoint.
+        device: The device to load the model on.
+        compiled: Compile the model with `network.compile_model`.
+        channels_last: Run the convolutions in the channels last memory
+            format.
+        image_size: The input image size to warm up with.
+
+    Returns:
+        The model, in evaluation mode.
+    """
+    model = network.load_model(
+        checkpoint,
+        device=device,
+        compiled=compiled,
+        channels_last=channels_last)
+    model.eval()
+
+    # The first call allocates the buffers and selects the kernels, run it
+    # now instead of on the first inference. Compiled models are already
+    # warmed up.
+    if not compiled:
+        inputs = torch.zeros(
+            (1, 12, image_size[1], image_size[0]), device=device)
+        inputs = inputs.contiguous(
+            memory_format=network.get_memory_format(model))
+        with torch.no_grad():
+            model(inputs)
+    return model
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ModelRegistry:
+    """Get the process wide model registry.
+
+    Returns:
+        The registry.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
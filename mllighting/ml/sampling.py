@@ -0,0 +1,75 @@
+import math
+import typing
+
+import torch
+import torch.utils.data as torch_data
+
+from mllighting.ml import distributed
+
+
+class ResumableSampler(torch_data.Sampler):
+    """Sample the dataset in an order that can be resumed mid-epoch.
+
+    The order of each epoch only depends on the seed and the epoch, so a
+    resumed training gets the same order and can skip the samples already
+    trained on without loading them. In a distributed training, the samples
+    are split between the processes like `DistributedSampler` does.
+    """
+
+    def __init__(
+            self,
+            data: torch_data.Dataset,
+            shuffle: bool = True,
+            seed: int = 0):
+        """Initialize the sampler.
+
+        Args:
+            data: The dataset to sample.
+            shuffle: Shuffle the samples at each epoch.
+            seed: The seed of the shuffle, shared by all the processes.
+        """
+        self.sample_count = len(data)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.rank = distributed.get_rank()
+        self.world_size = distributed.get_world_size()
+
+        self.epoch = 0
+        self.start = 0
+
+    def __len__(self) -> int:
+        return math.ceil(self.sample_count / self.world_size)
+
+    def __iter__(self) -> typing.Iterator[int]:
+        if self.shuffle:
+            generator = torch.Generator().manual_seed(self.seed + self.epoch)
+            indices = torch.randperm(
+                self.sample_count, generator=generator).tolist()
+        else:
+            indices = list(range(self.sample_count))
+
+        # Repeat the first samples so all the processes get the same number
+        # of samples.
+        padding = len(self) * self.world_size - len(indices)
+        indices += indices[:padding]
+        indices = indices[self.rank::self.world_size]
+
+        # The start only applies to the resumed epoch.
+        start, self.start = self.start, 0
+        return iter(indices[start:])
+
+    def set_epoch(self, epoch: int):
+        """Set the epoch the order is drawn for.
+
+        Args:
+            epoch: The epoch.
+        """
+        self.epoch = epoch
+
+    def set_start(self, start: int):
+        """Skip the first samples of the next iteration.
+
+        Args:
+            start: The number of samples of the process to skip.
+        """
+        self.start = start
@@ -0,0 +1,130 @@
+import math
+
+import torch.optim.lr_scheduler as torch_lr_scheduler
+import torch.optim.optimizer as torch_optimizer
+
+
+# The supported learning rate schedules.
+SCHEDULES = ('constant', 'onecycle', 'cosine')
+
+# The one cycle schedule starts at the learning rate divided by the initial
+# factor, and ends at the start divided by the final factor.
+ONECYCLE_INITIAL_FACTOR = 25.0
+ONECYCLE_FINAL_FACTOR = 1e4
+
+
+def get_cosine_factor(progress: float) -> float:
+    """Get the cosine annealing factor of the learning rate.
+
+    Args:
+        progress: The fraction of the annealing done, from 0 to 1.
+
+    Returns:
+        The factor, from 1 to 0.
+    """
+    return 0.5 * (1.0 + math.cos(math.pi * min(progress, 1.0)))
+
+
+def get_scheduler(
+        name: str,
+        optimizer: torch_optimizer.Optimizer,
+        total_steps: int,
+        warmup: float = 0.05) -> torch_lr_scheduler.LRScheduler | None:
+    """Get a learning rate schedule stepped after each optimizer step.
+
+    The learning rate of the optimizer is the peak learning rate. Both
+    schedules warm it up linearly, then anneal it with a cosine:
+    - `onecycle` starts and ends well below the peak learning rate.
+    - `cosine` starts at 0 and anneals to 0.
+
+    The schedules hold the last learning rate when stepped past the total
+    step count, which can happen with streamed datasets.
+
+    Args:
+        name: The schedule name, from `SCHEDULES`.
+        optimizer: The optimizer to schedule the learning rate of.
+        total_steps: The number of optimizer steps of the training.
+        warmup: The fraction of the steps the learning rate is warmed up
+            over.
+
+    Returns:
+        The scheduler, None for the constant schedule.
+    """
+    if name not in SCHEDULES:
+        raise ValueError(f'Unknown schedule {name}, expected one of '
+                         f'{", ".join(SCHEDULES)}')
+    if name == 'constant':
+        return None
+
+    total_steps = max(total_steps, 1)
+    warmup_steps = int(total_steps * warmup)
+
+    if name == 'onecycle':
+        initial = 1.0 / ONECYCLE_INITIAL_FACTOR
+        final = initial / ONECYCLE_FINAL_FACTOR
+
+        def get_factor(step: int) -> float:
+            if step < warmup_steps:
+                return initial + (1.0 - initial) * step / warmup_steps
+            progress = (step - warmup_steps) / max(
+                total_steps - warmup_steps, 1)
+            return final + (1.0 - final) * get_cosine_factor(progress)
+    else:
+        def get_factor(step: int) -> float:
+            if step < warmup_steps:
+                return (step + 1) / (warmup_steps + 1)
+            progress = (step - warmup_steps) / max(
+                total_steps - warmup_steps, 1)
+            return get_cosine_factor(progress)
+
+    return torch_lr_scheduler.LambdaLR(optimizer, get_factor)
+
+
+class EarlyStopping:
+    """Stop the training when the monitored score stops improving."""
+
+    def __init__(self, patience: int, min_delta: float = 0.0):
+        """Initialize the early stopping.
+
+        Args:
+            patience: The number of epochs without improvement before
+                stopping.
+            min_delta: The decrease of the score counted as an improvement.
+        """
+        self.patience = patience
+        self.min_delta = min_delta
+        self.best_score = math.inf
+        self.bad_epochs = 0
+
+    def update(self, score: float) -> bool:
+        """Update with the score of an epoch.
+
+        Args:
+            score: The monitored score, lower is better.
+
+        Returns:
+            True if the training must stop.
+        """
+        if score < self.best_score - self.min_delta:
+            self.best_score = score
+            self.bad_epochs = 0
+        else:
+            self.bad_epochs += 1
+        return self.bad_epochs >= self.patience
+
+    def state_dict(self) -> dict:
+        """Get the state to resume the early stopping.
+
+        Returns:
+            The best score and the number of epochs without improvement.
+        """
+        return {'best_score': self.best_score, 'bad_epochs': self.bad_epochs}
+
+    def load_state_dict(self, state: dict):
+        """Restore the state of the early stopping.
+
+        Args:
+            state: The state from `state_dict`.
+        """
+        self.best_score = state['best_score']
+        self.bad_epochs = state['bad_epochs']
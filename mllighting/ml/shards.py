@@ -0,0 +1,266 @@
+import json
+import os
+import random
+import shutil
+import tarfile
+import tempfile
+import typing
+
+import torch
+import torch.utils.data as torch_data
+
+from mllighting import log
+from mllighting.ml import constants, dataset, manifest
+
+
+logger = log.LoggerManager.get_logger(__name__)
+
+
+INDEX_FILENAME = 'index.json'
+
+
+class ShardedRenderMapsDataset(torch_data.IterableDataset):
+    """The render map dataset streamed from tar shards.
+
+    Shards are created with `write_shards` and are stored under the shard
+    directory with the following structure:
+
+    ```
+    |- shard directory
+       |- index.json
+       |- shard-000000.tar
+          |- sample name
+             |- albedo.png
+             |- beauty.png
+             |- normal.exr
+             |- position.exr
+             |- light.json
+       |- shard-000001.tar
+    ```
+
+    Shards are read sequentially and split across the DataLoader workers.
+    Samples are shuffled within a buffer.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            image_size: tuple[int, int] = constants.IMAGE_SIZE,
+            shuffle: bool = True,
+            buffer_size: int = 1000,
+            statistics: dict | None = None):
+        """Initialize the dataset.
+
+        Args:
+            directory: The shard directory.
+            image_size: The image size to work with.
+            shuffle: Shuffle the shards order and the samples.
+            buffer_size: The number of samples to shuffle within.
+            statistics: The report of `validation.scan_dataset`. The invalid
+                samples are skipped and the EXR maps are normalized.
+        """
+        self.directory = directory
+        self.image_size = image_size
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+
+        self.invalid = set()
+        self.normalization = None
+        if statistics is not None:
+            self.invalid = set(statistics['errors'])
+            self.normalization = dataset.get_normalization(statistics)
+
+        index = read_index(directory)
+        self.shards = [
+            os.path.join(directory, shard['name'])
+            for shard in index['shards']]
+        self._length = sum(
+            get_valid_count(shard, self.invalid) for shard in index['shards'])
+
+        # The number of iterations done by this dataset instance, used to
+        # get a different order at each epoch.
+        self._iteration = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> typing.Iterator[tuple[torch.Tensor, torch.Tensor]]:
+        worker_info = torch_data.get_worker_info()
+        if worker_info is None:
+            worker_id = 0
+            num_workers = 1
+            seed = int(torch.empty((), dtype=torch.int64).random_().item())
+        else:
+            # All the workers share the same base seed, so they agree on the
+            # shards order.
+            worker_id = worker_info.id
+            num_workers = worker_info.num_workers
+            seed = worker_info.seed - worker_info.id + self._iteration
+        self._iteration += 1
+
+        rng = random.Random(seed)
+        shards = list(self.shards)
+        if self.shuffle:
+            rng.shuffle(shards)
+        shards = shards[worker_id::num_workers]
+
+        # Use a worker specific random generator for the shuffle buffer.
+        rng = random.Random(seed + worker_id + 1)
+        samples = self._iter_samples(shards)
+        if not self.shuffle:
+            yield from samples
+            return
+
+        buffer = []
+        for sample in samples:
+            if len(buffer) < self.buffer_size:
+                buffer.append(sample)
+                continue
+            index = rng.randrange(len(buffer))
+            yield buffer[index]
+            buffer[index] = sample
+
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def _iter_samples(self, shards: list[str])\
+            -> typing.Iterator[tuple[torch.Tensor, torch.Tensor]]:
+        """Decode the samples of the given shards.
+
+        Args:
+            shards: The shard files to read.
+
+        Yields:
+            The image tensor and the light positions tensor.
+        """
+        # The sample files are extracted in a local temporary directory,
+        # so OpenImageIO can read the EXR files.
+        with tempfile.TemporaryDirectory(prefix='mllighting_') as tmp:
+            for shard in shards:
+                for name, sample_directory in _extract_samples(shard, tmp):
+                    if name in self.invalid:
+                        continue
+                    image_tensor, light_tensor = dataset.load_sample(
+                        sample_directory, image_size=self.image_size)
+                    if self.normalization is not None:
+                        dataset.normalize_maps(
+                            image_tensor, self.normalization)
+                    yield image_tensor, light_tensor
+
+
+def get_valid_count(shard: dict, invalid: set[str]) -> int:
+    """Get the number of valid samples of a shard.
+
+    Args:
+        shard: The shard entry of the index.
+        invalid: The names of the invalid samples.
+
+    Returns:
+        The number of samples of the shard not in the invalid samples. All
+        the samples are counted for the shards indexed without their sample
+        names.
+    """
+    names = shard.get('samples')
+    if names is None:
+        return shard['count']
+    return sum(1 for name in names if name not in invalid)
+
+
+def _extract_samples(
+        shard: str, directory: str) -> typing.Iterator[tuple[str, str]]:
+    """Stream the samples of a shard into a directory.
+
+    The shard is read sequentially, each sample overwrites the previous one.
+
+    Args:
+        shard: The shard file.
+        directory: The directory to extract the samples in.
+
+    Yields:
+        The sample name and the extracted sample directory.
+    """
+    sample_directory = os.path.join(directory, 'sample')
+    current = None
+
+    with tarfile.open(shard, mode='r|') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            name, filename = os.path.split(member.name)
+            if name != current:
+                if current is not None:
+                    yield current, sample_directory
+                shutil.rmtree(sample_directory, ignore_errors=True)
+                os.makedirs(sample_directory)
+                current = name
+
+            with open(os.path.join(sample_directory, filename), 'wb') as f:
+                shutil.copyfileobj(tar.extractfile(member), f)
+
+    if current is not None:
+        yield current, sample_directory
+
+
+def read_index(directory: str) -> dict:
+    """Read the index of a shard directory.
+
+    Args:
+        directory: The shard directory.
+
+    Returns:
+        The index.
+    """
+    with open(os.path.join(directory, INDEX_FILENAME), 'r') as f:
+        return json.load(f)
+
+
+def is_shard_directory(directory: str) -> bool:
+    """Check if the directory contains shards.
+
+    Args:
+        directory: The directory to check.
+
+    Returns:
+        True if the directory contains a shard index.
+    """
+    return os.path.isfile(os.path.join(directory, INDEX_FILENAME))
+
+
+def write_shards(
+        directory: str,
+        output_directory: str,
+        samples_per_shard: int = 1000):
+    """Pack a dataset directory into tar shards.
+
+    Args:
+        directory: The dataset directory.
+        output_directory: The directory to write the shards in.
+        samples_per_shard: The number of samples in each shard.
+    """
+    sample_names = manifest.get_sample_names(directory)
+
+    os.makedirs(output_directory, exist_ok=True)
+
+    shards = []
+    for start in range(0, len(sample_names), samples_per_shard):
+        names = sample_names[start:start + samples_per_shard]
+        shard_name = f'shard-{len(shards):06d}.tar'
+        shard_filepath = os.path.join(output_directory, shard_name)
+        logger.debug(f'Writing {len(names)} samples to {shard_filepath}')
+
+        # Write to a temporary file so an interrupted run never leaves a
+        # truncated shard.
+        with tarfile.open(f'{shard_filepath}.tmp', mode='w') as tar:
+            for name in names:
+                for filename in constants.SAMPLE_FILENAMES:
+                    tar.add(
+                        os.path.join(directory, name, filename),
+                        arcname=f'{name}/{filename}')
+        os.replace(f'{shard_filepath}.tmp', shard_filepath)
+
+        shards.append({
+            'name': shard_name, 'count': len(names), 'samples': names})
+
+    index = {'samples_per_shard': samples_per_shard, 'shards': shards}
+    with open(os.path.join(output_directory, INDEX_FILENAME), 'w') as f:
+        json.dump(index, f, indent=4)
@@ -0,0 +1,219 @@
+import multiprocessing
+
+import numpy
+
+import torch
+import torch.utils.data as torch_data
+
+from mllighting import log
+from mllighting.ml import cache, dataset
+
+
+logger = log.LoggerManager.get_logger(__name__)
+
+
+class SharedCacheDataset(torch_data.Dataset):
+    """Cache the decoded samples of a dataset in shared memory.
+
+    The cache pool is allocated in shared memory before the DataLoader
+    workers are started, so all the workers read and fill the same pool.
+    The samples are evicted with the clock algorithm when the pool is
+    full: the slots are visited in turn and the first slot not used since
+    the last visit is evicted, which approximates the least recently used
+    sample in constant time.
+    """
+
+    def __init__(
+            self,
+            data: dataset.RenderMapsDataset,
+            budget: int,
+            storage: str = 'float32'):
+        """Initialize the dataset.
+
+        Args:
+            data: The dataset to cache the samples of.
+            budget: The size of the cache pool, in bytes.
+            storage: The storage of the cached render maps, from
+                `cache.STORAGE_TYPES`. The compact storage fits about 2.7
+                times more samples in the same budget.
+        """
+        self.dataset = data
+
+        # Get the record layout from the first sample.
+        image_tensor, light_tensor = data[0]
+        self._dtype = cache.get_record_dtype(
+            (3, *image_tensor.shape[1:]), light_tensor.numel(), storage)
+
+        slot_count = budget // self._dtype.itemsize
+        if slot_count == 0:
+            raise ValueError(
+                f'The shared cache budget of {budget} bytes is too small for '
+                f'a sample of {self._dtype.itemsize} bytes')
+        logger.debug(
+            f'Allocating a shared cache of {slot_count} samples '
+            f'for {len(data)} samples')
+
+        # The cache pool and its index, shared with the workers.
+        self._pool = torch.empty(
+            slot_count * self._dtype.itemsize,
+            dtype=torch.uint8).share_memory_()
+        self._slot_samples = torch.full(
+            (slot_count,), -1, dtype=torch.int64).share_memory_()
+        self._sample_slots = torch.full(
+            (len(data),), -1, dtype=torch.int64).share_memory_()
+        # The slots used since the last visit of the clock hand.
+        self._referenced = torch.zeros(
+            slot_count, dtype=torch.bool).share_memory_()
+        # The clock hand slot, the hit count and the miss count.
+        self._counters = torch.zeros(3, dtype=torch.int64).share_memory_()
+        self._lock = multiprocessing.Lock()
+
+        # The structured view of the pool is created in each process.
+        self._records = None
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state['_records'] = None
+        return state
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, index: int) -> tuple[torch.Tensor, torch.Tensor]:
+        inputs, targets = self.read_batch([index])
+        return inputs[0], targets[0]
+
+    def __getitems__(
+            self, indices: list[int]) -> tuple[torch.Tensor, torch.Tensor]:
+        return self.read_batch(indices)
+
+    @property
+    def slot_count(self) -> int:
+        """The number of samples the cache can hold."""
+        return len(self._slot_samples)
+
+    def stats(self) -> dict:
+        """Get the cache statistics.
+
+        Returns:
+            The hit and miss counts, the hit rate, the number of cached
+            samples and the cache capacity.
+        """
+        with self._lock:
+            hits = int(self._counters[1])
+            misses = int(self._counters[2])
+            cached = int((self._slot_samples >= 0).sum())
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / max(1, hits + misses),
+            'cached': cached,
+            'capacity': self.slot_count,
+        }
+
+    def read_batch(
+            self,
+            indices: list[int],
+            out: torch.Tensor | None = None)\
+            -> tuple[torch.Tensor, torch.Tensor]:
+        """Load a batch of samples, from the cache when possible.
+
+        Args:
+            indices: The indices of the samples to load.
+            out: The (B, 12, H, W) tensor to load the samples into.
+                Allocated with `dataset.allocate_batch` if not set.
+
+        Returns:
+            The inputs batch and the light positions batch.
+        """
+        if self._records is None:
+            self._records = self._pool.numpy().view(self._dtype)
+
+        if out is None:
+            height, width = self._dtype['beauty'].shape[1:]
+            out = dataset.allocate_batch(len(indices), (width, height))
+        targets = torch.empty(
+            (len(indices), *self._dtype['targets'].shape))
+
+        for batch_index, index in enumerate(indices):
+            record = self._lookup(index)
+            if record is not None:
+                out_array = out[batch_index].numpy()
+                for map_index, name in enumerate(cache.MAP_NAMES):
+                    channels = slice(map_index * 3, (map_index + 1) * 3)
+                    out_array[channels] = cache.decode_map(record[name])
+                targets[batch_index] = torch.from_numpy(record['targets'])
+                continue
+
+            _, light_tensor = self.dataset.read_batch(
+                [index], out=out[batch_index:batch_index + 1])
+            targets[batch_index] = light_tensor[0]
+            self._store(index, out[batch_index], light_tensor[0])
+
+        return out, targets
+
+    def _lookup(self, index: int) -> numpy.ndarray | None:
+        """Copy a sample out of the cache.
+
+        Args:
+            index: The sample index.
+
+        Returns:
+            The copy of the cached record, None if the sample is not cached.
+        """
+        with self._lock:
+            slot = int(self._sample_slots[index])
+            if slot < 0:
+                self._counters[2] += 1
+                return None
+
+            self._counters[1] += 1
+            self._referenced[slot] = True
+            # Copy while locked, the slot can be evicted once released.
+            return self._records[slot].copy()
+
+    def _store(
+            self,
+            index: int,
+            image_tensor: torch.Tensor,
+            light_tensor: torch.Tensor):
+        """Store a decoded sample in the slot chosen by the clock hand.
+
+        Args:
+            index: The sample index.
+            image_tensor: The (12, H, W) image tensor.
+            light_tensor: The light positions tensor.
+        """
+        # Encode the record before taking the lock, only the copy into the
+        # pool is locked.
+        image_array = image_tensor.numpy()
+        record = numpy.empty((), dtype=self._dtype)
+        for map_index, name in enumerate(cache.MAP_NAMES):
+            channels = slice(map_index * 3, (map_index + 1) * 3)
+            record[name] = cache.encode_map(
+                image_array[channels], self._dtype[name].base.type)
+        record['targets'] = light_tensor.numpy()
+
+        with self._lock:
+            # Another worker may have stored the sample in the meantime.
+            if self._sample_slots[index] >= 0:
+                return
+
+            # Give the used slots a second chance, each visit clears their
+            # flag so the hand stops within one turn.
+            slot = int(self._counters[0])
+            while self._referenced[slot]:
+                self._referenced[slot] = False
+                slot = (slot + 1) % self.slot_count
+            self._counters[0] = (slot + 1) % self.slot_count
+
+            evicted = int(self._slot_samples[slot])
+            if evicted >= 0:
+                self._sample_slots[evicted] = -1
+
+            # The hand moved past the slot, the sample is kept for at least
+            # a turn.
+            self._records[slot] = record
+            self._referenced[slot] = False
+            self._slot_samples[slot] = index
+            self._sample_slots[index] = slot
@@ -0,0 +1,298 @@
+import concurrent.futures
+import contextlib
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+import torch
+
+from mllighting import log
+from mllighting.ml import cache, checkpoint, manifest, network, train
+
+
+logger = log.LoggerManager.get_logger(__name__)
+
+
+# The file names written in the sweep output directory.
+CACHE_FILENAME = 'dataset.npy'
+CACHE_SOURCE_FILENAME = 'dataset.json'
+RESULTS_FILENAME = 'results.csv'
+CHECKPOINT_FILENAME = 'model.pt'
+LOG_FILENAME = 'train.log'
+
+
+def get_configurations(grid: dict[str, list]) -> list[dict]:
+    """Get every combination of the values of a parameter grid.
+
+    Args:
+        grid: The values of each `train.train_model` keyword argument.
+
+    Returns:
+        The keyword arguments of each trial.
+    """
+    names = list(grid)
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*(grid[name] for name in names))]
+
+
+def get_trial_name(index: int) -> str:
+    """Get the name of the output directory of a trial.
+
+    Args:
+        index: The trial index.
+
+    Returns:
+        The directory name.
+    """
+    return f'trial_{index:03d}'
+
+
+def get_cache_source(directory: str, statistics: dict | None) -> dict:
+    """Get the description of the data a cache is decoded from.
+
+    Args:
+        directory: The dataset directory.
+        statistics: The report of `validation.scan_dataset` used to decode
+            the dataset.
+
+    Returns:
+        The dataset path, the fingerprint of its samples and the
+        statistics.
+    """
+    return {
+        'path': os.path.realpath(directory),
+        'fingerprint': manifest.get_fingerprint(directory),
+        'statistics': statistics,
+    }
+
+
+def read_cache_source(filepath: str) -> dict | None:
+    """Read the description of the data a cache was decoded from.
+
+    Args:
+        filepath: The cache source file.
+
+    Returns:
+        The description written with the cache, None if there is none.
+    """
+    if not os.path.isfile(filepath):
+        return None
+    with open(filepath, 'r') as f:
+        return json.load(f)
+
+
+def prepare_cache(
+        directory: str,
+        output_directory: str,
+        statistics: dict | None = None) -> str:
+    """Decode a dataset directory into the cache of a sweep.
+
+    The cache of a previous sweep is reused when it was decoded from the
+    same dataset path, samples and statistics, and decoded again otherwise.
+
+    Args:
+        directory: The dataset directory.
+        output_directory: The sweep output directory.
+        statistics: The report of `validation.scan_dataset` used to decode
+            the dataset.
+
+    Returns:
+        The cache file path.
+    """
+    cache_path = os.path.join(output_directory, CACHE_FILENAME)
+    source_path = os.path.join(output_directory, CACHE_SOURCE_FILENAME)
+
+    # Compare through json, so the statistics read back compare equal.
+    source = json.loads(json.dumps(get_cache_source(directory, statistics)))
+    if os.path.isfile(cache_path) and \
+            read_cache_source(source_path) == source:
+        logger.debug(f'Reusing {cache_path}')
+        return cache_path
+
+    # Remove the source first, so an interrupted decode is never reused.
+    if os.path.isfile(source_path):
+        os.remove(source_path)
+    logger.debug(f'Decoding {directory} to {cache_path}')
+    cache.preprocess_dataset(
+        directory,
+        cache_path,
+        num_workers=train.get_default_worker_count(),
+        statistics=statistics)
+
+    with open(source_path, 'w') as f:
+        json.dump(source, f, indent=4)
+    return cache_path
+
+
+def _init_trial_worker(thread_count: int):
+    """Configure a trial process to use its share of the cores.
+
+    Args:
+        thread_count: The number of torch threads of the process.
+    """
+    torch.set_num_threads(thread_count)
+
+
+def _run_trial(
+        directory: str,
+        dataset_path: str,
+        configuration: dict,
+        seed: int,
+        validation_split: float) -> dict:
+    """Train a model with one configuration of the sweep.
+
+    The training output is written to the log file of the trial, and the
+    best model to its checkpoint.
+
+    Args:
+        directory: The trial output directory.
+        dataset_path: The shared cache file.
+        configuration: The `train.train_model` keyword arguments.
+        seed: The seed of the model initialization and the samples order.
+        validation_split: The fraction of the samples held out to score the
+            trial on, the same samples for all the trials.
+
+    Returns:
+        The best score, the training duration, and the training time until
+        the target loss when one is given.
+    """
+    os.makedirs(directory, exist_ok=True)
+    checkpoint_path = os.path.join(directory, CHECKPOINT_FILENAME)
+    state_path = f'{checkpoint_path}.state'
+
+    torch.manual_seed(seed)
+    model = network.CNNModel()
+
+    start = time.perf_counter()
+    with open(os.path.join(directory, LOG_FILENAME), 'w') as f, \
+            contextlib.redirect_stdout(f):
+        # The samples are read from the mapped cache in the trial process.
+        train.train_model(
+            model,
+            dataset_path,
+            num_workers=0,
+            checkpoint_path=checkpoint_path,
+            validation_split=validation_split,
+            state_path=state_path,
+            seed=seed,
+            **configuration)
+    duration = time.perf_counter() - start
+
+    # The training state holds the best score of the training.
+    state = checkpoint.load_training_state(state_path)
+    return {
+        'score': state['progress']['lowest_score'],
+        'duration': duration,
+        'target_time': state['progress']['target_time'],
+    }
+
+
+def run_sweep(
+        dataset_path: str,
+        output_directory: str,
+        configurations: list[dict],
+        process_count: int = 1,
+        statistics: dict | None = None,
+        validation_split: float = 0.1,
+        seed: int = 0) -> list[dict]:
+    """Train a model for each configuration with a process pool.
+
+    A dataset directory is decoded once into a cache file in the output
+    directory, reused by the next sweeps of the same data, see
+    `prepare_cache`. All the trials map the same cache file, so the decoded
+    samples are shared through the page cache. The cores are split evenly
+    between the trial processes.
+
+    Args:
+        dataset_path: The dataset directory, or a cache file created with
+            `cache.preprocess_dataset`.
+        output_directory: The directory the cache, the trials checkpoints
+            and logs, and the results table are written to.
+        configurations: The `train.train_model` keyword arguments of each
+            trial, such as `learning_rate`, `batch_size` or `num_epochs`.
+        process_count: The number of trials trained at once.
+        statistics: The report of `validation.scan_dataset` used to decode a
+            dataset directory.
+        validation_split: The fraction of the samples held out to score the
+            trials on.
+        seed: The seed of the model initialization and the samples order,
+            the same for all the trials.
+
+    Returns:
+        The result of each trial, sorted by score, the failed trials last.
+    """
+    os.makedirs(output_directory, exist_ok=True)
+
+    # Decode the dataset once for all the trials.
+    if os.path.isfile(dataset_path):
+        cache_path = dataset_path
+    else:
+        cache_path = prepare_cache(
+            dataset_path, output_directory, statistics=statistics)
+
+    process_count = max(1, min(process_count, len(configurations)))
+    thread_count = max(1, train.get_cpu_count() // process_count)
+
+    results = []
+    # Spawn the processes, torch does not support forking a process using
+    # its thread pool.
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=process_count,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_trial_worker,
+            initargs=(thread_count,)) as executor:
+        futures = {}
+        for index, configuration in enumerate(configurations):
+            directory = os.path.join(output_directory, get_trial_name(index))
+            future = executor.submit(
+                _run_trial,
+                directory,
+                cache_path,
+                configuration,
+                seed,
+                validation_split)
+            futures[future] = (index, directory, configuration)
+
+        for future in concurrent.futures.as_completed(futures):
+            index, directory, configuration = futures[future]
+            result = {
+                'trial': get_trial_name(index),
+                **configuration,
+                'score': None,
+                'duration': None,
+                'target_time': None,
+                'checkpoint': os.path.join(directory, CHECKPOINT_FILENAME),
+                'error': None,
+            }
+            try:
+                result.update(future.result())
+            except Exception as e:
+                logger.warning(f'{result["trial"]} failed: {e}')
+                result['error'] = str(e)
+            results.append(result)
+
+    results.sort(key=lambda result: (
+        result['score'] is None, result['score'] or 0.0, result['trial']))
+    write_results(os.path.join(output_directory, RESULTS_FILENAME), results)
+    return results
+
+
+def write_results(filepath: str, results: list[dict]):
+    """Write the results table of a sweep.
+
+    Args:
+        filepath: The CSV file path.
+        results: The results returned by `run_sweep`.
+    """
+    fieldnames = []
+    for result in results:
+        fieldnames.extend(name for name in result if name not in fieldnames)
+
+    with open(filepath, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(results)
@@ -0,0 +1,373 @@
+import json
+import os
+
+import numpy
+
+import torch
+
+from mllighting import log
+from mllighting.ml import manifest
+
+
+logger = log.LoggerManager.get_logger(__name__)
+
+
+INDEX_FILENAME = 'targets.json'
+# The arrays of the tables indexed without their filenames.
+TRANSLATIONS_FILENAME = 'targets_translations.npy'
+OFFSETS_FILENAME = 'targets_offsets.npy'
+MATRICES_FILENAME = 'targets_matrices.npy'
+
+
+class TargetTable:
+    """The light targets of a dataset compiled into memory mapped arrays.
+
+    The table is created with `update_targets` and is stored in the dataset
+    directory:
+
+    ```
+    |- dataset directory
+       |- targets.json
+       |- targets_translations.GENERATION.npy
+       |- targets_offsets.GENERATION.npy
+       |- targets_matrices.GENERATION.npy
+    ```
+
+    The lights of all the samples are stored one after the other, the
+    lights of the sample at row `r` are between `offsets[r]` and
+    `offsets[r + 1]`. The full matrices are only stored when requested.
+    The index lists the arrays of the table, each update writes new arrays
+    and replacing the index commits them.
+
+    The fingerprint of each light json file is stored with the table. The
+    samples whose file changed since the table was built are checked once,
+    when the table is opened, and left out of its rows.
+    """
+
+    def __init__(self, directory: str, validate: bool = True):
+        """Initialize the table.
+
+        Args:
+            directory: The dataset directory.
+            validate: Leave out the samples whose light json file changed
+                since the table was built.
+        """
+        self.directory = directory
+
+        index = read_index(directory)
+        self.has_matrices = index['matrices']
+        self.filenames = get_array_filenames(index)
+        self.rows = {
+            sample['name']: row
+            for row, sample in enumerate(index['samples'])}
+
+        if validate:
+            stale = [
+                name for name, row in self.rows.items()
+                if not is_current(
+                    os.path.join(directory, name, 'light.json'),
+                    index['samples'][row]['light'])]
+            for name in stale:
+                del self.rows[name]
+            if stale:
+                logger.warning(
+                    f'{len(stale)} light json files of {directory} changed '
+                    'since the target table was built, they are read from '
+                    'the json files')
+
+        # The arrays are mapped lazily in each process.
+        self._arrays = None
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def arrays(self) -> dict[str, numpy.ndarray]:
+        """The memory mapped arrays of the table."""
+        if self._arrays is None:
+            self._arrays = {
+                name: numpy.load(
+                    os.path.join(self.directory, filename), mmap_mode='r')
+                for name, filename in self.filenames.items()}
+        return self._arrays
+
+    def get_light_count(self, row: int) -> int:
+        """Get the number of lights of a sample.
+
+        Args:
+            row: The sample row in the table.
+
+        Returns:
+            The light count.
+        """
+        offsets = self.arrays['offsets']
+        return int(offsets[row + 1] - offsets[row])
+
+    def get_light_positions(self, row: int) -> torch.Tensor:
+        """Get the light positions of a sample.
+
+        Args:
+            row: The sample row in the table.
+
+        Returns:
+            The light positions tensor, like `dataset.read_light_positions`.
+        """
+        offsets = self.arrays['offsets']
+        translations = self.arrays['translations'][
+            offsets[row]:offsets[row + 1]]
+        return torch.from_numpy(numpy.array(translations).reshape(-1))
+
+    def get_light_matrices(self, row: int) -> torch.Tensor:
+        """Get the full light matrices of a sample.
+
+        Args:
+            row: The sample row in the table.
+
+        Returns:
+            The (N, 16) light matrices tensor.
+        """
+        if not self.has_matrices:
+            raise ValueError(
+                f'The target table of {self.directory} has no matrices')
+        offsets = self.arrays['offsets']
+        matrices = self.arrays['matrices'][offsets[row]:offsets[row + 1]]
+        return torch.from_numpy(numpy.array(matrices))
+
+
+def read_light_matrices(filepath: str) -> list[list[float]]:
+    """Read the light matrices from a light json file.
+
+    Args:
+        filepath: The light json file path.
+
+    Returns:
+        The 16 values matrix of each light.
+    """
+    with open(filepath, 'r') as f:
+        lights_data = json.load(f)
+    return [light_dict['matrix'] for light_dict in lights_data]
+
+
+def get_fingerprint(filepath: str) -> list[int]:
+    """Get the fingerprint used to detect the changed light json files.
+
+    Args:
+        filepath: The light json file path.
+
+    Returns:
+        The file size and modification time in nanoseconds.
+    """
+    stat = os.stat(filepath)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def is_current(filepath: str, fingerprint: list[int]) -> bool:
+    """Check if a light json file did not change since it was compiled.
+
+    Args:
+        filepath: The light json file path.
+        fingerprint: The fingerprint of the compiled file.
+
+    Returns:
+        True if the file has the same fingerprint.
+    """
+    try:
+        return get_fingerprint(filepath) == fingerprint
+    except FileNotFoundError:
+        return False
+
+
+def get_array_filenames(index: dict) -> dict[str, str]:
+    """Get the filenames of the arrays of a target table.
+
+    Args:
+        index: The index of the table.
+
+    Returns:
+        The array filenames by array name.
+    """
+    if 'arrays' in index:
+        return index['arrays']
+
+    filenames = {
+        'translations': TRANSLATIONS_FILENAME,
+        'offsets': OFFSETS_FILENAME,
+    }
+    if index['matrices']:
+        filenames['matrices'] = MATRICES_FILENAME
+    return filenames
+
+
+def has_targets(directory: str) -> bool:
+    """Check if the dataset directory has a target table.
+
+    Args:
+        directory: The dataset directory.
+
+    Returns:
+        True if the directory contains a target table index.
+    """
+    return os.path.isfile(os.path.join(directory, INDEX_FILENAME))
+
+
+def read_index(directory: str) -> dict:
+    """Read the index of a target table.
+
+    Args:
+        directory: The dataset directory.
+
+    Returns:
+        The index, with the sample names and light json fingerprints in the
+        table order.
+    """
+    with open(os.path.join(directory, INDEX_FILENAME), 'r') as f:
+        return json.load(f)
+
+
+def _save_array(directory: str, filename: str, array: numpy.ndarray):
+    """Save an array of the table.
+
+    Args:
+        directory: The dataset directory.
+        filename: The array filename.
+        array: The array to save.
+    """
+    with open(os.path.join(directory, filename), 'wb') as f:
+        numpy.save(f, array)
+
+
+def _remove_arrays(directory: str, kept: set[str]):
+    """Remove the arrays of the previous tables.
+
+    Args:
+        directory: The dataset directory.
+        kept: The filenames of the arrays to keep.
+    """
+    with os.scandir(directory) as entries:
+        filenames = [
+            entry.name for entry in entries
+            if entry.name.startswith('targets_') and
+            entry.name.endswith('.npy') and entry.name not in kept]
+    for filename in filenames:
+        try:
+            os.remove(os.path.join(directory, filename))
+        except OSError as e:
+            logger.debug(f'Could not remove {filename}: {e}')
+
+
+def update_targets(
+        directory: str,
+        matrices: bool | None = None,
+        full: bool = False) -> TargetTable:
+    """Compile the light json files of a dataset into the target table.
+
+    Only the light json files added or changed since the previous table are
+    parsed again.
+
+    Args:
+        directory: The dataset directory.
+        matrices: Store the full light matrices. Defaults to the previous
+            table setting, or False.
+        full: Parse every light json file instead of only the changed ones.
+
+    Returns:
+        The updated table.
+    """
+    previous = None
+    previous_index = None
+    if has_targets(directory):
+        previous_index = read_index(directory)
+    if not full and previous_index is not None:
+        # The fingerprints are compared below.
+        previous = TargetTable(directory, validate=False)
+        if matrices is None:
+            matrices = previous.has_matrices
+        elif matrices and not previous.has_matrices:
+            previous = None
+    matrices = bool(matrices)
+
+    samples = []
+    sample_matrices = []
+    parsed_count = 0
+    for name in manifest.get_sample_names(directory):
+        filepath = os.path.join(directory, name, 'light.json')
+        try:
+            fingerprint = get_fingerprint(filepath)
+        except FileNotFoundError:
+            logger.warning(f'Missing {filepath}')
+            continue
+
+        row = None if previous is None else previous.rows.get(name)
+        if row is not None and \
+                previous_index['samples'][row]['light'] == fingerprint:
+            offsets = previous.arrays['offsets']
+            if matrices:
+                values = numpy.array(previous.get_light_matrices(row))
+            else:
+                # Only the translations are kept, pad them to the matrix
+                # layout.
+                values = numpy.zeros((previous.get_light_count(row), 16))
+                values[:, 12:15] = previous.arrays['translations'][
+                    offsets[row]:offsets[row + 1]]
+        else:
+            try:
+                values = numpy.array(
+                    read_light_matrices(filepath), dtype=numpy.float32)
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning(f'Invalid {filepath}: {e}')
+                continue
+            parsed_count += 1
+
+        samples.append({'name': name, 'light': fingerprint})
+        sample_matrices.append(values.reshape(-1, 16))
+
+    counts = [len(values) for values in sample_matrices]
+    offsets = numpy.zeros(len(counts) + 1, dtype=numpy.int64)
+    numpy.cumsum(counts, out=offsets[1:])
+    all_matrices = numpy.concatenate(
+        sample_matrices or [numpy.empty((0, 16))]).astype(numpy.float32)
+
+    logger.debug(
+        f'Target table of {directory} built with {len(samples)} samples, '
+        f'{parsed_count} parsed')
+
+    # Write the arrays under new names, the readers of the previous table
+    # keep reading its arrays until the index is replaced.
+    generation = 1
+    if previous_index is not None:
+        generation = previous_index.get('generation', 0) + 1
+    arrays = {
+        'translations': numpy.ascontiguousarray(all_matrices[:, 12:15]),
+        'offsets': offsets,
+    }
+    if matrices:
+        arrays['matrices'] = all_matrices
+    filenames = {}
+    for name, array in arrays.items():
+        filenames[name] = f'targets_{name}.{generation}.npy'
+        _save_array(directory, filenames[name], array)
+
+    index = {
+        'version': 2,
+        'generation': generation,
+        'matrices': matrices,
+        'arrays': filenames,
+        'samples': samples,
+    }
+    filepath = os.path.join(directory, INDEX_FILENAME)
+    with open(f'{filepath}.tmp', 'w') as f:
+        json.dump(index, f)
+    os.replace(f'{filepath}.tmp', filepath)
+
+    # Keep the arrays of the previous table for the tables already opened.
+    kept = set(filenames.values())
+    if previous_index is not None:
+        kept.update(get_array_filenames(previous_index).values())
+    _remove_arrays(directory, kept)
+
+    return TargetTable(directory, validate=False)
@@ -1,11 +1,220 @@
-import copy
+import contextlib
+import math
+import os
+import time
+import typing
 
 import torch
 import torch.nn as torch_nn
 import torch.utils.data as torch_data
+import torch.optim.lr_scheduler as torch_lr_scheduler
 import torch.optim.optimizer as torch_optimizer
 
-from mllighting.ml import constants, dataset
+from mllighting.ml import (
+    augment, cache, checkpoint, constants, dataset, distributed, evaluation,
+    mixed_precision, network, profiling, sampling, schedules, sharedcache,
+    shards)
+
+
+def load_dataset(
+        path: str,
+        pin_memory: bool = False,
+        statistics: dict | None = None,
+        shuffle: bool = True) -> torch_data.Dataset:
+    """Load the dataset stored at the given path.
+
+    Args:
+        path: The dataset directory, a cache file created with
+            `cache.preprocess_dataset` or a shard directory created with
+            `shards.write_shards`.
+        pin_memory: Allocate the batches loaded in the main process in pinned
+            memory, when supported by the dataset.
+        statistics: The report of `validation.scan_dataset`, to skip the
+            invalid samples and normalize the EXR maps of a dataset or shard
+            directory. Caches are normalized when they are created.
+        shuffle: Shuffle the samples of a shard directory, the order of the
+            other datasets is set by the loader.
+
+    Returns:
+        The dataset.
+    """
+    if os.path.isfile(path):
+        return cache.CachedRenderMapsDataset(path)
+    if shards.is_shard_directory(path):
+        return shards.ShardedRenderMapsDataset(
+            path, shuffle=shuffle, statistics=statistics)
+    return dataset.RenderMapsDataset(
+        path, pin_memory=pin_memory, statistics=statistics)
+
+
+def get_collate_function(data: torch_data.Dataset) -> typing.Callable | None:
+    """Get the DataLoader collate function for the dataset.
+
+    Datasets loading whole batches at once already return collated batches.
+
+    Args:
+        data: The dataset to load.
+
+    Returns:
+        The collate function, None to use the default one.
+    """
+    if isinstance(data, torch_data.Subset):
+        data = data.dataset
+    if hasattr(data, '__getitems__'):
+        return dataset.collate_batch
+    return None
+
+
+def is_shuffleable(data: torch_data.Dataset) -> bool:
+    """Check if the DataLoader can shuffle the dataset.
+
+    Iterable datasets shuffle their samples on their own.
+
+    Args:
+        data: The dataset to check.
+
+    Returns:
+        True if the DataLoader can shuffle the dataset.
+    """
+    return not isinstance(data, torch_data.IterableDataset)
+
+
+def get_cpu_count() -> int:
+    """Get the number of cores available to the process.
+
+    The cores are shared between the distributed training processes running
+    on the machine.
+
+    Returns:
+        The number of cores.
+    """
+    try:
+        cpu_count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpu_count = os.cpu_count() or 1
+    return max(1, cpu_count // distributed.get_local_world_size())
+
+
+def get_default_worker_count() -> int:
+    """Get the default number of DataLoader workers from the core count.
+
+    A core is kept for the main process running the model.
+
+    Returns:
+        The number of workers.
+    """
+    return min(get_cpu_count() - 1, 8)
+
+
+def get_thread_count(num_workers: int) -> int:
+    """Get the number of torch threads to use in the main process.
+
+    The cores are shared between the DataLoader workers and the main process
+    to not oversubscribe them.
+
+    Args:
+        num_workers: The number of DataLoader workers.
+
+    Returns:
+        The number of threads.
+    """
+    return max(1, get_cpu_count() - num_workers)
+
+
+def get_loader_options(
+        device: torch.device = torch.device('cpu'),
+        num_workers: int | None = None,
+        pin_memory: bool | None = None,
+        persistent_workers: bool = False,
+        prefetch_factor: int | None = None) -> dict:
+    """Get the DataLoader keyword arguments to load the data in parallel.
+
+    Args:
+        device: The device the data is loaded to.
+        num_workers: The number of worker processes. Defaults to a number
+            based on the core count.
+        pin_memory: Load the data in pinned memory. Defaults to True when
+            the device is a GPU.
+        persistent_workers: Keep the worker processes alive between epochs.
+        prefetch_factor: The number of batches loaded in advance by each
+            worker.
+
+    Returns:
+        The DataLoader keyword arguments.
+    """
+    if num_workers is None:
+        num_workers = get_default_worker_count()
+    if pin_memory is None:
+        pin_memory = device.type == 'cuda'
+
+    options = {
+        'num_workers': num_workers,
+        'pin_memory': pin_memory,
+    }
+    if num_workers > 0:
+        options['persistent_workers'] = persistent_workers
+        options['prefetch_factor'] = prefetch_factor
+        options['worker_init_fn'] = dataset.init_worker
+    return options
+
+
+def split_dataset(
+        data: torch_data.Dataset,
+        validation_split: float,
+        seed: int = 0) -> tuple[torch_data.Dataset, torch_data.Dataset]:
+    """Split a dataset into a training and a validation dataset.
+
+    The split is drawn from a fixed seed, so the validation samples are the
+    same across runs.
+
+    Args:
+        data: The dataset to split.
+        validation_split: The fraction of the samples used for validation.
+        seed: The seed of the split.
+
+    Returns:
+        The training and validation datasets.
+    """
+    if isinstance(data, torch_data.IterableDataset):
+        raise ValueError('Streamed datasets can not be split for validation')
+
+    generator = torch.Generator().manual_seed(seed)
+    train_subset, validation_subset = torch_data.random_split(
+        data, [1.0 - validation_split, validation_split], generator=generator)
+
+    # An empty validation set would score every epoch 0.
+    if len(train_subset) == 0 or len(validation_subset) == 0:
+        raise ValueError(
+            f'A validation split of {validation_split} leaves '
+            f'{len(train_subset)} training and {len(validation_subset)} '
+            f'validation samples out of {len(data)}')
+    return train_subset, validation_subset
+
+
+def get_sampler(
+        data: torch_data.Dataset,
+        shuffle: bool,
+        seed: int = 0) -> sampling.ResumableSampler | None:
+    """Get the sampler of the dataset.
+
+    The sampler splits the dataset between the distributed processes, and
+    lets a resumed training skip the samples already trained on.
+
+    Args:
+        data: The dataset to sample.
+        shuffle: Shuffle the samples.
+        seed: The seed of the shuffle.
+
+    Returns:
+        The sampler, None for streamed datasets.
+    """
+    if is_shuffleable(data):
+        return sampling.ResumableSampler(data, shuffle=shuffle, seed=seed)
+    if distributed.is_distributed():
+        raise ValueError(
+            'Streamed datasets are not supported in distributed training, '
+            'their processes could get a different number of batches')
+    return None
 
 
 def get_loss_function() -> torch_nn.Module:
@@ -17,91 +226,572 @@ def get_loss_function() -> torch_nn.Module:
     return torch_nn.MSELoss()
 
 
-def train_loop(
+def evaluate(
         model: torch_nn.Module,
         loader: torch_data.DataLoader,
         criterion: torch_nn.Module,
-        optimizer: torch_optimizer.Optimizer,
-        num_epochs: int = constants.EPOCH_COUNT,
-        device: torch.device = torch.device('cpu')) -> torch_nn.Module:
-    """Train the model for a number of epoch and returns the best version.
+        device: torch.device = torch.device('cpu'),
+        precision: str = 'fp32',
+        results: evaluation.ResultsWriter | None = None) -> float:
+    """Compute the average loss of the model over a dataset.
+
+    The loss is accumulated on the device, and only read back once all the
+    batches are evaluated. In a distributed training, the loss is averaged
+    over the samples of all the processes.
 
     Args:
-        model: The model to train.
-        loader: The loader of the data to train on.
-        criterion: The loss funtion to use for the training.
-        optimizer: The optimizer function to use for the training.
-        num_epochs: The number of epoch to train the model.
-        device: The device to run the train on.
+        model: The model to evaluate.
+        loader: The loader of the data to evaluate on.
+        criterion: The loss function, averaging over the batch.
+        device: The device to run the evaluation on.
+        precision: The precision to run the model with, from
+            `mixed_precision.PRECISIONS`.
+        results: The writer the per sample errors are streamed to, in the
+            loader order. Not supported in a distributed training.
 
     Returns:
-        The best trained model.
+        The loss averaged over all the samples.
     """
-    lowest_score = 1e10
-    best_model = None
+    if results is not None and distributed.is_distributed():
+        raise ValueError(
+            'The per sample errors can not be written in a distributed '
+            'evaluation')
 
-    for epoch in range(num_epochs):
-        print(f'Epoch {epoch+1}/{num_epochs}')
+    memory_format = network.get_memory_format(network.unwrap_model(model))
 
-        model.train()
+    model.eval()
+    total_loss = torch.zeros((), device=device)
+    sample_count = 0
+    with torch.no_grad():
         for inputs, targets in loader:
-            # Load the data.
-            inputs = inputs.to(device=device)
-            targets = targets.to(device=device)
+            inputs = inputs.to(
+                device=device,
+                memory_format=memory_format,
+                non_blocking=True)
+            targets = targets.to(device=device, non_blocking=True)
 
-            # Predict.
-            preds = model(inputs)
-            loss = criterion(preds, targets)
+            with mixed_precision.get_autocast(device, precision):
+                preds = model(inputs)
+            # Weight by the batch size, the last batch can be smaller.
+            total_loss += criterion(preds.float(), targets) * len(inputs)
+            sample_count += len(inputs)
 
-            # Compute the gradients.
-            optimizer.zero_grad()
-            loss.backward()
+            if results is not None:
+                results.write(preds, targets)
 
-            # Update the model.
-            optimizer.step()
+    # Sum the loss and the sample count of all the processes.
+    totals = torch.stack([
+        total_loss, torch.tensor(float(sample_count), device=device)])
+    total_loss, sample_count = distributed.all_reduce_sum(totals).tolist()
+    return total_loss / max(1.0, sample_count)
 
-        if loss < lowest_score:
-            print(f'New lowest: {loss}')
-            lowest_score = loss
 
-            best_model = copy.deepcopy(model)
-
-            # path = os.path.join(output_directory, f'model_{epoch}.pth')
-            # torch.save(model.state_dict(), path)
+def train_loop(
+        model: torch_nn.Module,
+        loader: torch_data.DataLoader,
+        criterion: torch_nn.Module,
+        optimizer: torch_optimizer.Optimizer,
+        num_epochs: int = constants.EPOCH_COUNT,
+        device: torch.device = torch.device('cpu'),
+        augmentation: augment.BatchAugmentation | None = None,
+        checkpoint_path: str | None = None,
+        validation_loader: torch_data.DataLoader | None = None,
+        precision: str = 'fp32',
+        state_path: str | None = None,
+        state_interval: int | None = None,
+        resume_state: dict | None = None,
+        accumulation_steps: int = 1,
+        profiler: profiling.StageProfiler | None = None,
+        scheduler: torch_lr_scheduler.LRScheduler | None = None,
+        early_stopping: schedules.EarlyStopping | None = None,
+        target_loss: float | None = None) -> torch_nn.Module:
+    """Train the model for a number of epoch and returns the best version.
 
-            # best_state = model.state_dict()
+    The best version is selected from the validation loss of each epoch, or
+    from the loss of the last batch of each epoch without validation data.
+    In a distributed training, the losses are averaged over the processes
+    and only the rank 0 process reports and writes the checkpoints.
 
-        print(f'Loss: {loss}')
+    Args:
+        model: The model to train.
+        loader: The loader of the data to train on.
+        criterion: The loss funtion to use for the training.
+        optimizer: The optimizer function to use for the training.
+        num_epochs: The number of epoch to train the model.
+        device: The device to run the train on.
+        augmentation: The augmentation applied on each batch.
+        checkpoint_path: The file the best state dict is written to, in a
+            background thread, each time the loss improves.
+        validation_loader: The loader of the data to select the best
+            version on.
+        precision: The precision to run the forward pass with, from
+            `mixed_precision.PRECISIONS`.
+        state_path: The file the full training state is written to at the
+            end of each epoch, in a background thread, to resume the
+            training.
+        state_interval: Also write the training state every number of
+            steps. Requires the loader to use a
+            `sampling.ResumableSampler`.
+        resume_state: The training state to resume from, loaded with
+            `checkpoint.load_training_state`.
+        accumulation_steps: The number of batches the gradients are
+            accumulated over before each model update.
+        profiler: The profiler timing the stages of the steps, its summary
+            is printed at the end of each epoch.
+        scheduler: The learning rate scheduler, stepped after each optimizer
+            step.
+        early_stopping: Stop the training when the score of the epochs
+            stops improving.
+        target_loss: Report the training time until the score reaches the
+            target loss.
 
-    if best_model is None:
+    Returns:
+        The model, with the best state loaded.
+    """
+    lowest_score = 1e10
+    # Snapshot the eager model, so the checkpoints of a compiled model load
+    # in both modes.
+    eager_model = network.unwrap_model(model)
+    best_state = checkpoint.StateSnapshot(eager_model)
+    has_best_state = False
+
+    # The model wrapped by DistributedDataParallel, if any, and the memory
+    # format the inputs are converted to.
+    distributed_model = getattr(model, '_orig_mod', model)
+    memory_format = network.get_memory_format(eager_model)
+
+    verbose = distributed.is_main_process()
+    sampler = getattr(loader, 'sampler', None)
+    resumable = isinstance(sampler, sampling.ResumableSampler)
+
+    # Restore the training progress.
+    start_epoch = 0
+    start_batch = 0
+    step = 0
+    elapsed = 0.0
+    target_time = None
+    if resume_state is not None:
+        eager_model.load_state_dict(resume_state['model'])
+        optimizer.load_state_dict(resume_state['optimizer'])
+        progress = resume_state['progress']
+        start_epoch = progress['epoch']
+        start_batch = progress['batch']
+        step = progress['step']
+        lowest_score = progress['lowest_score']
+        elapsed = progress.get('elapsed', 0.0)
+        target_time = progress.get('target_time')
+        if progress.get('stopped'):
+            start_epoch = num_epochs
+        if scheduler is not None and \
+                resume_state.get('scheduler') is not None:
+            scheduler.load_state_dict(resume_state['scheduler'])
+        if early_stopping is not None and \
+                progress.get('early_stopping') is not None:
+            early_stopping.load_state_dict(progress['early_stopping'])
+        if resume_state['best_model'] is not None:
+            best_state.load_state(resume_state['best_model'])
+            has_best_state = True
+        if start_batch > 0 and not resumable:
+            raise ValueError(
+                'The training state was saved in the middle of an epoch, '
+                'the loader must use a ResumableSampler')
+        if verbose:
+            print(f'Resuming at epoch {start_epoch+1}, batch {start_batch}')
+
+    writer = None
+    if checkpoint_path is not None and verbose:
+        writer = checkpoint.CheckpointWriter(eager_model, checkpoint_path)
+    # All the processes gather their random generator states.
+    state_writer = None
+    if state_path is not None:
+        state_writer = checkpoint.TrainingStateWriter(eager_model, state_path)
+
+    if profiler is None:
+        profiler = profiling.StageProfiler(device=device, enabled=False)
+    profiler.start()
+
+    # The training time excludes the time before a resumed training.
+    start_time = time.perf_counter() - elapsed
+
+    optimizer.zero_grad()
+    try:
+        for epoch in range(start_epoch, num_epochs):
+            if verbose:
+                print(f'Epoch {epoch+1}/{num_epochs}')
+            profiler.start_epoch()
+
+            # Shuffle the samples of the distributed processes differently
+            # at each epoch.
+            if hasattr(sampler, 'set_epoch'):
+                sampler.set_epoch(epoch)
+
+            # Skip the batches trained on before the training stopped,
+            # without loading them.
+            first_batch = start_batch if epoch == start_epoch else 0
+            if resumable:
+                sampler.set_start(first_batch * loader.batch_size)
+
+            model.train()
+            with profiler.stage('data'):
+                iterator = iter(loader)
+
+            # Restore the random generators once the loader iterator is
+            # created, they then draw the same values as the stopped run.
+            if resume_state is not None and epoch == start_epoch:
+                rng_states = resume_state['rng']
+                if len(rng_states) == distributed.get_world_size():
+                    checkpoint.set_rng_state(
+                        rng_states[distributed.get_rank()])
+                elif verbose:
+                    print(
+                        'The process count changed, the random generators '
+                        'are not restored')
+
+            batch_count = len(loader)
+            has_gradients = False
+            for batch, (inputs, targets) in enumerate(
+                    profiler.iterate(iterator), start=first_batch + 1):
+                profiler.add_samples(len(inputs))
+
+                # Load the data.
+                with profiler.stage('transfer'):
+                    inputs = inputs.to(device=device, non_blocking=True)
+                    targets = targets.to(device=device, non_blocking=True)
+
+                # Augment the whole batch at once.
+                with profiler.stage('augment'):
+                    if augmentation is not None:
+                        inputs, targets = augmentation(inputs, targets)
+                    inputs = inputs.contiguous(memory_format=memory_format)
+
+                # Update the model every number of accumulated batches, and
+                # with the last batches of the epoch. Streamed datasets can
+                # have more batches than expected, they are accumulated in
+                # full groups.
+                group_start = (batch - 1) // accumulation_steps \
+                    * accumulation_steps
+                group_size = accumulation_steps
+                if group_start < batch_count:
+                    group_size = min(group_size, batch_count - group_start)
+                is_step = batch - group_start == group_size
+
+                # Only synchronize the gradients of the distributed processes
+                # when the model is updated.
+                sync_context = contextlib.nullcontext()
+                if not is_step and isinstance(
+                        distributed_model,
+                        torch_nn.parallel.DistributedDataParallel):
+                    sync_context = distributed_model.no_sync()
+
+                with sync_context:
+                    # Predict, the loss is computed in float32.
+                    with profiler.stage('forward'):
+                        with mixed_precision.get_autocast(device, precision):
+                            preds = model(inputs)
+                        loss = criterion(preds.float(), targets)
+
+                    # Accumulate the gradients of the batch.
+                    with profiler.stage('backward'):
+                        (loss / group_size).backward()
+                    has_gradients = True
+
+                profiler.step()
+                if not is_step:
+                    continue
+
+                # Update the model.
+                with profiler.stage('optimizer'):
+                    optimizer.step()
+                    optimizer.zero_grad()
+                    if scheduler is not None:
+                        scheduler.step()
+                has_gradients = False
+                step += 1
+
+                # The state at the end of the epoch is written below, once
+                # the best model is updated.
+                if state_writer is not None and state_interval \
+                        and resumable and step % state_interval == 0 \
+                        and batch < batch_count:
+                    state_writer.submit(
+                        eager_model,
+                        optimizer,
+                        progress={
+                            'epoch': epoch,
+                            'batch': batch,
+                            'step': step,
+                            'lowest_score': lowest_score,
+                            'elapsed': time.perf_counter() - start_time,
+                            'target_time': target_time,
+                            'early_stopping': None
+                            if early_stopping is None
+                            else early_stopping.state_dict(),
+                        },
+                        best_state=best_state if has_best_state else None,
+                        scheduler=scheduler)
+
+            # Update the model with the last accumulated gradients.
+            if has_gradients:
+                with profiler.stage('optimizer'):
+                    optimizer.step()
+                    optimizer.zero_grad()
+                    if scheduler is not None:
+                        scheduler.step()
+                step += 1
+
+            score = distributed.all_reduce_mean(loss.detach().clone()).item()
+            if verbose:
+                print(f'Loss: {score}')
+                if scheduler is not None:
+                    print(f'Learning rate: {scheduler.get_last_lr()[0]}')
+
+            if validation_loader is not None:
+                with profiler.stage('validation'):
+                    score = evaluate(
+                        model,
+                        validation_loader,
+                        criterion,
+                        device=device,
+                        precision=precision)
+                if verbose:
+                    print(f'Validation loss: {score}')
+
+            if score < lowest_score:
+                if verbose:
+                    print(f'New lowest: {score}')
+                lowest_score = score
+
+                # Update the preallocated copy, the model is not duplicated.
+                best_state.update(eager_model)
+                has_best_state = True
+
+                if writer is not None:
+                    writer.submit(eager_model)
+
+            elapsed = time.perf_counter() - start_time
+            if target_loss is not None and target_time is None \
+                    and score <= target_loss:
+                target_time = elapsed
+                if verbose:
+                    print(f'Target loss reached in {target_time:.1f} s')
+
+            stopped = False
+            if early_stopping is not None:
+                stopped = early_stopping.update(score)
+                if stopped and verbose:
+                    print(
+                        f'Early stopping, no improvement in '
+                        f'{early_stopping.bad_epochs} epochs')
+
+            if state_writer is not None:
+                state_writer.submit(
+                    eager_model,
+                    optimizer,
+                    progress={
+                        'epoch': epoch + 1,
+                        'batch': 0,
+                        'step': step,
+                        'lowest_score': lowest_score,
+                        'elapsed': elapsed,
+                        'target_time': target_time,
+                        'early_stopping': None
+                        if early_stopping is None
+                        else early_stopping.state_dict(),
+                        'stopped': stopped,
+                    },
+                    best_state=best_state if has_best_state else None,
+                    scheduler=scheduler)
+
+            summary = profiler.end_epoch()
+            if summary is not None and verbose:
+                print(f'Profile: {profiling.format_summary(summary)}')
+
+            if stopped:
+                break
+    finally:
+        profiler.stop()
+
+        # Wait for the last checkpoint and training state to be written,
+        # even if the training failed.
+        if writer is not None:
+            writer.close()
+        if state_writer is not None:
+            state_writer.close()
+
+    if not has_best_state:
         raise ValueError('No best model found. This should not happen')
 
-    return best_model
+    if verbose:
+        print(f'Training time: {elapsed:.1f} s')
+        if target_loss is not None:
+            if target_time is None:
+                print(f'Target loss {target_loss} not reached')
+            else:
+                print(
+                    f'Time to target loss {target_loss}: '
+                    f'{target_time:.1f} s')
+
+    best_state.load_into(eager_model)
+    return model
 
 
 def train_model(
         model: torch_nn.Module,
         dataset_directory: str,
         num_epochs: int = constants.EPOCH_COUNT,
-        device: torch.device = torch.device('cpu')) -> torch_nn.Module:
+        device: torch.device = torch.device('cpu'),
+        num_workers: int | None = None,
+        pin_memory: bool | None = None,
+        persistent_workers: bool = True,
+        prefetch_factor: int | None = None,
+        augmentation: augment.BatchAugmentation | None = None,
+        shared_cache_size: int | None = None,
+        statistics: dict | None = None,
+        checkpoint_path: str | None = None,
+        validation_split: float = 0.0,
+        precision: str = 'fp32',
+        compiled: bool = False,
+        state_path: str | None = None,
+        state_interval: int | None = None,
+        resume: bool = False,
+        seed: int = 0,
+        batch_size: int = constants.BATCH_SIZE,
+        accumulation_steps: int = 1,
+        channels_last: bool = False,
+        learning_rate: float = 1e-3,
+        profiler: profiling.StageProfiler | None = None,
+        schedule: str = 'constant',
+        warmup: float = 0.05,
+        patience: int | None = None,
+        min_delta: float = 0.0,
+        target_loss: float | None = None) -> torch_nn.Module:
     """Train the model for a number of epoch and returns the best version.
 
     Args:
         model: The model to train.
-        dataset_directory: The dataset directory.
+        dataset_directory: The dataset directory, or any dataset path
+            supported by `load_dataset`.
+        num_epochs: The number of epoch to train the model.
         device: The device to run the train on.
+        num_workers: The number of DataLoader worker processes. Defaults to a
+            number based on the core count.
+        pin_memory: Load the data in pinned memory. Defaults to True when
+            the device is a GPU.
+        persistent_workers: Keep the worker processes alive between epochs.
+        prefetch_factor: The number of batches loaded in advance by each
+            worker.
+        augmentation: The augmentation applied on each batch. Defaults to
+            the random beauty gamma.
+        shared_cache_size: The size in bytes of the shared memory cache of
+            the decoded samples, shared by the DataLoader workers. Only
+            used for dataset directories.
+        statistics: The report of `validation.scan_dataset`, to skip the
+            invalid samples and normalize the EXR maps.
+        checkpoint_path: The file the best state dict is written to each
+            time the loss improves.
+        validation_split: The fraction of the samples held out to select the
+            best model on. The best model is selected on the training loss
+            if 0.
+        precision: The precision to run the model with, from
+            `mixed_precision.PRECISIONS`.
+        compiled: Train the model compiled with `network.compile_model`.
+        state_path: The file the full training state is written to at the
+            end of each epoch.
+        state_interval: Also write the training state every number of
+            steps.
+        resume: Resume the training from the state file, if it exists.
+        seed: The seed of the samples order.
+        batch_size: The number of samples of each batch, per process.
+        accumulation_steps: The number of batches the gradients are
+            accumulated over before each model update, so the effective
+            batch size is `batch_size * accumulation_steps` per process.
+        channels_last: Run the convolutions in the channels last memory
+            format, usually faster on CPU.
+        learning_rate: The learning rate of the optimizer.
+        profiler: The profiler timing the stages of the training steps.
+        schedule: The learning rate schedule, from `schedules.SCHEDULES`.
+            The learning rate is the peak learning rate of the schedule.
+        warmup: The fraction of the steps the learning rate is warmed up
+            over by the schedule.
+        patience: Stop the training after this number of epochs without
+            improvement of the score. Trains all the epochs if not set.
+        min_delta: The decrease of the score counted as an improvement.
+        target_loss: Report the training time until the score reaches the
+            target loss.
 
     Returns:
-        The best trained model.
+        The best trained model, not compiled.
     """
     lossfunc = get_loss_function()
+    if augmentation is None:
+        augmentation = augment.get_augmentation()
+
     # Define optimiser.
-    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=learning_rate)
 
     # Load the data.
-    train_dataset = dataset.RenderMapsDataset(dataset_directory)
+    loader_options = get_loader_options(
+        device=device,
+        num_workers=num_workers,
+        pin_memory=pin_memory,
+        persistent_workers=persistent_workers,
+        prefetch_factor=prefetch_factor)
+    train_dataset = load_dataset(
+        dataset_directory,
+        pin_memory=loader_options['pin_memory'],
+        statistics=statistics)
+    if shared_cache_size and \
+            isinstance(train_dataset, dataset.RenderMapsDataset):
+        train_dataset = sharedcache.SharedCacheDataset(
+            train_dataset, shared_cache_size)
+    full_dataset = train_dataset
+
+    # The loaders draw the worker seeds from their own generator, so the
+    # global random generator only depends on the training steps.
+    validation_loader = None
+    if validation_split > 0.0:
+        train_dataset, validation_dataset = split_dataset(
+            train_dataset, validation_split)
+        validation_loader = torch_data.DataLoader(
+            validation_dataset,
+            batch_size=constants.EVALUATION_BATCH_SIZE,
+            sampler=get_sampler(validation_dataset, False),
+            collate_fn=get_collate_function(validation_dataset),
+            generator=torch.Generator(),
+            **loader_options)
+
     train_loader = torch_data.DataLoader(
-        train_dataset, batch_size=constants.BATCH_SIZE, shuffle=True)
+        train_dataset,
+        batch_size=batch_size,
+        sampler=get_sampler(train_dataset, True, seed=seed),
+        collate_fn=get_collate_function(train_dataset),
+        generator=torch.Generator(),
+        **loader_options)
+
+    # The schedule is stepped after each optimizer step.
+    steps_per_epoch = math.ceil(len(train_loader) / accumulation_steps)
+    scheduler = schedules.get_scheduler(
+        schedule, optimizer, steps_per_epoch * num_epochs, warmup=warmup)
+    early_stopping = None
+    if patience is not None:
+        early_stopping = schedules.EarlyStopping(patience, min_delta)
+
+    resume_state = None
+    if resume and state_path is not None and os.path.isfile(state_path):
+        resume_state = checkpoint.load_training_state(state_path)
+
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+
+    # Synchronize the gradients of the distributed processes.
+    if distributed.is_distributed():
+        model = torch_nn.parallel.DistributedDataParallel(
+            model,
+            device_ids=[device.index] if device.type == 'cuda' else None)
+
+    if compiled:
+        model = network.compile_model(
+            model, batch_size=batch_size, training=True)
 
     best_model = train_loop(
         model,
@@ -109,21 +799,105 @@ def train_model(
         lossfunc,
         optimizer,
         num_epochs=num_epochs,
-        device=device)
+        device=device,
+        augmentation=augmentation,
+        checkpoint_path=checkpoint_path,
+        validation_loader=validation_loader,
+        precision=precision,
+        state_path=state_path,
+        state_interval=state_interval,
+        resume_state=resume_state,
+        accumulation_steps=accumulation_steps,
+        profiler=profiler,
+        scheduler=scheduler,
+        early_stopping=early_stopping,
+        target_loss=target_loss)
+
+    if isinstance(full_dataset, sharedcache.SharedCacheDataset) and \
+            distributed.is_main_process():
+        print(f'Shared cache: {full_dataset.stats()}')
+
+    return network.unwrap_model(best_model)
+
+
+def get_test_loader(
+        dataset_directory: str,
+        device: torch.device = torch.device('cpu'),
+        num_workers: int | None = None,
+        pin_memory: bool | None = None,
+        prefetch_factor: int | None = None,
+        statistics: dict | None = None,
+        batch_size: int = constants.EVALUATION_BATCH_SIZE)\
+        -> torch_data.DataLoader:
+    """Get the loader of a test dataset, always in the same order.
 
-    return best_model
+    Args:
+        dataset_directory: The dataset to use as test, or any dataset path
+            supported by `load_dataset`.
+        device: The device the data is loaded to.
+        num_workers: The number of DataLoader worker processes. Defaults to a
+            number based on the core count.
+        pin_memory: Load the data in pinned memory. Defaults to True when
+            the device is a GPU.
+        prefetch_factor: The number of batches loaded in advance by each
+            worker.
+        statistics: The dataset statistics the model was trained with.
+        batch_size: The number of samples evaluated at once.
+
+    Returns:
+        The loader.
+    """
+    loader_options = get_loader_options(
+        device=device,
+        num_workers=num_workers,
+        pin_memory=pin_memory,
+        prefetch_factor=prefetch_factor)
+    test_dataset = load_dataset(
+        dataset_directory,
+        pin_memory=loader_options['pin_memory'],
+        statistics=statistics,
+        shuffle=False)
+    return torch_data.DataLoader(
+        test_dataset,
+        batch_size=batch_size,
+        shuffle=False,
+        collate_fn=get_collate_function(test_dataset),
+        **loader_options)
 
 
 def test_model(
         model: torch_nn.Module,
         dataset_directory: str,
-        device: torch.device = torch.device('cpu')) -> float:
+        device: torch.device = torch.device('cpu'),
+        num_workers: int | None = None,
+        pin_memory: bool | None = None,
+        prefetch_factor: int | None = None,
+        statistics: dict | None = None,
+        precision: str = 'fp32',
+        batch_size: int = constants.EVALUATION_BATCH_SIZE,
+        results_path: str | None = None) -> float:
     """Test the given model on the specified data set.
 
+    The samples are evaluated in batches, always in the same order.
+
     Args:
         model: The model to test.
-        dataset_directory: The dataset to use as test.
+        dataset_directory: The dataset to use as test, or any dataset path
+            supported by `load_dataset`.
         device: The device to run the test on.
+        num_workers: The number of DataLoader worker processes. Defaults to a
+            number based on the core count.
+        pin_memory: Load the data in pinned memory. Defaults to True when
+            the device is a GPU.
+        prefetch_factor: The number of batches loaded in advance by each
+            worker.
+        statistics: The dataset statistics the model was trained with.
+        precision: The precision to run the model with, from
+            `mixed_precision.PRECISIONS`.
+        batch_size: The number of samples evaluated at once.
+        results_path: The `.npy` file the prediction, the light position
+            distance and the loss of each sample are streamed to, in the
+            evaluation order. See `evaluation.ResultsWriter`.
 
     Returns:
         The average loss value.
@@ -131,20 +905,76 @@ def test_model(
     lossfunc = get_loss_function()
 
     # Load the data.
-    test_dataset = dataset.RenderMapsDataset(dataset_directory)
-    test_loader = torch_data.DataLoader(
-        test_dataset, shuffle=True)
+    test_loader = get_test_loader(
+        dataset_directory,
+        device=device,
+        num_workers=num_workers,
+        pin_memory=pin_memory,
+        prefetch_factor=prefetch_factor,
+        statistics=statistics,
+        batch_size=batch_size)
 
     # Run the model on the data set and get the average loss.
-    model.eval()
-    running_loss = 0.0
-    with torch.no_grad():
-        for inputs, targets in test_loader:
-            inputs = inputs.to(device=device)
-            targets = targets.to(device=device)
+    if results_path is None:
+        return evaluate(
+            model, test_loader, lossfunc, device=device, precision=precision)
+
+    with evaluation.ResultsWriter(
+            results_path, len(test_loader.dataset)) as results:
+        return evaluate(
+            model,
+            test_loader,
+            lossfunc,
+            device=device,
+            precision=precision,
+            results=results)
+
+
+def test_models(
+        models: list[torch_nn.Module],
+        dataset_directory: str,
+        device: torch.device = torch.device('cpu'),
+        num_workers: int | None = None,
+        pin_memory: bool | None = None,
+        prefetch_factor: int | None = None,
+        statistics: dict | None = None,
+        precision: str = 'fp32',
+        batch_size: int = constants.EVALUATION_BATCH_SIZE,
+        vectorized: bool = False) -> list[dict]:
+    """Test several models on the specified data set, decoding it once.
 
-            preds = model(inputs)
-            loss = lossfunc(preds, targets)
-            running_loss += loss
+    Args:
+        models: The models to test, trained with the same statistics.
+        dataset_directory: The dataset to use as test, or any dataset path
+            supported by `load_dataset`.
+        device: The device to run the test on.
+        num_workers: The number of DataLoader worker processes. Defaults to a
+            number based on the core count.
+        pin_memory: Load the data in pinned memory. Defaults to True when
+            the device is a GPU.
+        prefetch_factor: The number of batches loaded in advance by each
+            worker.
+        statistics: The dataset statistics the models were trained with.
+        precision: The precision to run the models with, from
+            `mixed_precision.PRECISIONS`.
+        batch_size: The number of samples evaluated at once.
+        vectorized: Run the models with a single `torch.func.vmap` forward
+            over their stacked parameters.
 
-    return running_loss/len(test_loader)
+    Returns:
+        The metrics of each model, see `evaluation.evaluate_models`.
+    """
+    test_loader = get_test_loader(
+        dataset_directory,
+        device=device,
+        num_workers=num_workers,
+        pin_memory=pin_memory,
+        prefetch_factor=prefetch_factor,
+        statistics=statistics,
+        batch_size=batch_size)
+
+    return evaluation.evaluate_models(
+        evaluation.ModelStack(models, vectorized=vectorized),
+        test_loader,
+        device=device,
+        precision=precision)
@@ -0,0 +1,217 @@
+import collections
+import concurrent.futures
+import functools
+import json
+import math
+import os
+
+import numpy
+
+import OpenImageIO
+
+from PIL import Image
+
+import torch
+
+from mllighting import log
+from mllighting.ml import dataset, manifest
+
+
+logger = log.LoggerManager.get_logger(__name__)
+
+
+STATISTICS_FILENAME = 'statistics.json'
+
+
+def check_sample(
+        sample_directory: str,
+        image_size: tuple[int, int] = (32, 32)) -> dict:
+    """Check the files of a sample and compute its EXR maps statistics.
+
+    Args:
+        sample_directory: The sample directory.
+        image_size: The size the EXR maps are read at for the statistics.
+
+    Returns:
+        The sample name, the error message if the sample is invalid, the
+        light count, and for each EXR map the per channel pixel count,
+        mean, sum of squared differences to the mean, min and max.
+    """
+    result = {
+        'name': os.path.basename(sample_directory),
+        'error': None,
+        'light_count': 0,
+        'statistics': {},
+    }
+    try:
+        for name in ('albedo', 'beauty'):
+            with Image.open(os.path.join(sample_directory, f'{name}.png')) \
+                    as image:
+                image.verify()
+
+        for name in dataset.EXR_MAP_CHANNELS:
+            pixels = dataset.read_resized_exr_pixels(
+                os.path.join(sample_directory, f'{name}.exr'),
+                image_size=image_size)
+            if pixels.shape[2] < 3:
+                raise ValueError(f'{name}.exr has less than 3 channels')
+            pixels = pixels[..., :3].reshape(-1, 3).astype(numpy.float64)
+            if not numpy.isfinite(pixels).all():
+                raise ValueError(f'{name}.exr has non finite values')
+
+            mean = pixels.mean(axis=0)
+            result['statistics'][name] = {
+                'count': len(pixels),
+                'mean': mean.tolist(),
+                'm2': ((pixels - mean) ** 2).sum(axis=0).tolist(),
+                'min': pixels.min(axis=0).tolist(),
+                'max': pixels.max(axis=0).tolist(),
+            }
+
+        with open(os.path.join(sample_directory, 'light.json'), 'r') as f:
+            lights_data = json.load(f)
+        if not isinstance(lights_data, list) or not lights_data:
+            raise ValueError('light.json does not contain a list of lights')
+        for light_dict in lights_data:
+            matrix = light_dict['matrix']
+            if len(matrix) != 16 or \
+                    not all(math.isfinite(value) for value in matrix):
+                raise ValueError('light.json has an invalid matrix')
+        result['light_count'] = len(lights_data)
+
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+
+    return result
+
+
+def merge_statistics(first: dict | None, second: dict) -> dict:
+    """Merge the per channel statistics of two sets of pixels.
+
+    Args:
+        first: The statistics of the first set, None if empty.
+        second: The statistics of the second set.
+
+    Returns:
+        The statistics of both sets.
+    """
+    if first is None:
+        return second
+
+    count = first['count'] + second['count']
+    first_mean = numpy.array(first['mean'])
+    second_mean = numpy.array(second['mean'])
+    delta = second_mean - first_mean
+    mean = first_mean + delta * second['count'] / count
+    m2 = numpy.array(first['m2']) + numpy.array(second['m2']) + \
+        delta ** 2 * first['count'] * second['count'] / count
+
+    return {
+        'count': count,
+        'mean': mean.tolist(),
+        'm2': m2.tolist(),
+        'min': numpy.minimum(first['min'], second['min']).tolist(),
+        'max': numpy.maximum(first['max'], second['max']).tolist(),
+    }
+
+
+def _init_scan_worker():
+    """Configure a scan worker process to use a single thread."""
+    OpenImageIO.attribute('threads', 1)
+    OpenImageIO.attribute('exr_threads', 1)
+    torch.set_num_threads(1)
+
+
+def scan_dataset(
+        directory: str,
+        num_workers: int | None = None,
+        image_size: tuple[int, int] = (32, 32),
+        chunk_size: int = 64) -> dict:
+    """Check every sample of a dataset directory with a process pool.
+
+    Args:
+        directory: The dataset directory.
+        num_workers: The number of processes. Defaults to the core count.
+        image_size: The size the EXR maps are read at for the statistics.
+        chunk_size: The number of samples sent to a process at once.
+
+    Returns:
+        The report, with the invalid samples and their error, the light
+        count histogram, and the per channel mean, std, min and max of the
+        EXR maps.
+    """
+    sample_names = manifest.get_sample_names(directory)
+    sample_directories = [
+        os.path.join(directory, name) for name in sample_names]
+
+    errors = {}
+    light_counts = collections.Counter()
+    statistics = {name: None for name in dataset.EXR_MAP_CHANNELS}
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=num_workers,
+            initializer=_init_scan_worker) as executor:
+        results = executor.map(
+            functools.partial(check_sample, image_size=image_size),
+            sample_directories,
+            chunksize=chunk_size)
+
+        for index, result in enumerate(results):
+            if result['error'] is not None:
+                logger.warning(f'Invalid {result["name"]}: {result["error"]}')
+                errors[result['name']] = result['error']
+                continue
+
+            light_counts[result['light_count']] += 1
+            for name, sample_statistics in result['statistics'].items():
+                statistics[name] = merge_statistics(
+                    statistics[name], sample_statistics)
+
+            if (index + 1) % 10000 == 0:
+                logger.debug(f'Scanned {index + 1}/{len(sample_names)}')
+
+    channels = {}
+    for name, map_statistics in statistics.items():
+        if map_statistics is None:
+            continue
+        variance = numpy.array(map_statistics['m2']) / map_statistics['count']
+        channels[name] = {
+            'mean': map_statistics['mean'],
+            'std': numpy.sqrt(variance).tolist(),
+            'min': map_statistics['min'],
+            'max': map_statistics['max'],
+        }
+
+    return {
+        'samples': len(sample_names),
+        'valid': len(sample_names) - len(errors),
+        'errors': errors,
+        'light_counts': {
+            str(count): total for count, total in light_counts.items()},
+        'channels': channels,
+    }
+
+
+def write_report(filepath: str, report: dict):
+    """Write a scan report.
+
+    Args:
+        filepath: The report file path.
+        report: The report created by `scan_dataset`.
+    """
+    with open(filepath, 'w') as f:
+        json.dump(report, f, indent=4)
+
+
+def read_report(filepath: str) -> dict:
+    """Read a scan report.
+
+    Args:
+        filepath: The report file path.
+
+    Returns:
+        The report.
+    """
+    with open(filepath, 'r') as f:
+        return json.load(f)
+
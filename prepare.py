@@ -0,0 +1,132 @@
+import argparse
+import os
+
+from mllighting.ml import cache, manifest, shards, targets, validation
+
+
+def preprocess(args: argparse.Namespace):
+    statistics = None
+    if args.statistics:
+        statistics = validation.read_report(args.statistics)
+
+    # Decode the whole dataset once into the cache file.
+    cache.preprocess_dataset(
+        args.directory,
+        args.output,
+        num_workers=args.workers,
+        storage=args.storage,
+        statistics=statistics)
+    print(f'Cache written to {args.output}')
+
+
+def shard(args: argparse.Namespace):
+    # Pack the dataset into tar shards.
+    shards.write_shards(
+        args.directory,
+        args.output,
+        samples_per_shard=args.samples_per_shard)
+    print(f'Shards written to {args.output}')
+
+
+def update_manifest(args: argparse.Namespace):
+    # Rescan the changed sample directories.
+    result = manifest.update_manifest(args.directory, full=args.full)
+    print(f'Manifest written with {len(result["samples"])} samples')
+
+    # Keep the target table in sync with the new samples.
+    if targets.has_targets(args.directory):
+        table = targets.update_targets(args.directory)
+        print(f'Target table written with {len(table)} samples')
+
+
+def update_targets(args: argparse.Namespace):
+    # Compile the light json files of the new and changed samples.
+    table = targets.update_targets(
+        args.directory, matrices=args.matrices, full=args.full)
+    print(f'Target table written with {len(table)} samples')
+
+
+def scan(args: argparse.Namespace):
+    # Check every sample and compute the EXR maps statistics.
+    report = validation.scan_dataset(args.directory, num_workers=args.workers)
+    output = args.output or os.path.join(
+        args.directory, validation.STATISTICS_FILENAME)
+    validation.write_report(output, report)
+    print(f'{report["valid"]}/{report["samples"]} valid samples')
+    for name, error in report['errors'].items():
+        print(f'{name}: {error}')
+    print(f'Report written to {output}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='ML Lighting dataset preparation script',
+        description='Dataset preparation script for the ML Lighting tool')
+    subparsers = parser.add_subparsers(required=True)
+
+    preprocess_parser = subparsers.add_parser(
+        'preprocess',
+        help='Decode the dataset into a memory mapped cache file')
+    preprocess_parser.add_argument('directory', help='The dataset directory')
+    preprocess_parser.add_argument('output', help='The cache file output')
+    preprocess_parser.add_argument(
+        '--workers', type=int, default=0,
+        help='The number of processes used to decode the samples')
+    preprocess_parser.add_argument(
+        '--storage', default='float32', choices=sorted(cache.STORAGE_TYPES),
+        help='The render maps storage, compact stores the PNG maps in '
+             '8 bits and the EXR maps in half precision')
+    preprocess_parser.add_argument(
+        '--statistics',
+        help='The scan report used to skip the invalid samples and '
+             'normalize the EXR maps')
+    preprocess_parser.set_defaults(func=preprocess)
+
+    shard_parser = subparsers.add_parser(
+        'shard',
+        help='Pack the dataset into tar shards to be streamed')
+    shard_parser.add_argument('directory', help='The dataset directory')
+    shard_parser.add_argument('output', help='The shard directory output')
+    shard_parser.add_argument(
+        '--samples-per-shard', type=int, default=1000,
+        help='The number of samples in each shard')
+    shard_parser.set_defaults(func=shard)
+
+    manifest_parser = subparsers.add_parser(
+        'manifest',
+        help='Build or update the manifest of the dataset')
+    manifest_parser.add_argument('directory', help='The dataset directory')
+    manifest_parser.add_argument(
+        '--full', action='store_true',
+        help='Scan every sample instead of only the changed ones')
+    manifest_parser.set_defaults(func=update_manifest)
+
+    targets_parser = subparsers.add_parser(
+        'targets',
+        help='Compile the light json files into a binary target table')
+    targets_parser.add_argument('directory', help='The dataset directory')
+    targets_parser.add_argument(
+        '--matrices', action=argparse.BooleanOptionalAction,
+        help='Store the full light matrices, defaults to the previous table '
+             'setting')
+    targets_parser.add_argument(
+        '--full', action='store_true',
+        help='Parse every light json file instead of only the changed ones')
+    targets_parser.set_defaults(func=update_targets)
+
+    scan_parser = subparsers.add_parser(
+        'scan',
+        help='Check the samples and compute the EXR maps statistics')
+    scan_parser.add_argument('directory', help='The dataset directory')
+    scan_parser.add_argument(
+        '--output',
+        help='The report output, defaults to statistics.json in the dataset '
+             'directory')
+    scan_parser.add_argument(
+        '--workers', type=int,
+        help='The number of processes, defaults to the core count')
+    scan_parser.set_defaults(func=scan)
+
+    args = parser.parse_args()
+
+    args.func(args)
@@ -0,0 +1,96 @@
+import argparse
+
+from mllighting.ml import constants, schedules, sweep, validation
+
+
+def main(args: argparse.Namespace):
+    # Read the dataset statistics.
+    statistics = None
+    if args.statistics:
+        statistics = validation.read_report(args.statistics)
+
+    # Train every combination of the parameters.
+    configurations = sweep.get_configurations({
+        'learning_rate': args.learning_rates,
+        'batch_size': args.batch_sizes,
+        'num_epochs': args.epochs,
+        'schedule': args.schedules,
+    })
+    for configuration in configurations:
+        configuration['patience'] = args.patience
+        configuration['target_loss'] = args.target_loss
+
+    results = sweep.run_sweep(
+        args.dataset,
+        args.output,
+        configurations,
+        process_count=args.processes,
+        statistics=statistics,
+        validation_split=args.validation_split,
+        seed=args.seed)
+
+    for result in results:
+        if result['error'] is not None:
+            print(f'{result["trial"]}: failed, {result["error"]}')
+            continue
+        text = (
+            f'{result["trial"]}: learning rate {result["learning_rate"]}, '
+            f'batch size {result["batch_size"]}, '
+            f'epochs {result["num_epochs"]}, '
+            f'schedule {result["schedule"]}, '
+            f'score {result["score"]:.6f}, '
+            f'{result["duration"]:.1f} s')
+        if result['target_time'] is not None:
+            text += f', target reached in {result["target_time"]:.1f} s'
+        print(f'{text}, {result["checkpoint"]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='ML Lighting sweep script',
+        description='Hyperparameter sweep script for the ML Lighting tool')
+
+    parser.add_argument(
+        'dataset', help='The dataset directory or cache file')
+    parser.add_argument(
+        'output',
+        help='The directory the trials and the results table are written to')
+    parser.add_argument(
+        '--learning-rates', type=float, nargs='+', default=[1e-3],
+        help='The learning rates to train with')
+    parser.add_argument(
+        '--batch-sizes', type=int, nargs='+', default=[constants.BATCH_SIZE],
+        help='The batch sizes to train with')
+    parser.add_argument(
+        '--epochs', type=int, nargs='+', default=[constants.EPOCH_COUNT],
+        help='The numbers of epochs to train')
+    parser.add_argument(
+        '--schedules', nargs='+', default=['constant'],
+        choices=schedules.SCHEDULES,
+        help='The learning rate schedules to train with')
+    parser.add_argument(
+        '--patience', type=int,
+        help='Stop the trials after this number of epochs without '
+             'improvement of the score')
+    parser.add_argument(
+        '--target-loss', type=float,
+        help='Report the training time of the trials until the score '
+             'reaches the target')
+    parser.add_argument(
+        '--processes', type=int, default=1,
+        help='The number of trials trained at once, the cores are split '
+             'between them')
+    parser.add_argument(
+        '--statistics',
+        help='The scan report used to skip the invalid samples and '
+             'normalize the EXR maps of a dataset directory')
+    parser.add_argument(
+        '--validation-split', type=float, default=0.1,
+        help='The fraction of the samples held out to score the trials on')
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='The seed of the model initialization and the samples order')
+
+    args = parser.parse_args()
+
+    main(args)
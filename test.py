@@ -2,7 +2,8 @@ import argparse
 
 import torch
 
-from mllighting.ml import network, train
+from mllighting.ml import (
+    constants, evaluation, mixed_precision, network, train, validation)
 
 
 def main(args: argparse.Namespace):
@@ -10,20 +11,87 @@ def main(args: argparse.Namespace):
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     print(f'Using device {device}')
 
-    # Initialize the model.
-    model = network.CNNModel().to(device=device)
+    # Share the cores between the DataLoader workers and the model.
+    num_workers = args.workers
+    if num_workers is None:
+        num_workers = train.get_default_worker_count()
+    torch.set_num_threads(train.get_thread_count(num_workers))
 
-    # Load the checkpoint path.
-    checkpoint = torch.load(args.checkpoint, weights_only=True)
-    model.load_state_dict(checkpoint)
+    # Read the dataset statistics.
+    statistics = None
+    if args.statistics:
+        statistics = validation.read_report(args.statistics)
+
+    # Load the checkpoints.
+    models = []
+    for checkpoint in args.checkpoints:
+        model = network.load_model(
+            checkpoint, device=device, channels_last=args.channels_last)
+        if args.compile:
+            model = network.compile_model(model, batch_size=args.batch_size)
+        models.append(model)
+
+    if len(models) > 1:
+        compare(args, models, device, num_workers, statistics)
+        return
 
     # Test the model.
     result = train.test_model(
-        model,
+        models[0],
         args.directory,
-        device=device)
+        device=device,
+        num_workers=num_workers,
+        pin_memory=args.pin_memory,
+        prefetch_factor=args.prefetch_factor,
+        statistics=statistics,
+        precision=args.precision,
+        batch_size=args.batch_size,
+        results_path=args.results)
     print(result)
 
+    # Summarize the per sample errors.
+    if args.results:
+        summary = evaluation.summarize_results(
+            evaluation.read_results(args.results))
+        print(
+            f'Light distance: mean {summary["mean"]:.6f}, '
+            f'median {summary["median"]:.6f}, p95 {summary["p95"]:.6f}, '
+            f'max {summary["max"]:.6f}')
+        print(f'Results written to {args.results}')
+
+
+def compare(
+        args: argparse.Namespace,
+        models: list[torch.nn.Module],
+        device: torch.device,
+        num_workers: int,
+        statistics: dict | None):
+    # Test all the models on each decoded batch.
+    results = train.test_models(
+        models,
+        args.directory,
+        device=device,
+        num_workers=num_workers,
+        pin_memory=args.pin_memory,
+        prefetch_factor=args.prefetch_factor,
+        statistics=statistics,
+        precision=args.precision,
+        batch_size=args.batch_size,
+        vectorized=args.vmap)
+
+    # Print the comparison table, the best checkpoint first.
+    width = max(len(checkpoint) for checkpoint in args.checkpoints)
+    print(
+        f'{"checkpoint":<{width}}  {"loss":>10}  {"mean":>10}  '
+        f'{"median":>10}  {"p95":>10}  {"max":>10}')
+    rows = sorted(
+        zip(args.checkpoints, results), key=lambda row: row[1]['loss'])
+    for checkpoint, result in rows:
+        print(
+            f'{checkpoint:<{width}}  {result["loss"]:>10.6f}  '
+            f'{result["mean"]:>10.6f}  {result["median"]:>10.6f}  '
+            f'{result["p95"]:>10.6f}  {result["max"]:>10.6f}')
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -31,8 +99,50 @@ if __name__ == '__main__':
         description='Test script for the ML Lighting tool')
 
     parser.add_argument('directory', help='The dataset directory')
-    parser.add_argument('checkpoint', help='The checkpoint to use')
+    parser.add_argument(
+        'checkpoints', nargs='+',
+        help='The checkpoints to test, several checkpoints are compared on '
+             'a single pass over the dataset')
+    parser.add_argument(
+        '--workers', type=int,
+        help='The number of DataLoader worker processes, '
+             'defaults to a number based on the core count')
+    parser.add_argument(
+        '--pin-memory', action=argparse.BooleanOptionalAction,
+        help='Load the data in pinned memory, defaults to True on GPU')
+    parser.add_argument(
+        '--prefetch-factor', type=int,
+        help='The number of batches loaded in advance by each worker')
+    parser.add_argument(
+        '--batch-size', type=int, default=constants.EVALUATION_BATCH_SIZE,
+        help='The number of samples evaluated at once')
+    parser.add_argument(
+        '--results',
+        help='The .npy file the prediction, the light position distance and '
+             'the loss of each sample are written to')
+    parser.add_argument(
+        '--statistics',
+        help='The scan report used to skip the invalid samples and '
+             'normalize the EXR maps')
+
+    parser.add_argument(
+        '--precision', default='fp32', choices=mixed_precision.PRECISIONS,
+        help='The precision to run the model with, bf16 runs the supported '
+             'operations in bfloat16')
+
+    parser.add_argument(
+        '--compile', action='store_true',
+        help='Compile the model with torch.compile')
+    parser.add_argument(
+        '--channels-last', action='store_true',
+        help='Run the convolutions in the channels last memory format')
+    parser.add_argument(
+        '--vmap', action='store_true',
+        help='Compare the checkpoints with a single vectorized forward of '
+             'all the models')
 
     args = parser.parse_args()
+    if args.results and len(args.checkpoints) > 1:
+        parser.error('--results requires a single checkpoint')
 
     main(args)
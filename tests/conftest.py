@@ -0,0 +1,71 @@
+import json
+import os
+
+import numpy
+
+import OpenImageIO
+
+from PIL import Image
+
+import pytest
+
+
+def write_sample(
+        sample_directory: str,
+        rng: numpy.random.Generator,
+        size: int = 32,
+        position_scale: float = 1.0):
+    """Write a random sample.
+
+    Args:
+        sample_directory: The sample directory to create.
+        rng: The random generator of the sample values.
+        size: The width and height of the render maps.
+        position_scale: The std of the position map values.
+    """
+    os.makedirs(sample_directory, exist_ok=True)
+    for name in ('albedo', 'beauty'):
+        pixels = rng.integers(0, 256, (size, size, 3), dtype=numpy.uint8)
+        Image.fromarray(pixels).save(
+            os.path.join(sample_directory, f'{name}.png'))
+
+    for name, scale in (('normal', 1.0), ('position', position_scale)):
+        pixels = rng.standard_normal((size, size, 3)) * scale
+        buf = OpenImageIO.ImageBuf(
+            OpenImageIO.ImageSpec(size, size, 3, OpenImageIO.HALF))
+        buf.set_pixels(OpenImageIO.ROI(), pixels.astype(numpy.float32))
+        buf.write(os.path.join(sample_directory, f'{name}.exr'))
+
+    matrix = [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0]
+    matrix += rng.standard_normal(3).tolist() + [1]
+    with open(os.path.join(sample_directory, 'light.json'), 'w') as f:
+        json.dump([{'matrix': matrix}], f)
+
+
+def write_dataset(
+        directory: str,
+        sample_count: int,
+        seed: int = 0,
+        position_scale: float = 1.0):
+    """Write a dataset directory of random samples.
+
+    Args:
+        directory: The dataset directory.
+        sample_count: The number of samples.
+        seed: The seed of the sample values.
+        position_scale: The std of the position map values.
+    """
+    rng = numpy.random.default_rng(seed)
+    for index in range(sample_count):
+        write_sample(
+            os.path.join(directory, str(index)),
+            rng,
+            position_scale=position_scale)
+
+
+@pytest.fixture(scope='session')
+def dataset_directory(tmp_path_factory: pytest.TempPathFactory) -> str:
+    """A dataset directory of 20 random samples."""
+    directory = str(tmp_path_factory.mktemp('dataset'))
+    write_dataset(directory, 20)
+    return directory
@@ -0,0 +1,48 @@
+import numpy
+
+import torch
+
+from mllighting.ml import cache
+
+
+def test_compact_storage_error_bound(dataset_directory, tmp_path):
+    reference_path = str(tmp_path / 'float32.npy')
+    compact_path = str(tmp_path / 'compact.npy')
+    cache.preprocess_dataset(dataset_directory, reference_path)
+    cache.preprocess_dataset(
+        dataset_directory, compact_path, storage='compact')
+
+    reference = cache.open_cache(reference_path)
+    compact = cache.open_cache(compact_path)
+    assert cache.get_storage(compact.dtype) == 'compact'
+    assert compact.nbytes < reference.nbytes / 2
+
+    for name in cache.MAP_NAMES:
+        values = numpy.asarray(reference[name])
+        error = numpy.abs(cache.decode_map(compact[name]) - values)
+        bound = cache.get_error_bound(values, compact.dtype[name].base.type)
+        assert (error <= bound).all(), name
+    assert numpy.array_equal(compact['targets'], reference['targets'])
+
+
+def test_compact_batches_match_float32(dataset_directory, tmp_path):
+    reference_path = str(tmp_path / 'float32.npy')
+    cache.preprocess_dataset(dataset_directory, reference_path)
+
+    reference = cache.CachedRenderMapsDataset(reference_path)
+    compact = cache.CachedRenderMapsDataset(
+        reference_path, storage='compact', in_memory=True)
+
+    indices = list(range(len(reference)))
+    reference_inputs, reference_targets = reference.read_batch(indices)
+    compact_inputs, compact_targets = compact.read_batch(indices)
+
+    # The batches are formed from the decoded values of each map.
+    for map_index, name in enumerate(cache.MAP_NAMES):
+        channels = slice(map_index * 3, (map_index + 1) * 3)
+        values = reference_inputs[:, channels].numpy()
+        error = numpy.abs(compact_inputs[:, channels].numpy() - values)
+        bound = cache.get_error_bound(
+            values, cache.STORAGE_TYPES['compact'][name])
+        assert (error <= bound).all(), name
+    assert torch.equal(compact_targets, reference_targets)
@@ -0,0 +1,67 @@
+import torch
+
+from mllighting.ml import checkpoint, network
+
+
+def test_training_state_writer_snapshots(tmp_path):
+    torch.manual_seed(0)
+    model = network.CNNModel(image_size=(8, 8))
+    optimizer = torch.optim.AdamW(model.parameters())
+    best_state = checkpoint.StateSnapshot(model)
+    best_state.update(model)
+
+    model(torch.randn(2, 12, 8, 8)).sum().backward()
+    optimizer.step()
+    expected_model = {
+        name: value.clone() for name, value in model.state_dict().items()}
+    expected_exp_avg = optimizer.state[model.flatten_layers[1].weight][
+        'exp_avg'].clone()
+
+    state_path = str(tmp_path / 'model.pt.state')
+    with checkpoint.TrainingStateWriter(model, state_path) as writer:
+        writer.submit(
+            model,
+            optimizer,
+            progress={'epoch': 1, 'batch': 0},
+            best_state=best_state)
+
+        # The training goes on while the state is written.
+        with torch.no_grad():
+            for parameter in model.parameters():
+                parameter.add_(1.0)
+        model(torch.randn(2, 12, 8, 8)).sum().backward()
+        optimizer.step()
+
+    state = checkpoint.load_training_state(state_path)
+    assert state['progress'] == {'epoch': 1, 'batch': 0}
+    for name, value in expected_model.items():
+        assert torch.equal(state['model'][name], value), name
+    exp_avgs = [
+        parameter_state['exp_avg']
+        for parameter_state in state['optimizer']['state'].values()]
+    assert any(torch.equal(value, expected_exp_avg) for value in exp_avgs)
+    assert set(state['rng'][0]) >= {'torch', 'numpy', 'python'}
+
+
+def test_training_state_snapshot_preallocates_the_model():
+    model = network.CNNModel(image_size=(8, 8))
+    optimizer = torch.optim.AdamW(model.parameters())
+    snapshot = checkpoint.TrainingStateSnapshot(model)
+    pointers = {
+        name: value.data_ptr()
+        for name, value in snapshot._initial_state['model'].items()}
+
+    for step in range(2):
+        model(torch.randn(2, 12, 8, 8)).sum().backward()
+        optimizer.step()
+        snapshot.update(
+            model,
+            optimizer,
+            progress={'epoch': 0, 'batch': step},
+            best_state=None,
+            scheduler=None,
+            rng_states=[])
+        for name, value in model.state_dict().items():
+            assert snapshot.state['model'][name].data_ptr() == \
+                pointers[name], name
+            assert torch.equal(snapshot.state['model'][name], value), name
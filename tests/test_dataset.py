@@ -0,0 +1,38 @@
+import numpy
+
+import OpenImageIO
+
+import pytest
+
+from mllighting.ml import dataset
+
+
+def write_exr(filepath: str, pixels: numpy.ndarray, compression: str):
+    """Write float pixels to an EXR file.
+
+    Args:
+        filepath: The EXR file path.
+        pixels: The (height, width, channels) pixels.
+        compression: The EXR compression.
+    """
+    height, width, channels = pixels.shape
+    spec = OpenImageIO.ImageSpec(width, height, channels, OpenImageIO.HALF)
+    spec.attribute('compression', compression)
+    buf = OpenImageIO.ImageBuf(spec)
+    buf.set_pixels(OpenImageIO.ROI(), pixels.astype(numpy.float32))
+    assert buf.write(filepath)
+
+
+@pytest.mark.parametrize('compression', ['none', 'zips', 'zip'])
+def test_reduced_exr_decode_error(tmp_path, compression):
+    # Noisy render maps alias when they are point sampled.
+    rng = numpy.random.default_rng(0)
+    pixels = rng.standard_normal((1024, 1024, 3)) * 0.5
+    pixels += numpy.linspace(-1.0, 1.0, 1024)[None, :, None]
+    filepath = str(tmp_path / 'map.exr')
+    write_exr(filepath, pixels, compression)
+
+    full = dataset.read_resized_exr_pixels(filepath, reduced=False)
+    reduced = dataset.read_resized_exr_pixels(filepath, reduced=True)
+    assert reduced.shape == full.shape
+    assert numpy.abs(reduced - full).max() < 0.15
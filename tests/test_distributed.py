@@ -0,0 +1,79 @@
+import os
+
+import torch
+import torch.utils.data as torch_data
+
+from mllighting.ml import distributed, network, sampling, train
+
+
+def get_data() -> tuple[torch_data.Dataset, torch.nn.Module]:
+    """Get the same small dataset and model in every process.
+
+    Returns:
+        The dataset and the model.
+    """
+    torch.manual_seed(0)
+    data = torch_data.TensorDataset(torch.randn(10, 3), torch.randn(10, 3))
+    return data, torch.nn.Linear(3, 3)
+
+
+def run_process(directory: str, dataset_directory: str):
+    """Evaluate and train in a distributed process, and save the results.
+
+    Args:
+        directory: The directory the results are written to.
+        dataset_directory: The dataset to train on.
+    """
+    rank = distributed.get_rank()
+
+    # Evaluate on the share of the samples of the process.
+    data, model = get_data()
+    sampler = sampling.ResumableSampler(data, shuffle=True)
+    indices = list(sampler)
+    loader = torch_data.DataLoader(data, batch_size=4, sampler=sampler)
+    loss = train.evaluate(model, loader, train.get_loss_function())
+
+    torch.manual_seed(0)
+    trained = train.train_model(
+        network.CNNModel(),
+        dataset_directory,
+        num_epochs=1,
+        num_workers=0,
+        checkpoint_path=os.path.join(directory, f'model.{rank}.pt'),
+        state_path=os.path.join(directory, f'model.{rank}.pt.state'),
+        batch_size=4)
+
+    torch.save(
+        {'indices': indices, 'loss': loss, 'model': trained.state_dict()},
+        os.path.join(directory, f'rank.{rank}.pt'))
+
+
+def test_two_processes(dataset_directory, tmp_path):
+    distributed.launch(run_process, 2, str(tmp_path), dataset_directory)
+
+    results = [
+        torch.load(tmp_path / f'rank.{rank}.pt', weights_only=True)
+        for rank in range(2)]
+
+    # The processes sample disjoint halves of the dataset.
+    first, second = (set(result['indices']) for result in results)
+    assert len(first) == len(second) == 5
+    assert not first & second
+    assert first | second == set(range(10))
+
+    # The loss is averaged over the samples of both processes.
+    data, model = get_data()
+    inputs, targets = data.tensors
+    with torch.no_grad():
+        expected = train.get_loss_function()(model(inputs), targets).item()
+    for result in results:
+        assert abs(result['loss'] - expected) < 1e-6
+
+    # The models are kept in sync, and only the first process writes the
+    # checkpoint and the training state.
+    for name, value in results[0]['model'].items():
+        assert torch.equal(results[1]['model'][name], value), name
+    assert os.path.isfile(tmp_path / 'model.0.pt')
+    assert os.path.isfile(tmp_path / 'model.0.pt.state')
+    assert not os.path.exists(tmp_path / 'model.1.pt')
+    assert not os.path.exists(tmp_path / 'model.1.pt.state')
@@ -0,0 +1,59 @@
+import numpy
+
+import pytest
+
+import torch
+
+from mllighting.ml import evaluation, network, train
+
+
+def test_results_round_trip(tmp_path):
+    filepath = str(tmp_path / 'results.npy')
+    preds = torch.tensor([[0.0, 0.0, 0.0], [1.0, 2.0, 2.0], [3.0, 0.0, 4.0]])
+    targets = torch.zeros(3, 3)
+    with evaluation.ResultsWriter(filepath, 3) as results:
+        results.write(preds[:2], targets[:2])
+        results.write(preds[2:], targets[2:])
+
+    records = evaluation.read_results(filepath)
+    assert numpy.array_equal(records['prediction'], preds.numpy())
+    assert numpy.array_equal(records['target'], targets.numpy())
+    assert numpy.allclose(records['distance'], [0.0, 3.0, 5.0])
+    assert numpy.allclose(records['loss'], [0.0, 3.0, 25.0 / 3.0])
+    assert evaluation.summarize_results(records)['max'] == pytest.approx(5.0)
+
+
+def test_results_sample_count_checked(tmp_path):
+    filepath = str(tmp_path / 'results.npy')
+    results = evaluation.ResultsWriter(filepath, 2)
+    with pytest.raises(ValueError):
+        results.write(torch.zeros(3, 3), torch.zeros(3, 3))
+    results.write(torch.zeros(1, 3), torch.zeros(1, 3))
+    with pytest.raises(ValueError):
+        results.close()
+
+
+def test_results_in_dataset_order(tmp_path, dataset_directory):
+    torch.manual_seed(0)
+    model = network.CNNModel()
+    model.eval()
+    filepath = str(tmp_path / 'results.npy')
+    # The last batch is smaller and the batches are loaded by two workers.
+    train.test_model(
+        model,
+        dataset_directory,
+        num_workers=2,
+        batch_size=3,
+        results_path=filepath)
+
+    data = train.load_dataset(dataset_directory, shuffle=False)
+    records = evaluation.read_results(filepath)
+    assert len(records) == len(data)
+    for index in range(len(data)):
+        inputs, targets = data[index]
+        with torch.no_grad():
+            preds = model(inputs[None])[0]
+        assert numpy.allclose(
+            records['prediction'][index], preds.numpy(), atol=1e-5), index
+        assert numpy.array_equal(
+            records['target'][index], targets.numpy()), index
@@ -0,0 +1,73 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+import torch
+
+from mllighting.communication import client
+from mllighting.ml import inference, inference_server, network, registry
+
+
+@pytest.fixture
+def server_address(tmp_path):
+    """Serve a random model on a free port from a thread."""
+    torch.manual_seed(0)
+    checkpoint = str(tmp_path / 'model.pt')
+    torch.save(network.CNNModel().state_dict(), checkpoint)
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    server = inference_server.InferenceServer('127.0.0.1', port, checkpoint)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(
+        target=loop.run_until_complete, args=(server.start_server(),))
+    thread.start()
+
+    try:
+        for _ in range(100):
+            try:
+                client.send_request('127.0.0.1', port, 'ping')
+                break
+            except ConnectionRefusedError:
+                time.sleep(0.05)
+        yield '127.0.0.1', port, checkpoint
+    finally:
+        asyncio.run_coroutine_threadsafe(
+            server.stop_server(), loop).result(timeout=10)
+        thread.join()
+        loop.close()
+        registry.get_registry().clear()
+
+
+def test_infer_round_trip(server_address, dataset_directory):
+    address, port, checkpoint = server_address
+    sample_directory = os.path.join(dataset_directory, '0')
+    model = network.load_model(checkpoint)
+    model.eval()
+    expected = inference.run_inference(model, sample_directory)
+
+    lights = client.infer(
+        address, port, render_directory=sample_directory)
+    assert lights == pytest.approx(expected, abs=1e-5)
+
+    payload = {}
+    for name in ('albedo.png', 'beauty.png', 'normal.exr', 'position.exr'):
+        with open(os.path.join(sample_directory, name), 'rb') as f:
+            payload[name] = f.read()
+    lights = client.infer(address, port, payload=payload)
+    assert lights == pytest.approx(expected, abs=1e-5)
+
+
+@pytest.mark.parametrize('name', ['evil.txt', '../beauty.png'])
+def test_unexpected_payload_file_rejected(server_address, name):
+    address, port, _ = server_address
+    with pytest.raises(RuntimeError, match='Unexpected payload file'):
+        client.infer(address, port, payload={name: b'content'})
+
+    # The server still answers after the error.
+    assert client.send_request(address, port, 'ping')['checkpoint']
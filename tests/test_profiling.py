@@ -0,0 +1,17 @@
+from mllighting.ml import profiling
+
+
+def test_cpu_summary_reports_process_peak_memory():
+    profiler = profiling.StageProfiler()
+    profiler.start_epoch()
+    with profiler.stage('forward'):
+        buffer = bytearray(2**20)
+    profiler.add_samples(len(buffer) // 2**20)
+    summary = profiler.end_epoch()
+
+    # The epoch peak can not be measured on CPU.
+    assert summary['peak_memory'] is None
+    assert summary['process_peak_memory'] >= 2**20
+    text = profiling.format_summary(summary)
+    assert ', peak memory' not in text
+    assert 'process peak memory' in text
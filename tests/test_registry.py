@@ -0,0 +1,113 @@
+import os
+import threading
+
+import pytest
+
+from mllighting.ml import registry
+
+
+class FakeModel:
+
+    def __init__(self, checkpoint):
+        with open(checkpoint, 'r') as f:
+            self.content = f.read()
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """Replace the model loading, and record the loaded checkpoints."""
+    loads = []
+
+    def load_model(checkpoint, **kwargs):
+        loads.append(os.path.basename(checkpoint))
+        return FakeModel(checkpoint)
+
+    monkeypatch.setattr(registry, 'load_model', load_model)
+    return loads
+
+
+def write_checkpoint(path, content, mtime_ns):
+    path.write_text(content)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+    return str(path)
+
+
+def test_least_recently_used_model_evicted(tmp_path, loads):
+    checkpoints = [
+        write_checkpoint(tmp_path / f'model{i}.pt', str(i), 10**18)
+        for i in range(3)]
+    model_registry = registry.ModelRegistry(capacity=2)
+
+    model_registry.get(checkpoints[0])
+    model_registry.get(checkpoints[1])
+    # The first model is now the most recently used.
+    model_registry.get(checkpoints[0])
+    model_registry.get(checkpoints[2])
+    assert len(model_registry) == 2
+
+    model_registry.get(checkpoints[0])
+    model_registry.get(checkpoints[1])
+    assert loads == [
+        'model0.pt', 'model1.pt', 'model2.pt', 'model1.pt']
+
+
+def test_model_reloaded_when_checkpoint_changes(tmp_path, loads):
+    checkpoint = write_checkpoint(tmp_path / 'model.pt', 'old', 10**18)
+    model_registry = registry.ModelRegistry()
+
+    model = model_registry.get(checkpoint)
+    assert model_registry.get(checkpoint) is model
+
+    write_checkpoint(tmp_path / 'model.pt', 'new', 2 * 10**18)
+    reloaded_model = model_registry.get(checkpoint)
+    assert reloaded_model.content == 'new'
+    assert model.content == 'old'
+    assert model_registry.get(checkpoint) is reloaded_model
+    assert loads == ['model.pt', 'model.pt']
+
+
+def test_previous_model_kept_when_reload_fails(
+        tmp_path, monkeypatch, loads):
+    checkpoint = write_checkpoint(tmp_path / 'model.pt', 'old', 10**18)
+    model_registry = registry.ModelRegistry()
+    model = model_registry.get(checkpoint)
+
+    def load_model(checkpoint, **kwargs):
+        raise RuntimeError('Truncated checkpoint')
+
+    write_checkpoint(tmp_path / 'model.pt', 'new', 2 * 10**18)
+    monkeypatch.setattr(registry, 'load_model', load_model)
+    assert model_registry.get(checkpoint) is model
+
+    # A model that was never loaded has nothing to fall back to.
+    other_checkpoint = write_checkpoint(
+        tmp_path / 'other.pt', 'other', 10**18)
+    with pytest.raises(RuntimeError):
+        model_registry.get(other_checkpoint)
+
+
+def test_loaded_models_served_while_loading(tmp_path, monkeypatch, loads):
+    fast_checkpoint = write_checkpoint(tmp_path / 'fast.pt', 'fast', 10**18)
+    slow_checkpoint = write_checkpoint(tmp_path / 'slow.pt', 'slow', 10**18)
+    model_registry = registry.ModelRegistry()
+    fast_model = model_registry.get(fast_checkpoint)
+
+    loading = threading.Event()
+    release = threading.Event()
+
+    def load_model(checkpoint, **kwargs):
+        loading.set()
+        assert release.wait(timeout=10)
+        return FakeModel(checkpoint)
+
+    monkeypatch.setattr(registry, 'load_model', load_model)
+    thread = threading.Thread(
+        target=model_registry.get, args=(slow_checkpoint,))
+    thread.start()
+    try:
+        assert loading.wait(timeout=10)
+        assert model_registry.get(fast_checkpoint) is fast_model
+    finally:
+        release.set()
+        thread.join()
+    assert len(model_registry) == 2
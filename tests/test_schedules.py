@@ -0,0 +1,62 @@
+import pytest
+
+import torch
+
+from mllighting.ml import schedules
+
+
+def get_learning_rates(name, steps, total_steps=100, warmup=0.1):
+    parameter = torch.nn.Parameter(torch.zeros(1))
+    optimizer = torch.optim.SGD([parameter], lr=1.0)
+    scheduler = schedules.get_scheduler(
+        name, optimizer, total_steps, warmup=warmup)
+    learning_rates = {}
+    for step in range(max(steps) + 1):
+        if step in steps:
+            learning_rates[step] = scheduler.get_last_lr()[0]
+        optimizer.step()
+        scheduler.step()
+    return learning_rates
+
+
+def test_onecycle_learning_rates():
+    learning_rates = get_learning_rates('onecycle', {0, 5, 10, 55, 100, 150})
+    initial = 1.0 / schedules.ONECYCLE_INITIAL_FACTOR
+    final = initial / schedules.ONECYCLE_FINAL_FACTOR
+    assert learning_rates[0] == pytest.approx(initial)
+    assert learning_rates[5] == pytest.approx((initial + 1.0) / 2)
+    assert learning_rates[10] == pytest.approx(1.0)
+    assert learning_rates[55] == pytest.approx((final + 1.0) / 2)
+    assert learning_rates[100] == pytest.approx(final)
+    # The last learning rate is held past the total step count.
+    assert learning_rates[150] == pytest.approx(final)
+
+
+def test_cosine_learning_rates():
+    learning_rates = get_learning_rates('cosine', {0, 10, 55, 100, 150})
+    assert learning_rates[0] == pytest.approx(1.0 / 11)
+    assert learning_rates[10] == pytest.approx(1.0)
+    assert learning_rates[55] == pytest.approx(0.5)
+    assert learning_rates[100] == pytest.approx(0.0)
+    assert learning_rates[150] == pytest.approx(0.0)
+
+
+def test_constant_and_unknown_schedules():
+    optimizer = torch.optim.SGD([torch.nn.Parameter(torch.zeros(1))], lr=1.0)
+    assert schedules.get_scheduler('constant', optimizer, 100) is None
+    with pytest.raises(ValueError):
+        schedules.get_scheduler('linear', optimizer, 100)
+
+
+def test_early_stopping_patience():
+    early_stopping = schedules.EarlyStopping(patience=2, min_delta=0.1)
+    assert not early_stopping.update(1.0)
+    # Less than the minimum improvement.
+    assert not early_stopping.update(0.95)
+    assert not early_stopping.update(0.8)
+    assert not early_stopping.update(0.8)
+
+    resumed = schedules.EarlyStopping(patience=2, min_delta=0.1)
+    resumed.load_state_dict(early_stopping.state_dict())
+    assert resumed.best_score == 0.8
+    assert resumed.update(0.75)
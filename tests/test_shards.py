@@ -0,0 +1,71 @@
+import copy
+
+import pytest
+
+import torch
+import torch.utils.data as torch_data
+
+from mllighting.ml import shards, train, validation
+
+from conftest import write_dataset
+
+
+def test_shards_normalized_like_directory(tmp_path):
+    directory = str(tmp_path / 'dataset')
+    write_dataset(directory, 6, position_scale=5.0)
+    shard_directory = str(tmp_path / 'shards')
+    shards.write_shards(directory, shard_directory, samples_per_shard=4)
+
+    statistics = validation.scan_dataset(directory, num_workers=1)
+    # Skip a sample as if it was invalid.
+    statistics = copy.deepcopy(statistics)
+    statistics['errors']['2'] = 'ValueError: invalid'
+
+    expected = train.load_dataset(directory, statistics=statistics)
+    sharded = train.load_dataset(
+        shard_directory, statistics=statistics, shuffle=False)
+    assert len(sharded) == len(expected) == 5
+
+    samples = list(sharded)
+    assert len(samples) == len(expected)
+    for index, (inputs, targets) in enumerate(samples):
+        expected_inputs, expected_targets = expected[index]
+        assert torch.allclose(inputs, expected_inputs)
+        assert torch.equal(targets, expected_targets)
+
+    # The position maps are divided by their std of about 5.
+    raw_samples = list(train.load_dataset(shard_directory, shuffle=False))
+    positions = torch.stack([inputs[9:12] for inputs, _ in samples])
+    raw_positions = torch.stack([
+        inputs[9:12] for index, (inputs, _) in enumerate(raw_samples)
+        if index != 2])
+    ratio = raw_positions.std().item() / positions.std().item()
+    assert 4.0 < ratio < 6.0
+
+
+@pytest.mark.parametrize('persistent_workers', [False, True])
+def test_samples_read_once_per_epoch(
+        tmp_path, dataset_directory, persistent_workers):
+    # More shards than workers, and a smaller last shard.
+    shard_directory = str(tmp_path / 'shards')
+    shards.write_shards(
+        dataset_directory, shard_directory, samples_per_shard=3)
+    data = train.load_dataset(dataset_directory)
+    expected = sorted(
+        tuple(data[index][1].tolist()) for index in range(len(data)))
+
+    sharded = shards.ShardedRenderMapsDataset(shard_directory, buffer_size=4)
+    loader = torch_data.DataLoader(
+        sharded,
+        batch_size=4,
+        num_workers=2,
+        persistent_workers=persistent_workers)
+    orders = []
+    for epoch in range(2):
+        targets = [
+            tuple(sample_targets.tolist())
+            for _, batch_targets in loader
+            for sample_targets in batch_targets]
+        assert sorted(targets) == expected
+        orders.append(targets)
+    assert orders[0] != orders[1]
@@ -0,0 +1,58 @@
+import torch
+import torch.utils.data as torch_data
+
+from mllighting.ml import cache, sharedcache, train
+
+
+def get_record_size(data):
+    image_tensor, light_tensor = data[0]
+    return cache.get_record_dtype(
+        (3, *image_tensor.shape[1:]), light_tensor.numel()).itemsize
+
+
+def test_workers_share_the_cache(dataset_directory):
+    data = train.load_dataset(dataset_directory)
+    cached_data = sharedcache.SharedCacheDataset(
+        data, len(data) * get_record_size(data))
+    assert cached_data.slot_count == len(data)
+
+    loader = torch_data.DataLoader(
+        cached_data,
+        batch_size=4,
+        num_workers=2,
+        collate_fn=train.get_collate_function(cached_data))
+    for epoch in range(2):
+        for batch_index, (inputs, targets) in enumerate(loader):
+            expected_inputs, expected_targets = data.read_batch(
+                list(range(batch_index * 4, (batch_index + 1) * 4)))
+            assert torch.equal(inputs, expected_inputs)
+            assert torch.equal(targets, expected_targets)
+
+    # The first epoch fills the cache from the workers, the second one only
+    # reads it.
+    stats = cached_data.stats()
+    assert stats['misses'] == len(data)
+    assert stats['hits'] == len(data)
+    assert stats['cached'] == len(data)
+
+
+def test_used_samples_kept_when_evicting(dataset_directory):
+    data = train.load_dataset(dataset_directory)
+    cached_data = sharedcache.SharedCacheDataset(
+        data, 3 * get_record_size(data))
+    assert cached_data.slot_count == 3
+
+    for index in (0, 1, 2, 0, 3):
+        cached_data[index]
+    assert cached_data.stats()['hits'] == 1
+
+    # The sample 0 was used again, the sample 1 was evicted in its place.
+    cached_data[0]
+    assert cached_data.stats()['hits'] == 2
+    cached_data[1]
+    assert cached_data.stats()['misses'] == 5
+
+    inputs, targets = cached_data[3]
+    expected_inputs, expected_targets = data[3]
+    assert torch.equal(inputs, expected_inputs)
+    assert torch.equal(targets, expected_targets)
@@ -0,0 +1,68 @@
+import json
+import os
+
+import numpy
+
+from mllighting.ml import cache, manifest, sweep, validation
+
+from conftest import write_dataset
+
+
+def test_cache_rebuilt_for_other_data(tmp_path):
+    first = str(tmp_path / 'first')
+    second = str(tmp_path / 'second')
+    write_dataset(first, 3, seed=0)
+    write_dataset(second, 4, seed=1)
+    output = str(tmp_path / 'sweep')
+    os.makedirs(output)
+
+    cache_path = sweep.prepare_cache(first, output)
+    mtime = os.stat(cache_path).st_mtime_ns
+    assert len(cache.open_cache(cache_path)) == 3
+
+    # The same data reuses the cache.
+    assert sweep.prepare_cache(first, output) == cache_path
+    assert os.stat(cache_path).st_mtime_ns == mtime
+
+    # Other data, or other statistics, decode the cache again.
+    sweep.prepare_cache(second, output)
+    assert len(cache.open_cache(cache_path)) == 4
+
+    statistics = validation.scan_dataset(second, num_workers=1)
+    normals = numpy.array(cache.open_cache(cache_path)['normal'])
+    sweep.prepare_cache(second, output, statistics=statistics)
+    assert not numpy.array_equal(
+        cache.open_cache(cache_path)['normal'], normals)
+    source = sweep.read_cache_source(
+        os.path.join(output, sweep.CACHE_SOURCE_FILENAME))
+    assert source['path'] == os.path.realpath(second)
+
+    # A changed sample decodes the cache again.
+    mtime = os.stat(cache_path).st_mtime_ns
+    write_dataset(second, 1, seed=2)
+    sweep.prepare_cache(second, output, statistics=statistics)
+    assert os.stat(cache_path).st_mtime_ns != mtime
+
+
+def test_cache_rebuilt_for_edited_file_with_manifest(tmp_path):
+    directory = str(tmp_path / 'dataset')
+    write_dataset(directory, 3)
+    manifest.update_manifest(directory)
+    output = str(tmp_path / 'sweep')
+    os.makedirs(output)
+
+    cache_path = sweep.prepare_cache(directory, output)
+    assert cache.open_cache(cache_path)['targets'][1].tolist() != \
+        [10.0, 20.0, 30.0]
+
+    # Edit a light json in place, the sample directory is unchanged.
+    sample_directory = os.path.join(directory, '1')
+    mtime = os.stat(sample_directory).st_mtime_ns
+    matrix = [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 10.0, 20.0, 30.0, 1]
+    with open(os.path.join(sample_directory, 'light.json'), 'w') as f:
+        json.dump([{'matrix': matrix}], f)
+    assert os.stat(sample_directory).st_mtime_ns == mtime
+
+    sweep.prepare_cache(directory, output)
+    assert cache.open_cache(cache_path)['targets'][1].tolist() == \
+        [10.0, 20.0, 30.0]
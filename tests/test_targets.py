@@ -0,0 +1,70 @@
+import json
+import os
+import shutil
+
+from mllighting.ml import dataset, targets
+
+
+def write_light(filepath: str, position: list[float]):
+    """Write a light json file with a single light.
+
+    Args:
+        filepath: The light json file path.
+        position: The light position.
+    """
+    matrix = [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, *position, 1]
+    with open(filepath, 'w') as f:
+        json.dump([{'matrix': matrix}], f)
+
+
+def test_changed_light_json_not_served_stale(dataset_directory, tmp_path):
+    directory = str(tmp_path / 'dataset')
+    shutil.copytree(dataset_directory, directory)
+    table = targets.update_targets(directory)
+    assert len(table) == 20
+
+    filepath = os.path.join(directory, '3', 'light.json')
+    assert dataset.RenderMapsDataset(directory).get_light_positions(
+        3).tolist() == dataset.read_light_positions(filepath).tolist()
+
+    # Edit the light json after the table was built, the table opened by
+    # the dataset leaves it out.
+    write_light(filepath, [10.0, 20.0, 30.0])
+    data = dataset.RenderMapsDataset(directory)
+    assert '3' not in data.target_table.rows
+    assert len(data.target_table) == 19
+    assert data.get_light_positions(3).tolist() == [10.0, 20.0, 30.0]
+
+    # The table is current again once rebuilt.
+    table = targets.update_targets(directory)
+    assert len(targets.TargetTable(directory)) == 20
+    row = table.rows['3']
+    assert table.get_light_positions(row).tolist() == [10.0, 20.0, 30.0]
+
+
+def test_update_keeps_opened_table(dataset_directory, tmp_path):
+    directory = str(tmp_path / 'dataset')
+    shutil.copytree(dataset_directory, directory)
+    targets.update_targets(directory)
+    filepath = os.path.join(directory, '5', 'light.json')
+    expected = dataset.read_light_positions(filepath).tolist()
+    # The arrays are only mapped on the first read, after the update.
+    opened = targets.TargetTable(directory)
+
+    write_light(filepath, [1.0, 2.0, 3.0])
+    table = targets.update_targets(directory)
+
+    # The update wrote new arrays, committed by the index.
+    assert table.filenames != opened.filenames
+    assert targets.read_index(directory)['arrays'] == table.filenames
+    assert table.get_light_positions(table.rows['5']).tolist() == \
+        [1.0, 2.0, 3.0]
+
+    # The table opened before the update still reads its own arrays.
+    assert opened.get_light_positions(opened.rows['5']).tolist() == expected
+
+    # Only the arrays of the last two tables are kept.
+    targets.update_targets(directory, full=True)
+    filenames = sorted(
+        name for name in os.listdir(directory) if name.endswith('.npy'))
+    assert len(filenames) == 4
@@ -0,0 +1,62 @@
+import pytest
+
+import torch
+
+from mllighting.ml import network, train
+
+
+def train_with_state(
+        dataset_directory: str,
+        state_path: str,
+        num_epochs: int,
+        resume: bool = False) -> torch.nn.Module:
+    """Train a model with workers and a validation split.
+
+    Args:
+        dataset_directory: The dataset directory.
+        state_path: The training state file.
+        num_epochs: The number of epochs to train.
+        resume: Resume the training from the state file.
+
+    Returns:
+        The last trained model.
+    """
+    torch.manual_seed(0)
+    model = network.CNNModel()
+    train.train_model(
+        model,
+        dataset_directory,
+        num_epochs=num_epochs,
+        num_workers=2,
+        validation_split=0.2,
+        state_path=state_path,
+        resume=resume,
+        batch_size=4)
+    return model
+
+
+def test_resume_with_workers_and_validation(dataset_directory, tmp_path):
+    # The last state of the model is in the training state, the returned
+    # model is the best one.
+    train_with_state(dataset_directory, str(tmp_path / 'full.state'), 3)
+    full_state = torch.load(tmp_path / 'full.state', weights_only=True)
+
+    state_path = str(tmp_path / 'resumed.state')
+    train_with_state(dataset_directory, state_path, 1)
+    train_with_state(dataset_directory, state_path, 3, resume=True)
+    resumed_state = torch.load(state_path, weights_only=True)
+
+    for name, value in full_state['model'].items():
+        assert torch.equal(resumed_state['model'][name], value), name
+
+
+def test_split_dataset_not_empty():
+    data = torch.utils.data.TensorDataset(torch.arange(4))
+
+    train_subset, validation_subset = train.split_dataset(data, 0.25)
+    assert len(train_subset) == 3
+    assert len(validation_subset) == 1
+
+    # A single sample can not be split.
+    with pytest.raises(ValueError):
+        train.split_dataset(torch.utils.data.Subset(data, [0]), 0.5)
@@ -1,26 +1,82 @@
 import argparse
+import os
 
 import torch
 
-from mllighting.ml import network, train
+from mllighting.ml import (
+    augment, constants, distributed, mixed_precision, network, profiling,
+    schedules, train, validation)
 
 
 def main(args: argparse.Namespace):
-    # Detect the device to use.
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    print(f'Using device {device}')
+    # Train in a single process, or in each distributed process.
+    distributed.launch(run_training, args.processes, args)
+
+
+def run_training(args: argparse.Namespace):
+    # Detect the device to use, one per process.
+    device = torch.device('cpu')
+    if torch.cuda.is_available():
+        device = torch.device('cuda', distributed.get_local_rank())
+    if distributed.is_main_process():
+        print(f'Using device {device}')
+
+    # Share the cores between the DataLoader workers and the model.
+    num_workers = args.workers
+    if num_workers is None:
+        num_workers = train.get_default_worker_count()
+    torch.set_num_threads(train.get_thread_count(num_workers))
+
+    # Read the dataset statistics.
+    statistics = None
+    if args.statistics:
+        statistics = validation.read_report(args.statistics)
 
     # Initialize the model.
     model = network.CNNModel().to(device=device)
 
-    # Train the model.
-    best_model = train.train_model(
+    # Time the stages of the training steps.
+    profiler = None
+    if args.profile or args.profile_trace:
+        trace_path = args.profile_trace
+        if trace_path and distributed.get_world_size() > 1:
+            root, extension = os.path.splitext(trace_path)
+            trace_path = f'{root}.{distributed.get_rank()}{extension}'
+        profiler = profiling.StageProfiler(
+            device=device,
+            trace_path=trace_path,
+            trace_start=args.profile_trace_start,
+            trace_steps=args.profile_trace_steps)
+
+    # Train the model, the best model is saved each time the loss improves.
+    train.train_model(
         model,
         args.directory,
-        device=device)
-
-    # Save the best model trained.
-    torch.save(best_model.state_dict(), args.output)
+        device=device,
+        num_workers=num_workers,
+        pin_memory=args.pin_memory,
+        persistent_workers=args.persistent_workers,
+        prefetch_factor=args.prefetch_factor,
+        augmentation=augment.get_augmentation(args.augmentation),
+        shared_cache_size=args.shared_cache_size * 2**20,
+        statistics=statistics,
+        checkpoint_path=args.output,
+        validation_split=args.validation_split,
+        precision=args.precision,
+        compiled=args.compile,
+        state_path=f'{args.output}.state',
+        state_interval=args.state_interval,
+        resume=args.resume,
+        batch_size=args.batch_size,
+        accumulation_steps=args.accumulation_steps,
+        channels_last=args.channels_last,
+        profiler=profiler,
+        learning_rate=args.learning_rate,
+        schedule=args.schedule,
+        warmup=args.warmup,
+        patience=args.patience,
+        min_delta=args.min_delta,
+        target_loss=args.target_loss)
 
 
 if __name__ == '__main__':
@@ -30,6 +86,106 @@ if __name__ == '__main__':
 
     parser.add_argument('directory', help='The dataset directory')
     parser.add_argument('output', help='The checkout output')
+    parser.add_argument(
+        '--workers', type=int,
+        help='The number of DataLoader worker processes, '
+             'defaults to a number based on the core count')
+    parser.add_argument(
+        '--pin-memory', action=argparse.BooleanOptionalAction,
+        help='Load the data in pinned memory, defaults to True on GPU')
+    parser.add_argument(
+        '--persistent-workers', action=argparse.BooleanOptionalAction,
+        default=True,
+        help='Keep the worker processes alive between epochs')
+    parser.add_argument(
+        '--prefetch-factor', type=int,
+        help='The number of batches loaded in advance by each worker')
+    parser.add_argument(
+        '--statistics',
+        help='The scan report used to skip the invalid samples and '
+             'normalize the EXR maps')
+    parser.add_argument(
+        '--augmentation', nargs='*', default=['gamma'],
+        choices=sorted(augment.AUGMENTATIONS),
+        help='The augmentations applied on the training batches')
+    parser.add_argument(
+        '--shared-cache-size', type=int, default=0,
+        help='The size in MiB of the decoded samples cache shared by the '
+             'DataLoader workers')
+    parser.add_argument(
+        '--validation-split', type=float, default=0.0,
+        help='The fraction of the samples held out to select the best model '
+             'on, the training loss is used if 0')
+
+    parser.add_argument(
+        '--precision', default='fp32', choices=mixed_precision.PRECISIONS,
+        help='The precision to run the model with, bf16 runs the supported '
+             'operations in bfloat16')
+
+    parser.add_argument(
+        '--compile', action='store_true',
+        help='Compile the model with torch.compile')
+
+    parser.add_argument(
+        '--learning-rate', type=float, default=1e-3,
+        help='The learning rate, the peak learning rate of the schedule')
+    parser.add_argument(
+        '--schedule', default='constant', choices=schedules.SCHEDULES,
+        help='The learning rate schedule')
+    parser.add_argument(
+        '--warmup', type=float, default=0.05,
+        help='The fraction of the steps the learning rate is warmed up over '
+             'by the schedule')
+    parser.add_argument(
+        '--patience', type=int,
+        help='Stop the training after this number of epochs without '
+             'improvement of the loss')
+    parser.add_argument(
+        '--min-delta', type=float, default=0.0,
+        help='The decrease of the loss counted as an improvement')
+    parser.add_argument(
+        '--target-loss', type=float,
+        help='Report the training time until the loss reaches the target')
+
+    parser.add_argument(
+        '--channels-last', action='store_true',
+        help='Run the convolutions in the channels last memory format')
+
+    parser.add_argument(
+        '--batch-size', type=int, default=constants.BATCH_SIZE,
+        help='The number of samples of each batch, per process')
+    parser.add_argument(
+        '--accumulation-steps', type=int, default=1,
+        help='The number of batches the gradients are accumulated over '
+             'before each model update')
+
+    parser.add_argument(
+        '--processes', type=int, default=1,
+        help='The number of local data parallel training processes')
+
+    parser.add_argument(
+        '--resume', action='store_true',
+        help='Resume the training from the training state written next to '
+             'the checkpoint output, if it exists')
+    parser.add_argument(
+        '--state-interval', type=int,
+        help='Also write the training state every number of steps, it is '
+             'written at the end of each epoch')
+
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='Time the stages of the training steps and print a summary at '
+             'the end of each epoch')
+    parser.add_argument(
+        '--profile-trace',
+        help='The Chrome trace file a torch.profiler trace of a window of '
+             'steps is written to, enables --profile')
+    parser.add_argument(
+        '--profile-trace-start', type=int, default=10,
+        help='The number of steps skipped before the trace')
+    parser.add_argument(
+        '--profile-trace-steps', type=int, default=5,
+        help='The number of traced steps')
 
     args = parser.parse_args()
 